@@ -0,0 +1,401 @@
+"""
+Copyright 2022 Objectiv B.V.
+
+Fetch query results as Arrow tables, instead of as rows of Python objects.
+
+Reading a result with pandas.read_sql_query() creates a Python object for every value, which is slow and
+takes several times the memory of the final DataFrame for big results. The backends here get the result in
+Arrow's columnar format, and convert it to pandas in bulk:
+    * Postgres: with COPY ... TO STDOUT on a connection of the engine, the CSV output of which is parsed
+      with pyarrow's CSV reader.
+    * BigQuery: with the BigQuery Storage Read API. Requires the `google-cloud-bigquery-storage` package,
+      see the `bigquery` extra.
+
+:py:func:`read_sql_query` falls back to pandas.read_sql_query() if there is no backend for the database, if
+the sql consists of multiple statements (e.g. it creates temporary tables first), or if the result has
+columns of a dtype that is not in :py:data:`ARROW_DTYPES`, or of a database type that the backend doesn't
+support. For those dtypes the Arrow result converts to exactly the same pandas values as
+pandas.read_sql_query() gives.
+"""
+import io
+import tempfile
+from functools import lru_cache
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Union
+
+import pandas
+import pyarrow
+import pyarrow.csv
+from sqlalchemy.engine import Engine
+
+from bach.utils import escape_parameter_characters
+from sql_models.sql_query_parser import has_statement_separator
+from sql_models.util import is_bigquery, is_postgres, quote_identifier
+
+# Per database: bach dtypes of which the Arrow result gives the same pandas values as read_sql_query().
+# On BigQuery uuid and json are stored as strings, Series.to_pandas_info() converts them afterwards.
+ARROW_DTYPES = {
+    'postgresql': {'int64', 'float64', 'bool', 'string', 'date', 'timestamp'},
+    'bigquery': {'int64', 'float64', 'bool', 'string', 'date', 'timestamp', 'uuid', 'json'},
+}
+
+
+class _PostgresColumn(NamedTuple):
+    # sql expression that gives the value of the column in the COPY output, '{}' is the quoted column name
+    expression: str
+    # type to parse the CSV value as
+    csv_type: pyarrow.DataType
+    # type of the column in the result, the parsed value is cast to this
+    arrow_type: pyarrow.DataType
+
+
+# Postgres type oids of the columns that the Postgres backend supports, and how to get them in the same values
+# as psycopg2 gives: ints become int64, and floats and numerics (Decimals, which read_sql_query's coerce_float
+# converts) become float64. Dates and timestamps are exported as days and microseconds since the epoch, which
+# don't depend on the DateStyle and which pyarrow can parse without any loss of precision.
+_POSTGRES_COLUMNS = {
+    16: _PostgresColumn('{}', pyarrow.bool_(), pyarrow.bool_()),  # bool
+    20: _PostgresColumn('{}', pyarrow.int64(), pyarrow.int64()),  # int8
+    21: _PostgresColumn('{}', pyarrow.int64(), pyarrow.int64()),  # int2
+    23: _PostgresColumn('{}', pyarrow.int64(), pyarrow.int64()),  # int4
+    700: _PostgresColumn('{}', pyarrow.float64(), pyarrow.float64()),  # float4
+    701: _PostgresColumn('{}', pyarrow.float64(), pyarrow.float64()),  # float8
+    1700: _PostgresColumn('{}', pyarrow.float64(), pyarrow.float64()),  # numeric
+    19: _PostgresColumn('{}', pyarrow.string(), pyarrow.string()),  # name
+    25: _PostgresColumn('{}', pyarrow.string(), pyarrow.string()),  # text
+    1042: _PostgresColumn('{}', pyarrow.string(), pyarrow.string()),  # bpchar
+    1043: _PostgresColumn('{}', pyarrow.string(), pyarrow.string()),  # varchar
+    1082: _PostgresColumn(  # date
+        "{} - date '1970-01-01'",
+        pyarrow.int32(),
+        pyarrow.date32()
+    ),
+    1114: _PostgresColumn(  # timestamp
+        "(cast({0} as date) - date '1970-01-01') * cast(86400000000 as bigint)"
+        " + cast(round(extract(epoch from cast({0} as time)) * 1000000) as bigint)",
+        pyarrow.int64(),
+        pyarrow.timestamp('us')
+    ),
+}
+
+
+def read_sql_query(
+    engine: Engine,
+    sql: str,
+    dtype: Dict[str, str],
+    series_dtypes: Mapping[str, Any],
+    multi_statement: bool = False
+) -> pandas.DataFrame:
+    """
+    INTERNAL: Run the query, and give its result as a pandas DataFrame. Uses Arrow if possible, and
+    pandas.read_sql_query() otherwise.
+
+    :param engine: engine to run the query on.
+    :param sql: final SQL of the query, without escaped parameter characters.
+    :param dtype: mapping of column name to pandas dtype, for the columns that need a specific dtype.
+    :param series_dtypes: mapping of column name to bach dtype, for all the columns of the result.
+    :param multi_statement: whether the sql has statements before the final query, e.g. to create temporary
+        tables. Regardless of this, sql that contains multiple statements is never fetched with Arrow.
+    """
+    if not multi_statement and can_fetch_arrow(engine, sql, series_dtypes.values()):
+        try:
+            table = fetch_arrow_table(engine, sql)
+        except NotImplementedError:
+            # The result has a column of a database type that the backend doesn't support
+            pass
+        else:
+            return arrow_table_to_pandas(table, dtype=dtype)
+
+    with engine.connect() as conn:
+        # read_sql_query expects a parameterized query, so we need to escape the parameter characters
+        sql = escape_parameter_characters(conn, sql)
+        return pandas.read_sql_query(sql, conn, dtype=dtype)
+
+
+def read_sql_query_batches(
+    engine: Engine,
+    sql: str,
+    dtype: Dict[str, str],
+    series_dtypes: Mapping[str, Any],
+    batch_size: int,
+    multi_statement: bool = False
+) -> Iterator[pandas.DataFrame]:
+    """
+    INTERNAL: Run the query, and give its result as pandas DataFrames of batch_size rows, except for the last
+    batch, which can be smaller. The rows are fetched while iterating, with Arrow if possible and with a
+    server-side cursor otherwise. An empty result gives no DataFrames.
+
+    A server-side cursor can only run a single query. So for sql with multiple statements, all rows are
+    fetched at once with :py:func:`read_sql_query`, and then split in batches.
+
+    Parameters are the same as for :py:func:`read_sql_query`.
+    """
+    if multi_statement or has_statement_separator(sql):
+        pandas_df = read_sql_query(
+            engine, sql, dtype=dtype, series_dtypes=series_dtypes, multi_statement=True
+        )
+        for start in range(0, len(pandas_df), batch_size):
+            # Same index as the DataFrames of pandas.read_sql_query(chunksize=...)
+            yield pandas_df.iloc[start:start + batch_size].reset_index(drop=True)
+        return
+
+    if can_fetch_arrow(engine, sql, series_dtypes.values()):
+        try:
+            tables = fetch_arrow_tables(engine, sql, batch_size=batch_size)
+        except NotImplementedError:
+            # The result has a column of a database type that the backend doesn't support
+            pass
+        else:
+            for table in tables:
+                yield arrow_table_to_pandas(table, dtype=dtype)
+            return
+
+    # stream_results: Only fetch batch_size rows at a time from the database, instead of all rows at once
+    with engine.connect().execution_options(stream_results=True) as conn:
+        sql = escape_parameter_characters(conn, sql)
+        for pandas_df in pandas.read_sql_query(sql, conn, dtype=dtype, chunksize=batch_size):
+            # pandas gives a single empty DataFrame for an empty result
+            if len(pandas_df):
+                yield pandas_df
+
+
+def can_fetch_arrow(engine: Engine, sql: str, series_dtypes: Iterable[Any]) -> bool:
+    """
+    Determine whether the result of sql, with columns of the given bach dtypes, can be fetched as Arrow.
+    The Arrow backends can only run a single statement.
+    """
+    if is_postgres(engine):
+        supported_dtypes = ARROW_DTYPES['postgresql']
+    elif is_bigquery(engine):
+        if not _bigquery_storage_available():
+            return False
+        supported_dtypes = ARROW_DTYPES['bigquery']
+    else:
+        return False
+    # structured dtypes (e.g. of a SeriesDict) are not strings, and never supported
+    if not all(isinstance(dtype, str) and dtype in supported_dtypes for dtype in series_dtypes):
+        return False
+    return not has_statement_separator(sql)
+
+
+def fetch_arrow_table(engine: Engine, sql: str) -> pyarrow.Table:
+    """
+    Run the query, and give its result as an Arrow table.
+    :raise NotImplementedError: if there is no Arrow backend for the engine's database, or if the result has
+        a column of a type that the backend doesn't support.
+    """
+    if is_postgres(engine):
+        return _fetch_arrow_table_postgres(engine, sql)
+    if is_bigquery(engine) and _bigquery_storage_available():
+        return _fetch_arrow_table_bigquery(engine, sql)
+    raise NotImplementedError(f'Fetching Arrow results is not supported for {engine.name}')
+
+
+def fetch_arrow_tables(engine: Engine, sql: str, batch_size: int) -> Iterator[pyarrow.Table]:
+    """
+    Run the query, and give its result as Arrow tables of batch_size rows, except for the last table,
+    which can be smaller. An empty result gives no tables.
+    :raise NotImplementedError: if there is no Arrow backend for the engine's database, or if the result has
+        a column of a type that the backend doesn't support. This is raised by this call, not while iterating.
+    """
+    if is_postgres(engine):
+        batches = _fetch_arrow_batches_postgres(engine, sql)
+    elif is_bigquery(engine) and _bigquery_storage_available():
+        batches = _fetch_arrow_batches_bigquery(engine, sql)
+    else:
+        raise NotImplementedError(f'Fetching Arrow results is not supported for {engine.name}')
+    return _rebatch(batches, batch_size=batch_size)
+
+
+def _rebatch(batches: Iterable[pyarrow.RecordBatch], batch_size: int) -> Iterator[pyarrow.Table]:
+    """ Give the rows of batches as tables of batch_size rows, the batch size of the database can differ. """
+    if batch_size <= 0:
+        raise ValueError(f'batch_size should be positive, got {batch_size}')
+    pending: List[pyarrow.RecordBatch] = []
+    pending_rows = 0
+    for batch in batches:
+        while batch.num_rows:
+            row_count = min(batch_size - pending_rows, batch.num_rows)
+            pending.append(batch.slice(0, row_count))
+            pending_rows += row_count
+            batch = batch.slice(row_count)
+            if pending_rows == batch_size:
+                yield pyarrow.Table.from_batches(pending)
+                pending = []
+                pending_rows = 0
+    if pending:
+        yield pyarrow.Table.from_batches(pending)
+
+
+def arrow_table_to_pandas(table: pyarrow.Table, dtype: Optional[Dict[str, str]] = None) -> pandas.DataFrame:
+    """
+    Convert an Arrow table to a pandas DataFrame with the same dtypes that pandas.read_sql_query() gives,
+    for the column types that the databases return for the dtypes in ARROW_DTYPES.
+
+    :param table: query result.
+    :param dtype: mapping of column name to pandas dtype, for the columns that need a specific dtype.
+    """
+    table = pyarrow.Table.from_arrays(
+        [_normalize_column(column) for column in table.columns],
+        names=table.column_names
+    )
+    # Same as with read_sql_query(): integer columns with nulls become float64, and dates become objects
+    df = table.to_pandas(date_as_object=True)
+    if dtype:
+        df = df.astype(dtype)
+    return df
+
+
+def _normalize_column(column: pyarrow.ChunkedArray) -> pyarrow.ChunkedArray:
+    """
+    Cast column to the types that give the same pandas dtypes as the Python objects of the database drivers:
+    Python ints become int64, Python floats and Decimals (with read_sql_query's coerce_float) become float64.
+    """
+    arrow_type = column.type
+    if pyarrow.types.is_integer(arrow_type) and arrow_type != pyarrow.int64():
+        return column.cast(pyarrow.int64())
+    if pyarrow.types.is_floating(arrow_type) and arrow_type != pyarrow.float64():
+        return column.cast(pyarrow.float64())
+    if pyarrow.types.is_decimal(arrow_type):
+        return column.cast(pyarrow.float64())
+    return column
+
+
+def _copy_postgres_csv(engine: Engine, sql: str, file: BinaryIO) -> Dict[str, _PostgresColumn]:
+    """
+    Write the result of the query as CSV to file, without header. Gives the columns of the result, in the
+    order of the CSV.
+    :raise NotImplementedError: if the result has a column of a type that is not in _POSTGRES_COLUMNS.
+    """
+    raw_connection = engine.raw_connection()
+    try:
+        cursor = raw_connection.cursor()
+        try:
+            # Get the types of the columns, without running the query
+            cursor.execute(f'select * from ({sql}) as q limit 0')
+            columns = {}
+            for column_description in cursor.description:
+                name, type_code = column_description[0], column_description[1]
+                if type_code not in _POSTGRES_COLUMNS:
+                    raise NotImplementedError(f'Fetching Arrow results is not supported for column {name} '
+                                              f'of postgres type {type_code}')
+                columns[name] = _POSTGRES_COLUMNS[type_code]
+
+            expressions = ', '.join(
+                column.expression.format(quote_identifier(engine.dialect, name))
+                for name, column in columns.items()
+            )
+            copy_sql = f'copy (select {expressions} from ({sql}) as q) to stdout with (format csv)'
+            cursor.copy_expert(copy_sql, file)
+        finally:
+            cursor.close()
+    finally:
+        raw_connection.close()
+    return columns
+
+
+def _postgres_csv_options(columns: Dict[str, _PostgresColumn]) -> Dict[str, Any]:
+    """ Give the keyword arguments for pyarrow's CSV readers, for the COPY output of columns. """
+    return {
+        'read_options': pyarrow.csv.ReadOptions(column_names=list(columns.keys())),
+        'parse_options': pyarrow.csv.ParseOptions(newlines_in_values=True),
+        'convert_options': pyarrow.csv.ConvertOptions(
+            column_types={name: column.csv_type for name, column in columns.items()},
+            # COPY writes null as an empty value, and an empty string as a quoted empty value
+            null_values=[''],
+            strings_can_be_null=True,
+            quoted_strings_can_be_null=False,
+            true_values=['t'],
+            false_values=['f'],
+        ),
+    }
+
+
+def _cast_postgres_csv(
+    table: Union[pyarrow.Table, pyarrow.RecordBatch],
+    columns: Dict[str, _PostgresColumn]
+) -> Union[pyarrow.Table, pyarrow.RecordBatch]:
+    """ Cast the columns of a parsed table or record batch to the types of the result. """
+    arrays = [array.cast(column.arrow_type) for array, column in zip(table.columns, columns.values())]
+    return type(table).from_arrays(arrays, names=list(columns.keys()))
+
+
+def _empty_postgres_table(columns: Dict[str, _PostgresColumn]) -> pyarrow.Table:
+    # pyarrow's CSV readers refuse empty input
+    schema = pyarrow.schema([(name, column.arrow_type) for name, column in columns.items()])
+    return schema.empty_table()
+
+
+def _fetch_arrow_table_postgres(engine: Engine, sql: str) -> pyarrow.Table:
+    buffer = io.BytesIO()
+    columns = _copy_postgres_csv(engine, sql, buffer)
+    if not buffer.tell():
+        return _empty_postgres_table(columns)
+    buffer.seek(0)
+    table = pyarrow.csv.read_csv(buffer, **_postgres_csv_options(columns))
+    return _cast_postgres_csv(table, columns)
+
+
+def _fetch_arrow_batches_postgres(engine: Engine, sql: str) -> Iterator[pyarrow.RecordBatch]:
+    # The result is written to a temporary file, and parsed from there while iterating. So only a batch
+    # needs to fit in memory. Running the query happens here, such that unsupported column types are raised
+    # by this call.
+    file = tempfile.TemporaryFile()
+    try:
+        columns = _copy_postgres_csv(engine, sql, file)
+    except BaseException:
+        file.close()
+        raise
+    return _read_postgres_csv_batches(file, columns)
+
+
+def _read_postgres_csv_batches(
+    file: BinaryIO,
+    columns: Dict[str, _PostgresColumn]
+) -> Iterator[pyarrow.RecordBatch]:
+    with file:
+        if not file.tell():
+            return
+        file.seek(0)
+        reader = pyarrow.csv.open_csv(file, **_postgres_csv_options(columns))
+        for batch in reader:
+            yield _cast_postgres_csv(batch, columns)
+
+
+@lru_cache(maxsize=None)
+def _bigquery_storage_available() -> bool:
+    # Import on first use only, the BigQuery libraries are slow to import
+    try:
+        import google.cloud.bigquery_storage  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _fetch_arrow_table_bigquery(engine: Engine, sql: str) -> pyarrow.Table:
+    raw_connection = engine.raw_connection()
+    try:
+        # The DB-API connection of sqlalchemy-bigquery wraps the clients that it was configured with,
+        # including the default dataset of the engine's url.
+        dbapi_connection = getattr(raw_connection, 'dbapi_connection', None) or raw_connection.connection
+        client = dbapi_connection._client
+        bqstorage_client = dbapi_connection._bqstorage_client
+        query_job = client.query(sql)
+        return query_job.to_arrow(
+            bqstorage_client=bqstorage_client,
+            create_bqstorage_client=bqstorage_client is None
+        )
+    finally:
+        raw_connection.close()
+
+
+def _fetch_arrow_batches_bigquery(engine: Engine, sql: str) -> Iterator[pyarrow.RecordBatch]:
+    raw_connection = engine.raw_connection()
+    try:
+        # See _fetch_arrow_table_bigquery()
+        dbapi_connection = getattr(raw_connection, 'dbapi_connection', None) or raw_connection.connection
+        client = dbapi_connection._client
+        bqstorage_client = dbapi_connection._bqstorage_client
+        row_iterator = client.query(sql).result()
+        yield from row_iterator.to_arrow_iterable(bqstorage_client=bqstorage_client)
+    finally:
+        raw_connection.close()
@@ -5,22 +5,25 @@ from copy import copy
 
 from typing import (
     List, Set, Union, Dict, Any, Optional, Tuple,
-    cast, NamedTuple, TYPE_CHECKING, Callable, Hashable, Sequence, overload, Mapping,
+    cast, NamedTuple, TYPE_CHECKING, Callable, Hashable, Sequence, overload, Mapping, Iterator,
 )
 
 import numpy
 import pandas
 from sqlalchemy.engine import Engine
 
+from bach.arrow_fetch import read_sql_query, read_sql_query_batches
 from bach.expression import Expression, SingleValueExpression, VariableToken, ColumnReferenceToken
 from bach.from_database import get_dtypes_from_table, get_dtypes_from_model
 from bach.sql_model import BachSqlModel, CurrentNodeSqlModel, get_variable_values_sql
+from bach.query_cache import get_query_cache, get_table_names
 from bach.types import get_series_type_from_dtype, AllSupportedLiteralTypes, StructuredDtype
 from bach.utils import (
     escape_parameter_characters, validate_node_column_references_in_sorting_expressions, SortColumn
 )
 from sql_models.constants import NotSet, not_set
-from sql_models.graph_operations import update_placeholders_in_graph, get_all_placeholders
+from sql_models.graph_operations import update_placeholders_in_graph, get_all_placeholders, \
+    get_graph_nodes_info
 from sql_models.model import SqlModel, Materialization, CustomSqlModelBuilder, RefPath
 
 from sql_models.sql_generator import to_sql
@@ -1952,26 +1955,115 @@ class DataFrame:
         :returns: a pandas DataFrame.
 
         .. note::
-            This function queries the database.
+            This function queries the database, unless the query cache is enabled and has the result, see
+            :py:func:`bach.query_cache.enable_query_cache`.
         """
         sql = self.view_sql(limit=limit)
+        series_name_to_dtype = self._get_pandas_dtypes()
+
+        # The cache stores the raw query results, the post-processing below is applied after reading from it
+        query_cache = get_query_cache()
+        cache_key = None
+        pandas_df = None
+        if query_cache is not None:
+            cache_key = query_cache.get_key(
+                engine=self.engine,
+                sql=sql,
+                dtypes=series_name_to_dtype,
+                table_names=get_table_names(self.base_node)
+            )
+            pandas_df = query_cache.get(cache_key)
+
+        if pandas_df is None:
+            pandas_df = read_sql_query(
+                engine=self.engine,
+                sql=sql,
+                dtype=series_name_to_dtype,
+                series_dtypes=self._get_series_dtypes(),
+                multi_statement=self._has_temporary_statements()
+            )
+            if query_cache is not None and cache_key is not None:
+                query_cache.put(cache_key, pandas_df)
+
+        return self._post_process_pandas_df(pandas_df)
+
+    def to_pandas_batches(
+        self,
+        batch_size: int = 100_000,
+        limit: Union[int, slice] = None
+    ) -> Iterator[pandas.DataFrame]:
+        """
+        Run a SQL query representing the current state of this DataFrame against the database and return the
+        resulting data as Pandas DataFrames of `batch_size` rows each, except for the last one, which can be
+        smaller.
 
+        Rows are fetched from the database while iterating, so only one batch needs to fit in memory at a
+        time. The batches have the same dtypes and index as the result of :py:meth:`to_pandas`.
+        Exception: if the query needs temporary tables (see :py:meth:`materialize`), then all rows are fetched
+        at once, and split in batches afterwards.
+
+        Example: write a big DataFrame to a csv file
+
+        .. code-block:: python
+
+            for index, batch in enumerate(df.to_pandas_batches(batch_size=100_000)):
+                batch.to_csv('data.csv', mode='a', header=index == 0)
+
+        :param batch_size: maximum number of rows per batch.
+        :param limit: the limit to apply, either as a max amount of rows or a slice of the data.
+        :returns: an iterator over pandas DataFrames. An empty result gives no DataFrames.
+
+        .. note::
+            This function queries the database, the query cache is not used.
+        """
+        if batch_size <= 0:
+            raise ValueError(f'batch_size should be positive, got {batch_size}')
+        sql = self.view_sql(limit=limit)
+        batches = read_sql_query_batches(
+            engine=self.engine,
+            sql=sql,
+            dtype=self._get_pandas_dtypes(),
+            series_dtypes=self._get_series_dtypes(),
+            batch_size=batch_size,
+            multi_statement=self._has_temporary_statements()
+        )
+        for pandas_df in batches:
+            yield self._post_process_pandas_df(pandas_df)
+
+    def _get_series_dtypes(self) -> Dict[str, Any]:
+        """ Give the bach dtypes of the columns of the query results. """
+        return {series.name: series.dtype for series in self.all_series.values()}
+
+    def _has_temporary_statements(self) -> bool:
+        """
+        Determine whether the sql of view_sql() has statements before the final query: if the graph has
+        nodes that are statements without lasting effect, e.g. temporary tables.
+        """
+        return any(
+            node.model.materialization.is_statement and not node.model.materialization.has_lasting_effect
+            for node in get_graph_nodes_info(self.base_node)
+        )
+
+    def _get_pandas_dtypes(self) -> Dict[str, str]:
+        """ Give the pandas dtypes to use for the raw query results, for the columns that need one. """
         series_name_to_dtype = {}
         for series in self.all_series.values():
             pandas_info = series.to_pandas_info()
             if pandas_info is not None:
                 series_name_to_dtype[series.name] = pandas_info.dtype
+        return series_name_to_dtype
 
-        with self.engine.connect() as conn:
-            # read_sql_query expects a parameterized query, so we need to escape the parameter characters
-            sql = escape_parameter_characters(conn, sql)
-            pandas_df = pandas.read_sql_query(sql, conn, dtype=series_name_to_dtype)
-
+    def _post_process_pandas_df(self, pandas_df: pandas.DataFrame) -> pandas.DataFrame:
+        """ Convert raw query results to the values of this DataFrame's series, and set the index. """
         # Post-process any columns if needed. e.g. in BigQuery we represent UUIDs as text, so we convert
         # the strings that the query gives us into UUID objects
         for name, series in self.all_series.items():
             to_pandas_info = series.to_pandas_info()
-            if to_pandas_info is not None and to_pandas_info.function is not None:
+            if to_pandas_info is None:
+                continue
+            if to_pandas_info.series_function is not None:
+                pandas_df[name] = to_pandas_info.series_function(pandas_df[name])
+            elif to_pandas_info.function is not None:
                 pandas_df[name] = pandas_df[name].apply(to_pandas_info.function)
 
         if self.index:
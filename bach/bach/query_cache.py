@@ -0,0 +1,264 @@
+"""
+Copyright 2022 Objectiv B.V.
+
+Persistent cache for the results of the queries that :py:meth:`DataFrame.to_pandas()` executes.
+
+The cache is off by default, enable it with :py:func:`enable_query_cache`. Once enabled, each query result is
+stored as a Parquet file on local disk, and running the same query against the same database again returns
+the stored result without querying the database. This includes :py:meth:`DataFrame.head()`,
+:py:meth:`Series.to_pandas()`, :py:attr:`Series.value`, and everything else that is built on top of
+:py:meth:`DataFrame.to_pandas()`.
+
+An entry is found by a hash of:
+    * the final SQL of the query. As the values of all variables are filled in the SQL, a change in variable
+      values gives a different entry.
+    * the url of the database engine, without password.
+    * the requested pandas dtypes of the result columns.
+    * the versions of the tables used by :py:meth:`DataFrame.from_table()`, if set with
+      :py:meth:`QueryCache.set_table_version()`.
+
+The cache cannot tell whether the data in the database has changed. Results expire after `ttl_seconds`.
+Alternatively, bump the version of a table when its data changes, or call :py:meth:`QueryCache.clear()`.
+
+Results with object columns that Arrow cannot store without changing the values (e.g. dicts or lists from
+json columns on Postgres) are never cached, these always query the database.
+"""
+import hashlib
+import json
+import os
+import time
+import uuid
+from typing import Dict, Hashable, Iterable, List, Mapping, Optional, Tuple
+
+import pandas
+import pyarrow
+import pyarrow.parquet
+from sqlalchemy.engine import Engine
+
+from sql_models.graph_operations import get_graph_nodes_info
+from sql_models.model import SqlModel
+from sql_models.util import quote_identifier
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'objectiv-bach', 'query_results')
+DEFAULT_MAX_SIZE_BYTES = 1024 ** 3
+
+# Values that pandas.api.types.infer_dtype() gives for object columns that survive a round-trip through
+# Arrow without changes.
+_SAFE_OBJECT_TYPES = {'empty', 'string', 'bytes', 'date', 'time', 'decimal'}
+_FILE_EXTENSION = '.parquet'
+
+
+class QueryCache:
+    """
+    Directory with query results, keyed on a hash of the query. See the module documentation.
+
+    A file's modification time is the time it was stored, which is used for the ttl. A file's access time is
+    updated on every hit, which is used to evict the least recently used entries once the total size of the
+    directory exceeds `max_size_bytes`.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        max_size_bytes: int = DEFAULT_MAX_SIZE_BYTES,
+        ttl_seconds: Optional[float] = None
+    ):
+        """
+        :param path: directory to store the results in. Created if it doesn't exist.
+        :param max_size_bytes: maximum total size of all stored results.
+        :param ttl_seconds: optional number of seconds after which a stored result is not used anymore.
+            If not set, results are used until they are evicted, or invalidated.
+        """
+        if max_size_bytes <= 0:
+            raise ValueError(f'max_size_bytes should be positive, got {max_size_bytes}')
+        if ttl_seconds is not None and ttl_seconds <= 0:
+            raise ValueError(f'ttl_seconds should be positive, got {ttl_seconds}')
+        self.path = path
+        self.max_size_bytes = max_size_bytes
+        self.ttl_seconds = ttl_seconds
+        self._table_versions: Dict[str, Hashable] = {}
+        os.makedirs(path, exist_ok=True)
+
+    def set_table_version(self, table_name: str, version: Optional[Hashable]):
+        """
+        Set the version of a table, e.g. the time of its last update or the id of the last load job. Results
+        of queries on the table that were stored with a different version are not used anymore.
+
+        :param table_name: name of the table, as given to :py:meth:`DataFrame.from_table()`.
+        :param version: any value that changes if the data in the table changes. None removes the version.
+        """
+        if version is None:
+            self._table_versions.pop(table_name, None)
+        else:
+            self._table_versions[table_name] = version
+
+    def get_key(
+        self,
+        engine: Engine,
+        sql: str,
+        dtypes: Mapping[str, str],
+        table_names: Iterable[str] = ()
+    ) -> str:
+        """
+        Give the key of the result of a query.
+
+        :param engine: engine that the query runs on.
+        :param sql: final SQL of the query.
+        :param dtypes: pandas dtypes that are requested for the columns of the result.
+        :param table_names: quoted names of the tables that the query selects from, see
+            :py:func:`get_table_names`. Only the tables for which a version has been set affect the key.
+        """
+        table_names = set(table_names)
+        table_versions = sorted(
+            (name, repr(version)) for name, version in self._table_versions.items()
+            if quote_identifier(engine.dialect, name) in table_names
+        )
+        key_data = json.dumps([
+            _get_engine_url(engine),
+            sql,
+            sorted((name, str(dtype)) for name, dtype in dtypes.items()),
+            table_versions
+        ])
+        return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[pandas.DataFrame]:
+        """ Give the stored result for key, or None if there is none or it has expired. """
+        file_path = self._get_file_path(key)
+        try:
+            stat = os.stat(file_path)
+            if self._is_expired(stat.st_mtime):
+                os.remove(file_path)
+                return None
+            table = pyarrow.parquet.read_table(file_path)
+            # Mark the entry as recently used, keep the modification time for the ttl.
+            os.utime(file_path, (time.time(), stat.st_mtime))
+        except FileNotFoundError:
+            # Not stored, or evicted by another process between the calls above.
+            return None
+        return table.to_pandas()
+
+    def put(self, key: str, df: pandas.DataFrame) -> bool:
+        """
+        Store df as the result for key, and evict the least recently used results if the cache is too big.
+
+        :returns: True if the result has been stored, False if it cannot be stored.
+        """
+        if not is_cacheable(df):
+            return False
+        table = pyarrow.Table.from_pandas(df, preserve_index=False)
+        file_path = self._get_file_path(key)
+        # Write to a temporary file first, so other processes never read a partially written file.
+        tmp_path = f'{file_path}.{uuid.uuid4().hex}.tmp'
+        try:
+            pyarrow.parquet.write_table(table, tmp_path, compression='zstd')
+            if os.path.getsize(tmp_path) > self.max_size_bytes:
+                return False
+            os.replace(tmp_path, file_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._evict()
+        return True
+
+    def clear(self):
+        """ Remove all stored results. """
+        for file_path, _stat in self._list_entries():
+            _remove_if_exists(file_path)
+
+    def _get_file_path(self, key: str) -> str:
+        return os.path.join(self.path, f'{key}{_FILE_EXTENSION}')
+
+    def _is_expired(self, stored_time: float) -> bool:
+        return self.ttl_seconds is not None and time.time() - stored_time > self.ttl_seconds
+
+    def _list_entries(self) -> List[Tuple[str, os.stat_result]]:
+        entries = []
+        with os.scandir(self.path) as iterator:
+            for entry in iterator:
+                if entry.name.endswith(_FILE_EXTENSION):
+                    try:
+                        entries.append((entry.path, entry.stat()))
+                    except FileNotFoundError:
+                        pass
+        return entries
+
+    def _evict(self):
+        """ Remove expired results, and the least recently used results until the total size fits. """
+        entries = []
+        for file_path, stat in self._list_entries():
+            if self._is_expired(stat.st_mtime):
+                _remove_if_exists(file_path)
+            else:
+                entries.append((file_path, stat))
+        total_size = sum(stat.st_size for _file_path, stat in entries)
+        for file_path, stat in sorted(entries, key=lambda item: item[1].st_atime):
+            if total_size <= self.max_size_bytes:
+                break
+            _remove_if_exists(file_path)
+            total_size -= stat.st_size
+
+
+_QUERY_CACHE: Optional[QueryCache] = None
+
+
+def enable_query_cache(
+    path: str = DEFAULT_CACHE_PATH,
+    max_size_bytes: int = DEFAULT_MAX_SIZE_BYTES,
+    ttl_seconds: Optional[float] = None
+) -> QueryCache:
+    """
+    Cache the results of :py:meth:`DataFrame.to_pandas()` on disk, see :py:mod:`bach.query_cache`.
+
+    :param path: directory to store the results in. Created if it doesn't exist.
+    :param max_size_bytes: maximum total size of all stored results, the least recently used results are
+        removed if the total size is bigger.
+    :param ttl_seconds: optional number of seconds after which a stored result is not used anymore.
+    :returns: the cache, which can be used to invalidate results.
+    """
+    global _QUERY_CACHE
+    _QUERY_CACHE = QueryCache(path=path, max_size_bytes=max_size_bytes, ttl_seconds=ttl_seconds)
+    return _QUERY_CACHE
+
+
+def disable_query_cache():
+    """ Stop using the query cache. Results that are already stored are kept on disk. """
+    global _QUERY_CACHE
+    _QUERY_CACHE = None
+
+
+def get_query_cache() -> Optional[QueryCache]:
+    """ Give the query cache, or None if it is not enabled. """
+    return _QUERY_CACHE
+
+
+def is_cacheable(df: pandas.DataFrame) -> bool:
+    """ Determine whether df can be stored and read back from Parquet without changing any of the values. """
+    for _name, column in df.items():
+        if column.dtype == object and pandas.api.types.infer_dtype(column) not in _SAFE_OBJECT_TYPES:
+            return False
+    return True
+
+
+def get_table_names(start_node: SqlModel) -> List[str]:
+    """
+    INTERNAL: Give the quoted names of the tables that the graph of start_node selects from with
+    :py:meth:`DataFrame.from_table()`.
+    """
+    return [
+        str(node.model.placeholders['table_name'])
+        for node in get_graph_nodes_info(start_node)
+        if node.model.generic_name == 'from_table'
+    ]
+
+
+def _get_engine_url(engine: Engine) -> str:
+    if hasattr(engine.url, 'render_as_string'):
+        return engine.url.render_as_string(hide_password=True)
+    return str(engine.url)
+
+
+def _remove_if_exists(file_path: str):
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
@@ -2,13 +2,15 @@
 Copyright 2021 Objectiv B.V.
 """
 import re
-from typing import NamedTuple, Dict, List, Union, cast
+from functools import partial
+from typing import NamedTuple, Dict, List, Union, cast, Callable
 
 from sqlalchemy.engine import Engine, Dialect
 
 from bach import DataFrame
 from bach.sql_model import BachSqlModel
-from sql_models.model import Materialization, SqlModel, CustomSqlModelBuilder
+from sql_models.graph_operations import update_nodes_in_graph
+from sql_models.model import Materialization, SqlModel, CustomSqlModelBuilder, RefPath
 from sql_models.sql_generator import to_sql_materialized_nodes, GeneratedSqlStatement
 from sql_models.util import quote_identifier
 
@@ -252,12 +254,12 @@ class Savepoints:
         # Create one graph with all entries
         graph = _get_virtual_node(references)
 
-        # Now update all the nodes that represent an entry, to have the correct materialization
-        for entry in entries:
-            reference_path = (f'ref_{entry.name}', )
-            graph = graph.set_materialization_name(reference_path, materialization_name=entry.name)
-            graph = graph.set_materialization(reference_path, materialization=entry.materialization)
-        return graph
+        # Now update all the nodes that represent an entry, to have the correct materialization. Do this
+        # in a single pass over the graph, instead of a pass per entry.
+        update_functions: Dict[RefPath, Callable[[SqlModel], SqlModel]] = {
+            (f'ref_{entry.name}', ): partial(_set_entry_materialization, entry=entry) for entry in entries
+        }
+        return update_nodes_in_graph(graph, update_functions)
 
     def __str__(self) -> str:
         """ Give string with overview of all savepoints per materialization. """
@@ -292,3 +294,8 @@ def _get_virtual_node(references: Dict[str, BachSqlModel]) -> SqlModel:
         .set_materialization(Materialization.VIRTUAL_NODE)\
         .set_values(**references)\
         .instantiate()
+
+
+def _set_entry_materialization(model: SqlModel, entry: SavepointEntry) -> SqlModel:
+    """ Give a copy of model with the materialization and materialization_name of the savepoint entry. """
+    return model.copy_override(materialization=entry.materialization, materialization_name=entry.name)
@@ -4,7 +4,7 @@ Copyright 2021 Objectiv B.V.
 from abc import ABC, abstractmethod
 from copy import copy, deepcopy
 from typing import Optional, Dict, Tuple, Union, Type, Any, List, cast, TYPE_CHECKING, Callable, Mapping, \
-    TypeVar, Sequence, NamedTuple
+    TypeVar, Sequence, NamedTuple, Iterator
 from uuid import UUID
 
 import numpy
@@ -41,9 +41,13 @@ WrappedWindow = Union['Window', 'DataFrame']
 class ToPandasInfo(NamedTuple):
     """
     INTERNAL: Used to encode how to go from raw database result to pandas object, see Series.to_pandas_info.
+
+    If set, series_function is applied to the whole column at once, instead of applying function to each
+    value. Prefer series_function for conversions that pandas can do vectorized.
     """
     dtype: str
     function: Optional[Callable[[Any], Any]]
+    series_function: Optional[Callable[[pandas.Series], pandas.Series]] = None
 
 
 class Series(ABC):
@@ -572,8 +576,9 @@ class Series(ABC):
         Subclasses can override this function as needed. By default, this returns None.
 
         ToPandasInfo defines both the pandas-dtype of the data, and an optional function to apply to query
-        results. If defined for a given DBDialect, we use this information in :meth:`DataFrame.to_pandas()`,
-        by setting the dtype and applying the function to columns of the resulting pandas DataFrame.
+        results, either per value or per column. If defined for a given DBDialect, we use this information
+        in :meth:`DataFrame.to_pandas()`, by setting the dtype and applying the function to columns of the
+        resulting pandas DataFrame.
 
         Example usage: UUIDs in BigQuery are represented as strings, we convert these strings to UUID
         objects in to_pandas().
@@ -744,6 +749,21 @@ class Series(ABC):
         """
         return self.to_frame().to_pandas(limit=limit)[self.name]
 
+    def to_pandas_batches(
+        self,
+        batch_size: int = 100_000,
+        limit: Union[int, slice] = None
+    ) -> Iterator[pandas.Series]:
+        """
+        Get the data from this series as pandas.Series of `batch_size` rows each, fetched from the database
+        while iterating. See :py:meth:`DataFrame.to_pandas_batches`.
+
+        :param batch_size: maximum number of rows per batch.
+        :param limit: The limit to apply, either as a max amount of rows or a slice.
+        """
+        for pandas_df in self.to_frame().to_pandas_batches(batch_size=batch_size, limit=limit):
+            yield pandas_df[self.name]
+
     def head(self, n: int = 5) -> pandas.Series:
         """
         Get the first n rows from this Series as a pandas.Series.
@@ -342,10 +342,9 @@ class SeriesAbstractDateTime(Series, ABC):
             return series
 
 
-def dt_strip_timezone(value: Optional[datetime.datetime]) -> Optional[datetime.datetime]:
-    if value is None:
-        return None
-    return value.replace(tzinfo=None)
+def dt_strip_timezone(series: pandas.Series) -> pandas.Series:
+    """ Remove the timezone from a datetime64 series with a timezone, keeping the local times. """
+    return series.dt.tz_localize(None)
 
 
 class SeriesTimestamp(SeriesAbstractDateTime):
@@ -421,7 +420,7 @@ class SeriesTimestamp(SeriesAbstractDateTime):
         if is_postgres(self.engine):
             return ToPandasInfo('datetime64[ns]', None)
         if is_bigquery(self.engine):
-            return ToPandasInfo('datetime64[ns, UTC]', dt_strip_timezone)
+            return ToPandasInfo('datetime64[ns, UTC]', None, series_function=dt_strip_timezone)
         return None
 
     def __add__(self, other) -> 'Series':
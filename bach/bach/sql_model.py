@@ -80,7 +80,7 @@ class BachSqlModel(SqlModel[T]):
             self.materialization_name if materialization_name is not_set else materialization_name
         )
         return self.__class__(
-            model_spec=self.model_spec if model_spec is None else model_spec,
+            model_spec=self._model_spec if model_spec is None else model_spec,
             placeholders=self.placeholders if placeholders is None else placeholders,
             references=self.references if references is None else references,
             materialization=self.materialization if materialization is None else materialization,
@@ -160,7 +160,7 @@ class SampleSqlModel(BachSqlModel):
         materialization_name_value = \
             self.materialization_name if materialization_name is not_set else materialization_name
         return self.__class__(
-            model_spec=self.model_spec if model_spec is None else model_spec,
+            model_spec=self._model_spec if model_spec is None else model_spec,
             placeholders=self.placeholders if placeholders is None else placeholders,
             references=self.references if references is None else references,
             materialization=self.materialization if materialization is None else materialization,
@@ -0,0 +1,109 @@
+"""
+Copyright 2022 Objectiv B.V.
+
+Benchmark of rewriting SqlModel graphs of hundreds of nodes, as done by DataFrame.view_sql() and
+DataFrame.to_pandas() when setting variables, and by Savepoints when combining the graphs of all savepoints.
+
+Compares:
+ * per node: update the nodes one at a time with SqlModel.set() and SqlModel.set_materialization(). Every
+   update is a pass over the graph. This is how update_placeholders_in_graph() and
+   Savepoints._get_combined_graph() worked before there were batched rewrites.
+ * batched: update_placeholders_in_graph() and update_nodes_in_graph(), which update all nodes in a single
+   pass over the graph.
+
+Usage, from the bach directory:
+    PYTHONPATH=. python benchmarks/bench_graph_operations.py [--nodes 100 200 400 800] [--repeat 3]
+"""
+import argparse
+import random
+import sys
+import time
+from typing import Callable, List
+
+from sql_models.graph_operations import find_nodes, update_placeholders_in_graph, update_nodes_in_graph, \
+    get_graph_nodes_info
+from sql_models.model import CustomSqlModelBuilder, Materialization, SqlModel
+
+
+def make_graph(node_count: int, seed: int = 0) -> SqlModel:
+    """
+    Give the last node of a graph of node_count nodes. Every node has a placeholder 'val', and refers up to
+    three earlier nodes, mostly recent ones, such that the graph has long paths with many shared nodes,
+    like the graphs of DataFrames that are merged and aggregated in many steps.
+    """
+    rng = random.Random(seed)
+    nodes: List[SqlModel] = []
+    for i in range(node_count):
+        reference_count = min(len(nodes), rng.randint(1, 3))
+        references = {
+            f'ref_{j}': nodes[max(0, len(nodes) - 1 - int(rng.expovariate(0.2)))]
+            for j in range(reference_count)
+        }
+        sql = 'select {val} as value'
+        sql += ''.join(f' union all select * from {{{{{name}}}}}' for name in references)
+        builder = CustomSqlModelBuilder(sql=sql, name=f'node_{i}')
+        nodes.append(builder(val=rng.randint(0, 9), **references))
+    return nodes[-1]
+
+
+def _update_placeholders_per_node(graph: SqlModel) -> SqlModel:
+    for found_node in find_nodes(graph, function=lambda node: 'val' in node.placeholders):
+        graph = graph.set(found_node.reference_path, val=-1)
+    return graph
+
+
+def _update_placeholders_batched(graph: SqlModel) -> SqlModel:
+    return update_placeholders_in_graph(graph, {'val': -1})
+
+
+def _materialize_per_node(graph: SqlModel) -> SqlModel:
+    for found_node in find_nodes(graph, function=lambda node: True)[1::10]:
+        graph = graph.set_materialization(found_node.reference_path, Materialization.TABLE)
+    return graph
+
+
+def _materialize_batched(graph: SqlModel) -> SqlModel:
+    update_functions = {
+        found_node.reference_path: lambda node: node.copy_set_materialization(Materialization.TABLE)
+        for found_node in find_nodes(graph, function=lambda node: True)[1::10]
+    }
+    return update_nodes_in_graph(graph, update_functions)
+
+
+def _seconds_per_run(function: Callable[[SqlModel], SqlModel], graph: SqlModel, repeat: int) -> float:
+    """ Run function on graph, repeat times. Return the seconds of the fastest run. """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(graph)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark rewriting SqlModel graphs')
+    parser.add_argument('--nodes', type=int, nargs='+', default=[100, 200, 400, 800],
+                        help='number of nodes of the graphs')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs, the fastest run is reported')
+    args = parser.parse_args(sys.argv[1:])
+
+    benchmarks = [
+        ('update all placeholders', _update_placeholders_per_node, _update_placeholders_batched),
+        ('materialize every 10th node', _materialize_per_node, _materialize_batched),
+    ]
+    print(f'{"":28} {"nodes":>6} {"per node (ms)":>14} {"batched (ms)":>13} {"speed-up":>9}')
+    for node_count in args.nodes:
+        graph = make_graph(node_count)
+        # Not all nodes that make_graph() creates are necessarily referenced by the last node
+        node_count = len(get_graph_nodes_info(graph))
+        for name, per_node_function, batched_function in benchmarks:
+            if per_node_function(graph).hash != batched_function(graph).hash:
+                raise Exception(f'{name}: per node and batched give different graphs')
+            per_node = _seconds_per_run(per_node_function, graph, args.repeat)
+            batched = _seconds_per_run(batched_function, graph, args.repeat)
+            print(f'{name:28} {node_count:>6} {per_node * 1000:>14.1f} {batched * 1000:>13.1f} '
+                  f'{per_node / batched:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
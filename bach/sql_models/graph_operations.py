@@ -3,7 +3,7 @@ Copyright 2021 Objectiv B.V.
 """
 from collections import deque
 from typing import NamedTuple, List, Dict, Set, Tuple, Optional, Callable, Deque, Hashable, Mapping,\
-    TypeVar,  Union
+    TypeVar,  Union, cast
 
 from sql_models.model import SqlModel, RefPath
 
@@ -44,6 +44,8 @@ def get_graph_nodes_info(start_node: SqlModel) -> List[NodeInfo]:
     :return: List of NodeInfo objects.
     """
     nodes: Dict[int, NodeInfo] = {}
+    # id() pairs of the referencing and the referenced model of all edges that are in nodes already
+    edges: Set[Tuple[int, int]] = set()
     # stack contains the models to process. Each entry contains two models:
     # 1) reference_path to the current model
     # 2) the model that referenced the current model
@@ -71,9 +73,11 @@ def get_graph_nodes_info(start_node: SqlModel) -> List[NodeInfo]:
         current_node = nodes[current_id]
         if referencing_model is not None:
             referencing_id = id(referencing_model)
-            referencing_node = nodes[referencing_id]
-            _add_node_to_node_list(current_node.out_edges, referencing_node)
-            _add_node_to_node_list(referencing_node.in_edges, current_node)
+            if (referencing_id, current_id) not in edges:
+                edges.add((referencing_id, current_id))
+                referencing_node = nodes[referencing_id]
+                current_node.out_edges.append(referencing_node)
+                referencing_node.in_edges.append(current_node)
     return [node for node in nodes.values()][::-1]  # reverse list
 
 
@@ -224,26 +228,19 @@ def update_placeholders_in_graph(
     :param placeholder_values: Dictionary mapping placeholder names to new values.
     :return: Updated copy of the start_node. If nothing needs to be updated, then the start_node unchanged.
     """
-    find_keys = set(placeholder_values.keys())
-
-    def filter_function(node: SqlModel) -> bool:
-        filter_node_keys = set(node.placeholders.keys())
-        return bool(find_keys.intersection(filter_node_keys))
-
-    found_nodes = find_nodes(start_node, function=filter_function)
-    for found_node in found_nodes:
-        node_keys = set(found_node.model.placeholders.keys())
-        matching_keys = find_keys.intersection(node_keys)
+    def update_function(original: SqlModel, node: SqlModel) -> SqlModel:
+        node_placeholders = node.placeholders
         dict_to_update = {
-            key: placeholder_values[key]
-            for key in matching_keys if found_node.model.placeholders[key] != placeholder_values[key]
+            key: value for key, value in placeholder_values.items()
+            if key in node_placeholders and node_placeholders[key] != value
         }
         if not dict_to_update:
-            continue
-        new_dict = found_node.model.placeholders
-        new_dict.update(dict_to_update)
-        start_node = start_node.set(found_node.reference_path, **new_dict)
-    return start_node
+            return node
+        return node.copy_set(dict_to_update)
+
+    result = _rewrite_graph(start_node, replacements={}, update_function=update_function)
+    # copy_link() and copy_set() return an instance of the same class, so the type of start_node is kept
+    return cast(TSqlModel, result)
 
 
 def replace_node_in_graph(
@@ -264,20 +261,7 @@ def replace_node_in_graph(
     """
     if reference_path == tuple():
         return replacement_model
-
-    selected_node = get_node_info_selected_node(start_node, reference_path)
-    dependent_model_ids = _get_all_dependent_node_model_ids(selected_node)
-    # the dependent_model_ids are guaranteed to uniquely identify python objects as long as those objects
-    # exist. We still have a reference to the start node here, so all objects that are being replaced are
-    # guaranteed to still exist at the end of this function, ergo we can safely use dependent_model_ids to
-    # identify python objects.
-    return _replace_model_in_graph_recursively(
-        current_node=start_node,
-        model_to_replace=selected_node.model,
-        replacement_node=replacement_model,
-        dependent_model_ids=dependent_model_ids,
-        replaced_models={}
-    )
+    return replace_non_start_node_in_graph(start_node, reference_path, replacement_model)
 
 
 def replace_non_start_node_in_graph(
@@ -301,94 +285,120 @@ def replace_non_start_node_in_graph(
     """
     if reference_path == tuple():
         raise ValueError(f'reference path cannot be empty, use replace_node_in_graph() instead.')
-    selected_node = get_node_info_selected_node(start_node, reference_path)
-    dependent_model_ids = _get_all_dependent_node_model_ids(selected_node)
-    # See replace_node_in_graph() for more comments on the implementation
-    return _replace_model_in_graph_recursively(
-        current_node=start_node,
-        model_to_replace=selected_node.model,
-        replacement_node=replacement_model,
-        dependent_model_ids=dependent_model_ids,
-        replaced_models={}
-    )
-
-
-def _replace_model_in_graph_recursively(
-        current_node: TSqlModel,
-        model_to_replace: SqlModel,
-        replacement_node: SqlModel,
-        dependent_model_ids: Set[int],
-        replaced_models: Dict[int, SqlModel]
-) -> TSqlModel:
+    result = replace_nodes_in_graph(start_node, {reference_path: replacement_model})
+    # The start_node itself is not replaced, so the result is start_node or a copy of it
+    return cast(TSqlModel, result)
+
+
+def replace_nodes_in_graph(
+        start_node: SqlModel,
+        replacements: Mapping[RefPath, SqlModel]) -> SqlModel:
     """
-    Return the a copy of current_node, with the recursively referenced nodes of the original replaced by
-        copies too. The replacement_node is not replaced by a copy but by replacement_node.
-    Only nodes in dependent_model_ids are copied/updated, for others the original nodes are linked.
-
-    Effectively this can be used to replace a single node, and create a new graph that references that
-    updated node.
-
-    Important limitation: current_node cannot be the same as model_to_replace!
-
-    :param current_node: current node, copy of this node will be returned.
-    :param model_to_replace: model that should be replaced.
-    :param replacement_node: Replacement for the node that is identified by replacement_ref_path.
-    :param dependent_model_ids: Set of id() of the python objects that should be updated.
-    :param replaced_models: dictionary mapping the python instance id() of old nodes to the new version of
-        already updated nodes. This is used to make sure we only create one replacement node for each node,
-        even if that node is referenced multiple times. This dictionary will be updated by this function.
-    :return: copy of current-node, with referred nodes copied and updated too.
+    Batched version of :meth:`replace_node_in_graph()`: create a (partial) copy of the graph that can be
+    reached from start_node, with all the referenced nodes replaced by their replacement model.
+
+    Replacing the nodes one at a time takes a pass over the graph per node, this takes a single pass. All
+    nodes along all reference paths to the referenced nodes will be replaced with copies of the original
+    nodes that (indirectly) link to the replacement models. Replacement models are used as given; if a
+    replaced node is the only path to another referenced node, then that other replacement is not used.
+    If multiple reference paths lead to the same node, then the replacement of the last path is used.
+
+    The original start node, and all nodes that it refers recursively are unchanged.
+    :param start_node: start node
+    :param replacements: mapping of reference path to the model that will replace the referenced node
+    :return: an updated copy of the start node, or the start node itself if no node is replaced by
+        another model. The replacement model if replacements contains an empty reference path.
+    :raise ValueError: if one of the reference paths doesn't exist
     """
-    if current_node is model_to_replace:
-        # For a basic recursive function this would be the base case, and we'd return here. But as we want to
-        # guarantee to return the same type as current_node, we disallow this and handle the base case below
-        raise Exception('Function should only be used for the recursive case.')
-    new_references = {}
-    for ref_name, ref_node in current_node.references.items():
-        node_id = id(ref_node)
-        if node_id in dependent_model_ids:
-            if node_id in replaced_models:
-                # cached case
-                new_references[ref_name] = replaced_models[node_id]
-            elif ref_node is model_to_replace:
-                # base case
-                new_references[ref_name] = replacement_node
-            else:
-                # recursive case
-                new_references[ref_name] = _replace_model_in_graph_recursively(
-                    current_node=ref_node,
-                    model_to_replace=model_to_replace,
-                    replacement_node=replacement_node,
-                    dependent_model_ids=dependent_model_ids,
-                    replaced_models=replaced_models
-                )
-                replaced_models[node_id] = new_references[ref_name]
-    return current_node.copy_link(new_references=new_references)
-
-
-def _get_all_dependent_node_model_ids(node: NodeInfo) -> Set[int]:
+    replacements_by_id = {
+        id(get_node(start_node, reference_path)): replacement_model
+        for reference_path, replacement_model in replacements.items()
+    }
+    return _rewrite_graph(start_node, replacements=replacements_by_id, update_function=_keep_node)
+
+
+def update_nodes_in_graph(
+        start_node: SqlModel,
+        update_functions: Mapping[RefPath, Callable[[SqlModel], SqlModel]]) -> SqlModel:
     """
-    Get all nodes that recursively refer the given node, and the given node itself.
-    The returned nodes are identified by the id() of the their model.
+    Create a (partial) copy of the graph that can be reached from start_node, with the referenced nodes
+    updated by their update function, in a single pass over the graph.
 
-    Python's id() uniquely identifies an object during it's lifetime [1]. So the results of this function
-    can be used to identify dependent models in a graph, but only as long as all model instances in the
-    graph still exist.
+    The graph is updated bottom-up: an update function gets a copy of the referenced node that already links
+    to the updated versions of the nodes that it refers, and returns the updated node, e.g.
+    `lambda node: node.copy_set_materialization(Materialization.TABLE)`. This gives the same result as
+    updating the nodes one at a time with e.g. :meth:`SqlModel.set_materialization()`, regardless of the
+    order. If multiple reference paths lead to the same node, then their update functions are applied in
+    the order of update_functions.
 
-    [1] https://docs.python.org/3/library/functions.html#id
+    The original start node, and all nodes that it refers recursively are unchanged.
+    :param start_node: start node
+    :param update_functions: mapping of reference path to the function that updates the referenced node
+    :return: an updated copy of the start node, or the start node itself if nothing is updated. If
+        update_functions contains an empty reference path, then the result of that update function.
+    :raise ValueError: if one of the reference paths doesn't exist
     """
-    dependent_ids: Set[int] = {id(node.model)}
-    out_edges: List[NodeInfo] = node.out_edges
-    while out_edges:
-        out_edge = out_edges.pop()
-        model_id = id(out_edge.model)
-        if model_id not in dependent_ids:
-            dependent_ids.add(model_id)
-            out_edges.extend(out_edge.out_edges)
-    return dependent_ids
-
-
-def _add_node_to_node_list(node_list: List[NodeInfo], node: NodeInfo):
-    """ Add node to node_list, if there is no node yet with the same node-id. """
-    if all(id(node) != id(list_entry) for list_entry in node_list):
-        node_list.append(node)
+    functions_by_id: Dict[int, List[Callable[[SqlModel], SqlModel]]] = {}
+    for reference_path, update_function in update_functions.items():
+        node = get_node(start_node, reference_path)
+        functions_by_id.setdefault(id(node), []).append(update_function)
+
+    def update_node(original: SqlModel, node: SqlModel) -> SqlModel:
+        for function in functions_by_id.get(id(original), []):
+            node = function(node)
+        return node
+
+    return _rewrite_graph(start_node, replacements={}, update_function=update_node)
+
+
+def _rewrite_graph(
+        start_node: SqlModel,
+        replacements: Mapping[int, SqlModel],
+        update_function: Callable[[SqlModel, SqlModel], SqlModel]
+) -> SqlModel:
+    """
+    Rewrite the graph that can be reached from start_node in a single bottom-up pass, and return the
+    rewritten start_node.
+
+    Every model in the graph is visited once, after the models that it refers. Models in replacements are
+    replaced by their replacement, the graph below them is not visited. For all other models,
+    update_function gets the original model and the model with its references updated (the original
+    model if none of its references changed), and returns the model to use. Models that are not replaced
+    or updated, and for which none of the references are, are kept as-is.
+
+    :param start_node: start node
+    :param replacements: dictionary mapping the python instance id() of models in the graph to their
+        replacement. As we keep a reference to start_node, all models in the graph exist during the
+        whole rewrite, ergo the id()s uniquely identify them.
+    :param update_function: function that gets the original model and the model with updated references,
+        and returns the model to use in the rewritten graph.
+    :return: the rewritten start_node
+    """
+    # rewritten maps the id() of the original models to their rewritten version
+    rewritten: Dict[int, SqlModel] = {}
+    # stack contains the models to process, and whether the models they refer have been processed
+    stack: List[Tuple[SqlModel, bool]] = [(start_node, False)]
+    while stack:
+        model, references_done = stack.pop()
+        model_id = id(model)
+        if model_id in rewritten:
+            continue
+        if model_id in replacements:
+            rewritten[model_id] = replacements[model_id]
+            continue
+        references = model.references
+        if not references_done:
+            stack.append((model, True))
+            stack.extend((reference, False) for reference in references.values())
+            continue
+        new_references = {
+            ref_name: rewritten[id(reference)] for ref_name, reference in references.items()
+            if rewritten[id(reference)] is not reference
+        }
+        node = model.copy_link(new_references=new_references) if new_references else model
+        rewritten[model_id] = update_function(model, node)
+    return rewritten[id(start_node)]
+
+
+def _keep_node(original: SqlModel, node: SqlModel) -> SqlModel:
+    return node
@@ -500,11 +500,15 @@ class SqlModel(Generic[T]):
 
         Note that as None is a valid value for materialization_name, therefore we use the special token
         `not_set` to mean "keep current value".
+
+        The copy shares the model_spec with this instance. The model_spec property gives a deep copy,
+        which for an SqlModelBuilder includes copies of all the models it refers, and copying all of
+        those for every updated node would make graph operations quadratic in the size of the graph.
         """
         materialization_name_value = \
             self.materialization_name if materialization_name is not_set else materialization_name
         return self.__class__(
-            model_spec=self.model_spec if model_spec is None else model_spec,
+            model_spec=self._model_spec if model_spec is None else model_spec,
             placeholders=self.placeholders if placeholders is None else placeholders,
             references=self.references if references is None else references,
             materialization=self.materialization if materialization is None else materialization,
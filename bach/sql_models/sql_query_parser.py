@@ -1,7 +1,8 @@
 """
 Copyright 2021 Objectiv B.V.
 """
-from typing import NamedTuple, Optional, List
+import re
+from typing import NamedTuple, Optional, List, Iterator, Tuple
 
 import sqlparse
 from sqlparse.sql import TokenList, Token
@@ -12,6 +13,39 @@ class CteTuple(NamedTuple):
     select_sql: str
 
 
+# Tokens that matter for finding the CTE boundaries. The rules follow sqlparse's lexer, such that the
+# boundaries are the same as sqlparse would find: everything that sqlparse lexes as a single token that
+# can contain parentheses, quotes or words (comments, quoted strings and identifiers, placeholders, etc.)
+# is a single token here too.
+_TOKEN_REGEX = re.compile(
+    r"""
+    (?P<whitespace>\s+)
+    |(?P<comment>(?:--|\#\ ).*?(?:\r\n|\r|\n|$)|/\*[\s\S]*?\*/)
+    |(?P<quoted>
+        `(?:``|[^`])*`
+        |´(?:´´|[^´])*´
+        |(?<![\w"$])(?P<dollar_tag>\$(?:[_A-ZÀ-Ü]\w*)?\$)[\s\S]*?(?P=dollar_tag)
+        |'(?:''|\\'|[^'])*'
+        |"(?:""|\\"|[^"])*"
+        |""|".*?[^\\]"
+        |(?<![\w\])])\[[^\]\[]+\]
+    )
+    |(?P<prefixed>::|:=|%\(\w+\)s|%s|(?<!\w)[$:?]\w+|\\\w+|(?:@|\#\#|\#)[A-ZÀ-Ü]\w+)
+    |(?P<word>\w[$#\w]*)
+    |(?P<punctuation>[(),;])
+    |(?P<other>[^\s\w'"`´$()\[\],;\-/\#:?@\\%]+|[\s\S])
+    """,
+    re.IGNORECASE | re.VERBOSE
+)
+# Words that sqlparse treats as a name instead of a keyword: followed by a dot, or directly followed by
+# an opening parenthesis (a function call).
+_NAME_LOOKAHEAD_REGEX = re.compile(r'\s*\.|\(')
+# CTE names that sqlparse lexes as a single name token.
+_CTE_NAME_REGEX = re.compile(r'[A-Za-z_][A-Za-z0-9_]*|`(?:``|[^`])*`')
+
+_Token = Tuple[str, int, int]
+
+
 def raw_sql_to_selects(sql: str) -> List[CteTuple]:
     """
     Given a raw sql select statement, return a list with all CTEs and the final select statement.
@@ -22,6 +56,127 @@ def raw_sql_to_selects(sql: str) -> List[CteTuple]:
     For each CTE in the returned value the `name` field is guaranteed to be set, for the final select
     statement it will be None.
     """
+    # The sql of a model can run to megabytes, e.g. a VALUES list with all data of a pandas DataFrame.
+    # Lexing all of it with sqlparse takes seconds, so we only look at the tokens around the CTE
+    # boundaries. Only for sql that this doesn't handle, e.g. multiple statements or 'cte_name (columns)'
+    # syntax, we fall back to sqlparse.
+    result = _split_ctes(sql)
+    if result is None:
+        result = _raw_sql_to_selects_sqlparse(sql)
+    return result
+
+
+def _split_ctes(sql: str) -> Optional[List[CteTuple]]:
+    """
+    Split sql into CTEs and the final select statement, giving the same result as sqlparse.
+    Returns None if the sql is not a single select statement with CTEs of the form 'cte_name as (...)'.
+    """
+    if has_statement_separator(sql):
+        return None
+    tokens = _iterate_tokens(sql, 0)
+    for token in tokens:
+        if _is_keyword(sql, token, 'select'):
+            # This query is a simple select statement
+            return [CteTuple(name=None, select_sql=sql)]
+        if _is_keyword(sql, token, 'with'):
+            break
+    else:
+        raise ValueError(f'Cannot find select statement. sql: {sql}')
+
+    # This query contains Common Table Expressions
+    result = []
+    while True:
+        name_token = _next_significant_token(tokens)
+        if name_token is None or not _is_cte_name(sql, name_token):
+            return None
+        as_token = _next_significant_token(tokens)
+        if as_token is None or not _is_keyword(sql, as_token, 'as'):
+            return None
+        paren_token = _next_significant_token(tokens)
+        if paren_token is None or sql[paren_token[1]:paren_token[2]] != '(':
+            return None
+
+        cte_end = _find_closing_parenthesis(sql, tokens)
+        if cte_end is None:
+            return None
+        _, name_start, name_end = name_token
+        result.append(CteTuple(name=sql[name_start:name_end], select_sql=sql[paren_token[2]:cte_end]))
+
+        next_token = _next_significant_token(tokens)
+        if next_token is None:
+            return None
+        if _is_keyword(sql, next_token, 'select'):
+            if next_token[1] == cte_end + 1:
+                # sqlparse starts looking for the select after the token that follows the closing
+                # parenthesis, and thus skips a select without whitespace in between: ')select'.
+                return None
+            result.append(CteTuple(name=None, select_sql=sql[next_token[1]:]))
+            return result
+        if sql[next_token[1]:next_token[2]] != ',':
+            return None
+
+
+def _iterate_tokens(sql: str, pos: int) -> Iterator[_Token]:
+    """ Yield tuples (kind, start, end) for all tokens in sql, starting at pos. """
+    for match in _TOKEN_REGEX.finditer(sql, pos):
+        yield match.lastgroup or 'other', match.start(), match.end()
+
+
+def _next_significant_token(tokens: Iterator[_Token]) -> Optional[_Token]:
+    for token in tokens:
+        if token[0] not in ('whitespace', 'comment'):
+            return token
+    return None
+
+
+def _find_closing_parenthesis(sql: str, tokens: Iterator[_Token]) -> Optional[int]:
+    """ Give the position of the parenthesis that closes the one before tokens, None if there is none. """
+    depth = 1
+    for kind, start, end in tokens:
+        if kind == 'punctuation':
+            char = sql[start]
+            if char == '(':
+                depth += 1
+            elif char == ')':
+                depth -= 1
+                if depth == 0:
+                    return start
+    return None
+
+
+def has_statement_separator(sql: str) -> bool:
+    """
+    Determine whether sql contains something on which sqlparse splits statements: a semicolon or 'GO'
+    outside of quotes and comments.
+    """
+    if ';' not in sql and 'GO' not in sql:
+        return False
+    for kind, start, end in _iterate_tokens(sql, 0):
+        if kind == 'punctuation' and sql[start] == ';':
+            return True
+        if kind == 'word' and sql[start:end] == 'GO':
+            return True
+    return False
+
+
+def _is_keyword(sql: str, token: _Token, keyword: str) -> bool:
+    kind, start, end = token
+    if kind != 'word' or end - start != len(keyword) or sql[start:end].lower() != keyword:
+        return False
+    # sqlparse always treats AS as a keyword, other keywords are names if they are followed by a dot or by
+    # an opening parenthesis
+    return keyword == 'as' or not _NAME_LOOKAHEAD_REGEX.match(sql, end)
+
+
+def _is_cte_name(sql: str, token: _Token) -> bool:
+    kind, start, end = token
+    if kind not in ('word', 'quoted') or not _CTE_NAME_REGEX.fullmatch(sql, start, end):
+        return False
+    return sql[start:end].lower() not in ('as', 'select', 'recursive')
+
+
+def _raw_sql_to_selects_sqlparse(sql: str) -> List[CteTuple]:
+    """ Implementation of raw_sql_to_selects() that lexes the full sql with sqlparse. """
     # TODO: refactor function
     stmts = sqlparse.parse(sql)
     # if len(stmts) != 1:
@@ -4,8 +4,9 @@ Copyright 2021 Objectiv B.V.
 import numpy as np
 import pandas as pd
 import pytest
-from bach import DataFrame, SeriesBoolean
-from tests.functional.bach.test_data_and_utils import assert_equals_data, get_df_with_test_data
+from bach import DataFrame, SeriesBoolean, arrow_fetch
+from tests.functional.bach.test_data_and_utils import assert_equals_data, get_df_with_test_data, \
+    get_df_with_food_data
 
 
 @pytest.mark.athena_supported
@@ -191,3 +192,46 @@ def test__getitem__order_columns(engine) -> None:
     expected_ordered_columns = ['inhabitants', 'municipality']
     result = bt[expected_ordered_columns]
     assert ['inhabitants', 'municipality'] == result.data_columns
+
+
+def test_to_pandas_batches(engine) -> None:
+    bt = get_df_with_test_data(engine, full_data_set=True).sort_index()
+    expected = bt.to_pandas()
+
+    batches = list(bt.to_pandas_batches(batch_size=4))
+    assert [len(batch) for batch in batches] == [4, 4, 3]
+    pd.testing.assert_frame_equal(pd.concat(batches), expected)
+
+    series_batches = list(bt['city'].to_pandas_batches(batch_size=10, limit=5))
+    assert [len(batch) for batch in series_batches] == [5]
+    pd.testing.assert_series_equal(series_batches[0], expected['city'][:5])
+
+    assert list(bt[bt.skating_order > 100].to_pandas_batches()) == []
+
+
+def test_to_pandas_batches_temp_table(engine) -> None:
+    # the sql of this DataFrame creates a temporary table before the final query
+    bt = get_df_with_test_data(engine, full_data_set=True).materialize(materialization='temp_table')
+    bt = bt.sort_index()
+    expected = bt.to_pandas()
+
+    batches = list(bt.to_pandas_batches(batch_size=4))
+    assert [len(batch) for batch in batches] == [4, 4, 3]
+    pd.testing.assert_frame_equal(pd.concat(batches), expected)
+
+
+@pytest.mark.parametrize('get_df', [get_df_with_test_data, get_df_with_food_data])
+def test_to_pandas_arrow_postgres(pg_engine, monkeypatch, get_df) -> None:
+    bt = get_df(pg_engine).sort_index()
+    # round() gives a numeric
+    bt['ratio'] = (bt.skating_order / 3).round(2)
+    bt['large'] = bt.skating_order > 1
+    assert arrow_fetch.can_fetch_arrow(pg_engine, bt.view_sql(), bt._get_series_dtypes().values())
+    result = bt.to_pandas()
+    result_batches = list(bt.to_pandas_batches(batch_size=2))
+
+    # Without Arrow the result is fetched with pandas.read_sql_query()
+    monkeypatch.setattr(arrow_fetch, 'can_fetch_arrow', lambda *args: False)
+    expected = bt.to_pandas()
+    pd.testing.assert_frame_equal(result, expected)
+    pd.testing.assert_frame_equal(pd.concat(result_batches), expected)
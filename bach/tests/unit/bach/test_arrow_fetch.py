@@ -0,0 +1,207 @@
+"""
+Copyright 2022 Objectiv B.V.
+"""
+import datetime
+from decimal import Decimal
+from typing import Any, Iterator, List
+from uuid import UUID
+
+import pandas
+import pyarrow
+import pytest
+
+from bach import arrow_fetch
+from bach.arrow_fetch import arrow_table_to_pandas, can_fetch_arrow, read_sql_query_batches, _rebatch
+from bach.series.series_datetime import dt_strip_timezone
+from sql_models.util import is_bigquery, is_postgres
+from tests.unit.bach.util import FakeEngine, get_fake_df
+
+
+@pytest.mark.db_independent
+def test_arrow_table_to_pandas():
+    # Types as returned by the database drivers
+    table = pyarrow.table({
+        'int32': pyarrow.array([1, 2, 3], type=pyarrow.int32()),
+        'int_with_null': pyarrow.array([1, None, 3], type=pyarrow.int64()),
+        'float32': pyarrow.array([1.5, None, 3.0], type=pyarrow.float32()),
+        'numeric': pyarrow.array([Decimal('1.25'), Decimal('2'), None], type=pyarrow.decimal128(10, 2)),
+        'string': pyarrow.array(['a', None, ''], type=pyarrow.string()),
+        'bool': pyarrow.array([True, False, True]),
+        'bool_with_null': pyarrow.array([True, None, False]),
+        'date': pyarrow.array([datetime.date(2022, 1, 1), None, datetime.date(2022, 1, 3)]),
+        'timestamp': pyarrow.array(
+            [datetime.datetime(2022, 1, 1, 12, 30, 1, 123456), None, datetime.datetime(2022, 1, 3)],
+            type=pyarrow.timestamp('us')
+        ),
+    })
+    dtype = {'timestamp': 'datetime64[ns]'}
+    result = arrow_table_to_pandas(table, dtype=dtype)
+
+    # The same records as Python objects, converted the way pandas.read_sql_query() does
+    records = list(zip(*[table.column(name).to_pylist() for name in table.column_names]))
+    expected = pandas.DataFrame.from_records(records, columns=table.column_names, coerce_float=True)
+    expected = expected.astype(dtype)
+    pandas.testing.assert_frame_equal(result, expected)
+
+
+def test_can_fetch_arrow(dialect, monkeypatch):
+    engine = FakeEngine(dialect=dialect)
+    sql = "select 1 as a, 'x;y' as b"
+    if not is_postgres(engine):
+        monkeypatch.setattr(arrow_fetch, '_bigquery_storage_available', lambda: True)
+
+    assert can_fetch_arrow(engine, sql, ['int64', 'string', 'timestamp'])
+    assert can_fetch_arrow(engine, sql, [])
+    assert not can_fetch_arrow(engine, sql, ['int64', 'timedelta'])
+    assert not can_fetch_arrow(engine, sql, ['int64', {'a': 'int64'}])
+    # e.g. sql that creates a temporary table first
+    multi_statement_sql = 'create temporary table t as select 1 as a; select a from t'
+    assert not can_fetch_arrow(engine, multi_statement_sql, ['int64'])
+
+
+@pytest.mark.db_independent
+def test_rebatch():
+    def batch(start: int, stop: int) -> pyarrow.RecordBatch:
+        return pyarrow.RecordBatch.from_pydict({'a': list(range(start, stop))})
+
+    batches = [batch(0, 3), batch(3, 3), batch(3, 10), batch(10, 11)]
+    tables = list(_rebatch(batches, batch_size=4))
+    assert [table.column('a').to_pylist() for table in tables] == [
+        [0, 1, 2, 3], [4, 5, 6, 7], [8, 9, 10]
+    ]
+    assert [table.num_rows for table in _rebatch(batches, batch_size=11)] == [11]
+    assert list(_rebatch([], batch_size=4)) == []
+    with pytest.raises(ValueError, match='batch_size'):
+        list(_rebatch(batches, batch_size=0))
+
+
+def test_read_sql_query_batches_multi_statement(dialect, monkeypatch):
+    engine = FakeEngine(dialect=dialect)
+    result = pandas.DataFrame({'a': list(range(10))})
+
+    def fake_read_sql_query(engine, sql, dtype, series_dtypes, multi_statement):
+        assert multi_statement
+        return result
+
+    # sql with multiple statements can't be streamed, all rows are read at once and split in batches
+    monkeypatch.setattr(arrow_fetch, 'read_sql_query', fake_read_sql_query)
+    sql = 'create temporary table t as select 1 as a; select a from t'
+    batches = list(read_sql_query_batches(engine, sql, dtype={}, series_dtypes={'a': 'int64'}, batch_size=4))
+    assert [batch['a'].tolist() for batch in batches] == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+    assert [batch.index.tolist() for batch in batches] == [[0, 1, 2, 3], [0, 1, 2, 3], [0, 1]]
+
+    batches = list(read_sql_query_batches(
+        engine, 'select a from t', dtype={}, series_dtypes={'a': 'int64'}, batch_size=4, multi_statement=True
+    ))
+    assert len(batches) == 3
+
+
+class _FakeBigQueryCursor:
+    """ DB-API cursor that gives rows of Python objects, like the google-cloud-bigquery cursor does """
+    def __init__(self, table: pyarrow.Table):
+        self._table = table
+        self.description = None
+
+    def execute(self, sql: str, *args):
+        self.description = [(name, None, None, None, None, None, None) for name in self._table.column_names]
+
+    def fetchall(self) -> List[tuple]:
+        return list(zip(*[self._table.column(name).to_pylist() for name in self._table.column_names]))
+
+    def close(self):
+        pass
+
+
+class _FakeBigQueryConnection:
+    """
+    DB-API connection of sqlalchemy-bigquery, with the BigQuery client and BigQuery Storage client that the
+    Arrow backend uses.
+    """
+    def __init__(self, table: pyarrow.Table):
+        self._table = table
+        self._bqstorage_client = object()
+        self._client = self
+        self.closed = False
+        self.queries: List[str] = []
+
+    # DB-API connection
+    def cursor(self) -> _FakeBigQueryCursor:
+        return _FakeBigQueryCursor(self._table)
+
+    def commit(self):
+        pass
+
+    # bigquery.Client
+    def query(self, sql: str) -> '_FakeBigQueryConnection':
+        self.queries.append(sql)
+        return self
+
+    # bigquery.QueryJob
+    def to_arrow(self, bqstorage_client: Any, create_bqstorage_client: bool) -> pyarrow.Table:
+        assert bqstorage_client is self._bqstorage_client
+        return self._table
+
+    def result(self) -> '_FakeBigQueryConnection':
+        return self
+
+    # bigquery.table.RowIterator
+    def to_arrow_iterable(self, bqstorage_client: Any) -> Iterator[pyarrow.RecordBatch]:
+        assert bqstorage_client is self._bqstorage_client
+        yield from self._table.to_batches(max_chunksize=2)
+
+    # sqlalchemy pool connection
+    @property
+    def dbapi_connection(self) -> '_FakeBigQueryConnection':
+        return self
+
+    def close(self):
+        self.closed = True
+
+
+# pandas warns about DB-API connections other than sqlite3 ones
+@pytest.mark.filterwarnings('ignore:pandas only supports SQLAlchemy')
+def test_to_pandas_arrow_bigquery(dialect, monkeypatch):
+    if not is_bigquery(dialect):
+        pytest.skip('BigQuery Storage backend')
+    # Types as returned by the BigQuery Storage API, uuid and json are stored as strings
+    table = pyarrow.table({
+        '_index_id': pyarrow.array([1, 2, 3], type=pyarrow.int64()),
+        'moment': pyarrow.array(
+            [datetime.datetime(2022, 1, 1, 12, 30, 1, 123456), None, datetime.datetime(1960, 1, 3)],
+            type=pyarrow.timestamp('us', tz='UTC')
+        ),
+        'day': pyarrow.array([datetime.date(2022, 1, 1), datetime.date(1960, 1, 3), None]),
+        'event_id': pyarrow.array(
+            ['8ec1a6b3-0d1e-4c2c-9a2e-8e2ad2c4c2b1', 'a4b9f5f0-1d6c-4b8e-9b84-1d9c1b2c3d4e',
+             '0b5c2d1e-7f8a-4b9c-8d0e-1f2a3b4c5d6e']
+        ),
+        'data': pyarrow.array(['{"a": [1, 2]}', 'null', None]),
+        'name': pyarrow.array(['a', None, '']),
+        'amount': pyarrow.array([1, None, 3], type=pyarrow.int64()),
+        'ratio': pyarrow.array([1.5, None, 3.0]),
+        'flag': pyarrow.array([True, None, False]),
+    })
+    dtypes = {
+        '_index_id': 'int64', 'moment': 'timestamp', 'day': 'date', 'event_id': 'uuid', 'data': 'json',
+        'name': 'string', 'amount': 'int64', 'ratio': 'float64', 'flag': 'bool'
+    }
+    df = get_fake_df(
+        dialect=dialect, index_names=['_index_id'], data_names=table.column_names[1:], dtype=dtypes
+    )
+    connection = _FakeBigQueryConnection(table)
+    monkeypatch.setattr(type(df.engine), 'raw_connection', lambda self: connection, raising=False)
+    monkeypatch.setattr(arrow_fetch, '_bigquery_storage_available', lambda: True)
+
+    result = df.to_pandas()
+    result_batches = list(df.to_pandas_batches(batch_size=2))
+    assert connection.queries == [df.view_sql()] * 2
+    assert connection.closed
+
+    # The same records as Python objects, read the way to_pandas() does without Arrow
+    expected = pandas.read_sql_query(df.view_sql(), connection, dtype=df._get_pandas_dtypes())
+    expected = df._post_process_pandas_df(expected)
+    pandas.testing.assert_frame_equal(result, expected)
+    pandas.testing.assert_frame_equal(pandas.concat(result_batches), expected)
+    assert result['moment'].dtype == 'datetime64[ns]'
+    assert result['event_id'].tolist()[0] == UUID('8ec1a6b3-0d1e-4c2c-9a2e-8e2ad2c4c2b1')
+    assert result['data'].tolist()[0] == {'a': [1, 2]}
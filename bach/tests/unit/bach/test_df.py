@@ -158,3 +158,20 @@ def test_init_conditions(dialect):
         )
     # there are a few __init__ checks that we don't check here, as they are also checked when creating a
     # Series object, and are thus hard to actually trigger.
+
+
+def test_to_pandas_batches_batch_size(dialect):
+    df = get_fake_df(dialect=dialect, index_names=['a'], data_names=['b'])
+    # the batch size is checked before any query is run
+    with pytest.raises(ValueError, match='batch_size'):
+        next(df.to_pandas_batches(batch_size=0))
+
+
+def test_has_temporary_statements(dialect):
+    df = get_fake_df(dialect=dialect, index_names=['a'], data_names=['b'])
+    assert not df._has_temporary_statements()
+    assert not df.materialize()._has_temporary_statements()
+    df = df.materialize(materialization='temp_table')
+    assert df._has_temporary_statements()
+    # the temporary table is still created for queries on top of it
+    assert df.materialize()._has_temporary_statements()
@@ -0,0 +1,151 @@
+"""
+Copyright 2022 Objectiv B.V.
+"""
+import datetime
+import os
+import time
+from decimal import Decimal
+
+import pandas
+import pytest
+
+from bach import DataFrame
+from bach.query_cache import QueryCache, enable_query_cache, disable_query_cache, get_query_cache, \
+    get_table_names, is_cacheable
+from sql_models.model import CustomSqlModelBuilder
+from tests.unit.bach.util import get_fake_df, FakeEngine
+
+
+@pytest.fixture
+def query_cache(tmp_path):
+    cache = enable_query_cache(path=str(tmp_path))
+    yield cache
+    disable_query_cache()
+
+
+def _set_stored_time(cache: QueryCache, key: str, stored_time: float):
+    file_path = os.path.join(cache.path, f'{key}.parquet')
+    os.utime(file_path, (stored_time, stored_time))
+
+
+@pytest.mark.db_independent
+def test_put_get(tmp_path):
+    cache = QueryCache(path=str(tmp_path))
+    df = pandas.DataFrame({
+        'a': pandas.Series([1, None, 3], dtype='Int64'),
+        'b': ['x', None, 'z'],
+        'c': [datetime.date(2022, 1, 1), None, datetime.date(2022, 1, 3)],
+        'd': pandas.to_datetime(['2022-01-01 12:00', None, '2022-01-03']),
+        'e': [Decimal('1.5'), None, Decimal('3')],
+    })
+    assert cache.get('key') is None
+    assert cache.put('key', df)
+    pandas.testing.assert_frame_equal(cache.get('key'), df)
+
+    cache.clear()
+    assert cache.get('key') is None
+
+
+@pytest.mark.db_independent
+def test_not_cacheable(tmp_path):
+    cache = QueryCache(path=str(tmp_path))
+    # json data from Postgres: dicts would become structs with all keys of all rows
+    df = pandas.DataFrame({'a': [{'x': 1}, {'y': 2}]})
+    assert not is_cacheable(df)
+    assert not cache.put('key', df)
+    assert cache.get('key') is None
+    assert is_cacheable(pandas.DataFrame({'a': [1, 2], 'b': [None, None]}))
+
+
+@pytest.mark.db_independent
+def test_ttl(tmp_path):
+    cache = QueryCache(path=str(tmp_path), ttl_seconds=60)
+    df = pandas.DataFrame({'a': [1, 2]})
+    cache.put('key', df)
+    _set_stored_time(cache, 'key', time.time() - 30)
+    assert cache.get('key') is not None
+    _set_stored_time(cache, 'key', time.time() - 90)
+    assert cache.get('key') is None
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.db_independent
+def test_lru_eviction(tmp_path):
+    df = pandas.DataFrame({'a': list(range(100))})
+    probe = QueryCache(path=str(tmp_path / 'probe'))
+    probe.put('key', df)
+    entry_size = os.path.getsize(os.path.join(probe.path, 'key.parquet'))
+
+    cache = QueryCache(path=str(tmp_path / 'cache'), max_size_bytes=entry_size * 2)
+    cache.put('key1', df)
+    cache.put('key2', df)
+    now = time.time()
+    _set_stored_time(cache, 'key1', now - 20)
+    _set_stored_time(cache, 'key2', now - 10)
+    # key1 is used after key2 was stored, so key2 is the least recently used
+    assert cache.get('key1') is not None
+    cache.put('key3', df)
+    assert sorted(os.listdir(cache.path)) == ['key1.parquet', 'key3.parquet']
+
+    # results that don't fit at all are not stored
+    assert not cache.put('key4', pandas.DataFrame({'a': list(range(10_000))}))
+    assert cache.get('key4') is None
+
+
+def test_get_key(dialect, tmp_path):
+    cache = QueryCache(path=str(tmp_path))
+    engine = FakeEngine(dialect=dialect)
+    other_engine = FakeEngine(dialect=dialect, url='postgresql://user@other_host:5432/db')
+    dtypes = {'a': 'int64'}
+    key = cache.get_key(engine=engine, sql='select 1', dtypes=dtypes)
+    assert key == cache.get_key(engine=engine, sql='select 1', dtypes=dtypes)
+    assert key != cache.get_key(engine=engine, sql='select 2', dtypes=dtypes)
+    assert key != cache.get_key(engine=other_engine, sql='select 1', dtypes=dtypes)
+    assert key != cache.get_key(engine=engine, sql='select 1', dtypes={'a': 'Int64'})
+
+    df = DataFrame.from_table(engine, 'events', index=['a'], all_dtypes={'a': 'int64', 'b': 'string'})
+    table_names = get_table_names(df.base_node)
+    assert len(table_names) == 1
+    key = cache.get_key(engine=engine, sql='select 1', dtypes=dtypes, table_names=table_names)
+    # Only the tables that are used, and that have a version, change the key
+    cache.set_table_version('other_table', 1)
+    assert key == cache.get_key(engine=engine, sql='select 1', dtypes=dtypes, table_names=table_names)
+    cache.set_table_version('events', 1)
+    key_version_1 = cache.get_key(engine=engine, sql='select 1', dtypes=dtypes, table_names=table_names)
+    assert key != key_version_1
+    cache.set_table_version('events', 2)
+    key_version_2 = cache.get_key(engine=engine, sql='select 1', dtypes=dtypes, table_names=table_names)
+    assert key_version_1 != key_version_2
+    cache.set_table_version('events', None)
+    assert key == cache.get_key(engine=engine, sql='select 1', dtypes=dtypes, table_names=table_names)
+
+
+@pytest.mark.db_independent
+def test_get_table_names():
+    model = CustomSqlModelBuilder(sql='select * from {{a}} join {{b}}', name='join')(
+        a=CustomSqlModelBuilder(sql='SELECT x FROM {table_name}', name='from_table')(table_name='"t1"'),
+        b=CustomSqlModelBuilder(sql='select 1 as y', name='other')(),
+    )
+    assert get_table_names(model) == ['"t1"']
+
+
+def test_to_pandas_uses_cache(dialect, query_cache):
+    df = get_fake_df(
+        dialect=dialect, index_names=['a'], data_names=['b'], dtype={'a': 'int64', 'b': 'string'}
+    )
+    assert get_query_cache() is query_cache
+    dtypes = {
+        series.name: series.to_pandas_info().dtype
+        for series in df.all_series.values() if series.to_pandas_info() is not None
+    }
+    key = query_cache.get_key(
+        engine=df.engine,
+        sql=df.view_sql(),
+        dtypes=dtypes,
+        table_names=get_table_names(df.base_node)
+    )
+    query_cache.put(key, pandas.DataFrame({'a': [1, 2], 'b': pandas.Series(['x', 'y'], dtype='string')}))
+    # The fake engine cannot run queries, so this only works if the result comes from the cache
+    result = df.to_pandas()
+    assert result.index.name == 'a'
+    assert result['b'].to_list() == ['x', 'y']
@@ -1,15 +1,16 @@
 """
 Copyright 2021 Objectiv B.V.
 
-Tests for the replace_node_in_graph() function in sql_models.generic.graph_operations
+Tests for the replace_node_in_graph() function in sql_models.generic.graph_operations, and its batched
+    versions replace_nodes_in_graph() and update_nodes_in_graph()
 There are a lot of cases to consider for that function, that's why this file has been split of from
     test_graph_operations.py
 """
 import pytest
 
 from sql_models.graph_operations import get_node, replace_node_in_graph, get_graph_nodes_info, \
-    replace_non_start_node_in_graph
-from sql_models.model import SqlModel, RefPath
+    replace_non_start_node_in_graph, replace_nodes_in_graph, update_nodes_in_graph
+from sql_models.model import SqlModel, RefPath, Materialization
 from tests.unit.sql_models.util import ValueModel, RefModel, JoinModel, RefValueModel
 
 
@@ -352,3 +353,75 @@ def test_replace_node_in_graph_complex2():
            get_node(new_graph3, ('ref_left', 'ref_left', 'ref_left'))
     assert get_node(new_graph2, ('ref_left', 'ref_left', 'ref_left')) is \
            get_node(new_graph3, ('ref_left', 'ref_left', 'ref_left'))
+
+
+def test_replace_nodes_in_graph():
+    # Graph:
+    #          /--------------------\
+    #          |                     +-- graph
+    #   vm1 <--+-- rvm <-- rm  <----/
+    #   vm2 <------------------/
+    vm1 = ValueModel.build(key='a', val=1)
+    vm2 = ValueModel.build(key='a', val=2)
+    rvm = RefValueModel.build(ref=vm1, val=3)
+    rm = JoinModel.build(ref_left=rvm, ref_right=vm2)
+    graph = JoinModel.build(ref_left=rm, ref_right=vm1)
+
+    replacement_vm1 = ValueModel.build(key='b', val=98)
+    replacement_vm2 = ValueModel.build(key='b', val=99)
+
+    new_graph = replace_nodes_in_graph(graph, {
+        ('ref_right',): replacement_vm1,
+        ('ref_left', 'ref_right'): replacement_vm2,
+    })
+    # Same result as replacing the nodes one at a time
+    expected = replace_node_in_graph(graph, ('ref_right',), replacement_vm1)
+    expected = replace_node_in_graph(expected, ('ref_left', 'ref_right'), replacement_vm2)
+    assert new_graph.hash == expected.hash
+    assert get_node(new_graph, ('ref_left', 'ref_left', 'ref')) is replacement_vm1
+    assert get_node(new_graph, ('ref_right',)) is replacement_vm1
+    assert get_node(new_graph, ('ref_left', 'ref_right')) is replacement_vm2
+    assert len(get_graph_nodes_info(new_graph)) == 5
+    # the original graph is unchanged
+    assert get_node(graph, ('ref_right',)) is vm1
+    assert get_node(graph, ('ref_left', 'ref_right')) is vm2
+
+    # Nothing to replace: the original graph is returned
+    assert replace_nodes_in_graph(graph, {}) is graph
+    assert replace_nodes_in_graph(graph, {('ref_right',): vm1}) is graph
+    # Replacing the start node
+    assert replace_nodes_in_graph(graph, {tuple(): replacement_vm1}) is replacement_vm1
+
+    with pytest.raises(ValueError, match='Reference x does not exist'):
+        replace_nodes_in_graph(graph, {('ref_left', 'x'): replacement_vm1})
+
+
+def test_update_nodes_in_graph():
+    vm1 = ValueModel.build(key='a', val=1)
+    rvm = RefValueModel.build(ref=vm1, val=3)
+    graph = JoinModel.build(ref_left=rvm, ref_right=vm1)
+
+    def to_table(node: SqlModel) -> SqlModel:
+        return node.copy_set_materialization(Materialization.TABLE)
+
+    # A node that is updated gets the updated versions of the nodes that it refers
+    new_graph = update_nodes_in_graph(graph, {
+        ('ref_left',): to_table,
+        ('ref_right',): lambda node: node.copy_set({'val': 5}),
+    })
+    expected = graph.set(('ref_right',), val=5)
+    expected = expected.set_materialization(('ref_left',), Materialization.TABLE)
+    assert new_graph.hash == expected.hash
+    assert get_node(new_graph, ('ref_left',)).materialization == Materialization.TABLE
+    assert get_node(new_graph, ('ref_left', 'ref')) is get_node(new_graph, ('ref_right',))
+    assert get_node(new_graph, ('ref_right',)).placeholders['val'] == 5
+
+    # Multiple paths to the same node: all update functions are applied, in order
+    new_graph = update_nodes_in_graph(graph, {
+        ('ref_right',): lambda node: node.copy_set({'val': 5}),
+        ('ref_left', 'ref'): lambda node: node.copy_set({'key': 'b'}),
+    })
+    assert get_node(new_graph, ('ref_right',)).placeholders == {'key': 'b', 'val': 5}
+
+    # Nothing changes: the original graph is returned
+    assert update_nodes_in_graph(graph, {('ref_right',): lambda node: node}) is graph
@@ -5,7 +5,8 @@ from typing import List
 
 import pytest
 
-from sql_models.sql_query_parser import raw_sql_to_selects, CteTuple
+from sql_models.sql_query_parser import raw_sql_to_selects, CteTuple, _split_ctes, \
+    _raw_sql_to_selects_sqlparse
 from tests.unit.sql_models.util import assert_roughly_equal_sql
 
 
@@ -77,6 +78,44 @@ def test_parse_multiple_cte_select():
     _assert_equals_cte_tuples(result, expected)
 
 
+@pytest.mark.parametrize('sql', [
+    # parentheses, keywords, and semicolons in strings, quoted identifiers, and comments
+    "with cte_a as (select ')', 'select;' as \"col (\" from t1) select * from cte_a",
+    "with cte_a as (select $$ ( $$, $tag$ ) $tag$ from t1) select * from cte_a",
+    "with cte_a as (select x -- comment )\n from t1 /* ( */), cte_b as (select 1) select 2",
+    "with `cte_a` as (select `a)` from t1) select * from `cte_a`",
+    "WITH cte_a AS (SELECT 'it''s' AS x) SELECT x FROM cte_a",
+    # keywords used as names
+    "with cte_a as (select select.x, count(*) from t1) select with.y from cte_a",
+    "select x from t1",
+    # whitespace and comments around the boundaries
+    "\n  with/* c */cte_a/* c */as/* c */(select 1)-- c\n,\ncte_b as(select 2)\n\nselect 3\n  ",
+])
+def test_split_ctes_same_as_sqlparse(sql: str):
+    result = _split_ctes(sql)
+    assert result is not None
+    assert result == _raw_sql_to_selects_sqlparse(sql)
+
+
+@pytest.mark.parametrize('sql', [
+    'select x from t1;',
+    'with cte_a as (select 1) select 2;',
+    'with cte_a (x) as (select 1) select x from cte_a',
+    'with "cte_a" as (select 1) select 2',
+    'with recursive cte_a as (select 1) select 2',
+    'with cte_a as (select 1)select 2 union all select 3',
+])
+def test_split_ctes_fallback(sql: str):
+    # These are not handled by the scanner, raw_sql_to_selects() parses them with sqlparse
+    assert _split_ctes(sql) is None
+    assert raw_sql_to_selects(sql) == _raw_sql_to_selects_sqlparse(sql)
+
+
+def test_parse_no_select():
+    with pytest.raises(ValueError, match='Cannot find select statement'):
+        raw_sql_to_selects('update t1 set x = 1')
+
+
 def _assert_equals_cte_tuples(actual: List[CteTuple], expected: List[CteTuple]):
     assert len(actual) == len(expected)
     for a, e in zip(actual, expected):
@@ -0,0 +1,82 @@
+"""
+Copyright 2022 Objectiv B.V.
+
+Benchmark of the collector endpoint: a batch of DATA_MAX_EVENT_COUNT events is posted to collect() with the
+flask test client. This includes parsing, enrichment, validation, writing to the configured outputs and
+building the response. The outputs are configured with the usual environment variables, see
+CONFIGURATION.md. Note that if Postgres output is configured, the events are actually stored.
+
+Compares the json libraries that objectiv_backend.common.json_codec can use:
+ * json: the json module of the standard library
+ * orjson: only if orjson is installed
+
+Usage, from the backend directory:
+    PYTHONPATH=. python benchmarks/bench_collect.py [--events 1000] [--repeat 5]
+"""
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+
+from objectiv_backend.app import create_app
+from objectiv_backend.common import json_codec
+from objectiv_backend.end_points.collector import DATA_MAX_EVENT_COUNT
+
+from fixtures import make_events, PRESS_EVENT
+
+
+def _make_post_data(event_count: int) -> bytes:
+    """ Give the body of a request from the tracker with event_count new events. """
+    now_millis = round(time.time() * 1000)
+    template = dict(PRESS_EVENT, time=now_millis)
+    # The collector adds the CookieIdContext itself
+    template['global_contexts'] = [context for context in PRESS_EVENT['global_contexts']
+                                   if context['_type'] != 'CookieIdContext']
+    event_list = {
+        'events': make_events(event_count, template),
+        'transport_time': now_millis
+    }
+    return json.dumps(event_list).encode('utf-8')
+
+
+def _events_per_second(client, event_count: int, repeat: int) -> float:
+    """ Post event_count events, repeat times. Return the events/sec of the fastest run. """
+    best = float('inf')
+    for _ in range(repeat):
+        post_data = _make_post_data(event_count)
+        start = time.perf_counter()
+        # The collector prints some debug output per request
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = client.post('/', data=post_data, content_type='text/plain')
+        best = min(best, time.perf_counter() - start)
+        response_data = json.loads(response.data)
+        assert response_data['event_count'] == event_count, response_data
+        assert response_data['error_count'] == 0, response_data
+    return event_count / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the collector endpoint')
+    parser.add_argument('--events', type=int, default=DATA_MAX_EVENT_COUNT, help='number of events per batch')
+    parser.add_argument('--repeat', type=int, default=5, help='number of runs, the fastest run is reported')
+    args = parser.parse_args(sys.argv[1:])
+
+    client = create_app().test_client()
+    orjson = json_codec.orjson
+    libraries = ['json'] + (['orjson'] if orjson is not None else [])
+    results = {}
+    try:
+        for library in libraries:
+            json_codec.orjson = orjson if library == 'orjson' else None
+            results[library] = _events_per_second(client, args.events, args.repeat)
+            print(f'{library:>10}: {results[library]:12.0f} events/sec')
+    finally:
+        json_codec.orjson = orjson
+    if 'orjson' in results:
+        print(f'   speedup: {results["orjson"] / results["json"]:12.1f}x (orjson vs json)')
+
+
+if __name__ == '__main__':
+    main()
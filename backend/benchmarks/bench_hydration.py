@@ -0,0 +1,70 @@
+"""
+Copyright 2022 Objectiv B.V.
+
+Micro-benchmark of the type hydration of a batch of events, as done by the collector (sync mode) and the
+entry worker (async mode) for every valid event.
+
+Compares:
+ * uncached: sort the parent types of the event and of every context, per event. This is how hydration
+   worked before EventSchema pre-calculated the sorted parent types.
+ * cached: hydrate_types_into_event(), which attaches the sorted tuples that EventSchema pre-calculated.
+
+Usage, from the backend directory:
+    PYTHONPATH=. python benchmarks/bench_hydration.py [--events 1000] [--repeat 3]
+"""
+import argparse
+import sys
+import time
+from typing import Callable
+
+from objectiv_backend.common.config import get_collector_config
+from objectiv_backend.common.types import EventDataList, EventData
+from objectiv_backend.schema.event_schemas import EventSchema
+from objectiv_backend.schema.hydrate_events import hydrate_types_into_event
+
+from fixtures import make_events
+
+
+def _hydrate_uncached(event_schema: EventSchema, event: EventData):
+    event['_types'] = sorted(event_schema.get_all_parent_event_types(event['_type']))
+    for context in event['global_contexts'] + event['location_stack']:
+        context['_types'] = sorted(event_schema.get_all_parent_context_types(context['_type']))
+
+
+def _hydrate_cached(event_schema: EventSchema, event: EventData):
+    hydrate_types_into_event(event_schema, event)
+
+
+def _events_per_second(function: Callable[[EventSchema, EventData], None],
+                       event_schema: EventSchema,
+                       events: EventDataList,
+                       repeat: int) -> float:
+    """ Run function on all events, repeat times. Return the events/sec of the fastest run. """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for event in events:
+            function(event_schema, event)
+        best = min(best, time.perf_counter() - start)
+    return len(events) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark type hydration of events')
+    parser.add_argument('--events', type=int, default=1000, help='number of events per run')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs, the fastest run is reported')
+    args = parser.parse_args(sys.argv[1:])
+
+    event_schema = get_collector_config().event_schema
+    events = make_events(args.events)
+
+    results = {}
+    for name, function in (('uncached', _hydrate_uncached),
+                           ('cached', _hydrate_cached)):
+        results[name] = _events_per_second(function, event_schema, events, args.repeat)
+        print(f'{name:>10}: {results[name]:12.0f} events/sec')
+    print(f'   speedup: {results["cached"] / results["uncached"]:12.1f}x (cached vs uncached)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+"""
+Copyright 2022 Objectiv B.V.
+
+End-to-end ingestion benchmark: posts synthetic tracker payloads (see payloads.py) to the collector, and
+reports the throughput in events/sec and the p50 and p99 request latency.
+
+In-process (default), collect() is driven with the flask test client, once per scenario. A scenario is a
+mode and a single output:
+ * modes: 'sync', and 'async'. In async mode the events are processed by the workers (main_all) after all
+   requests are posted, the reported throughput is that of the collector and the workers together.
+ * outputs: 'none' (measures the collector itself), 'postgres', 'file_system', and 'parquet' (sync mode
+   only, requires pyarrow). Async mode requires the 'postgres' output.
+With --profile the time spent per stage of a request is reported as well: parsing (_get_event_data),
+enrichment (add_enriched_contexts), validation (process_events_entry), and the writes per output.
+
+Postgres is configured with the usual POSTGRES_* environment variables, and must be initialized with
+objectiv-db-init. The events that a scenario inserts are deleted afterwards. Scenarios that need Postgres
+are skipped if it's not available. Files are written to a temporary directory, that is removed afterwards.
+
+With --url, the payloads are posted to a running collector instead, from --concurrency threads. Only the
+throughput and latency are reported then, the mode and outputs are those of the server. Note that the
+server keeps the events.
+
+Usage, from the backend directory:
+    PYTHONPATH=. python benchmarks/bench_ingest.py [--requests 200] [--batch-size 10] [--global-contexts 2]
+        [--location-depth 3] [--event-mix PressEvent=4,VisibleEvent=1] [--modes sync async]
+        [--outputs none postgres file_system parquet] [--profile]
+    PYTHONPATH=. python benchmarks/bench_ingest.py --url http://localhost:8081/ [--concurrency 8]
+"""
+import argparse
+import contextlib
+import json
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence
+
+from objectiv_backend.app import create_app
+from objectiv_backend.common import config
+from objectiv_backend.common.config import CollectorConfig, FileSystemOutputConfig, ParquetOutputConfig, \
+    get_collector_config, get_config_postgres
+from objectiv_backend.common.db import get_db_connection
+from objectiv_backend.end_points import collector, extra_output
+from objectiv_backend.workers.workers import main_all
+
+from payloads import PayloadGenerator, parse_event_mix
+
+# Functions in the collector module that are timed with --profile, as (stage, function name)
+PROFILED_STAGES = [
+    ('parse', '_get_event_data'),
+    ('enrich', 'add_enriched_contexts'),
+    ('validate', 'process_events_entry'),
+    ('write postgres', 'insert_events_into_data'),
+    ('write postgres nok', 'insert_events_into_nok_data'),
+    ('write file_system', 'write_data_to_fs_if_configured'),
+    ('write parquet', 'write_data_to_parquet_if_configured'),
+    ('write snowplow', 'write_data_to_snowplow_if_configured'),
+    ('write sync total', 'write_sync_events'),
+    ('write async total', 'write_async_events'),
+]
+
+
+class Result(NamedTuple):
+    events_per_second: float
+    # request latencies, in seconds
+    p50: float
+    p99: float
+    # total time of all requests, in seconds
+    request_seconds: float
+    error_count: int
+
+
+class StageProfiler:
+    """ Records the duration of every call of the profiled functions of the collector module. """
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+
+    @contextlib.contextmanager
+    def patch(self) -> Iterator[None]:
+        """ Replace the profiled functions in the collector module with timed versions. """
+        originals = {name: getattr(collector, name) for _, name in PROFILED_STAGES}
+        for stage, name in PROFILED_STAGES:
+            setattr(collector, name, self._timed(stage, originals[name]))
+        try:
+            yield
+        finally:
+            for name, function in originals.items():
+                setattr(collector, name, function)
+
+    def _timed(self, stage: str, function: Callable) -> Callable:
+        @wraps(function)
+        def timed_function(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.samples[stage].append(time.perf_counter() - start)
+        return timed_function
+
+    def print_report(self, request_seconds: float):
+        """ Print per stage: the number of calls, p50 and p99, and the share of the total request time. """
+        for stage, _ in PROFILED_STAGES:
+            samples = self.samples.get(stage)
+            if not samples:
+                continue
+            share = sum(samples) / request_seconds * 100
+            print(f'    {stage:>20}: {len(samples):6d} calls, p50 {_percentile(samples, .5) * 1000:8.3f} ms, '
+                  f'p99 {_percentile(samples, .99) * 1000:8.3f} ms, {share:5.1f}% of request time')
+
+
+def _percentile(values: Sequence[float], fraction: float) -> float:
+    """ Nearest-rank percentile of values """
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def _get_result(latencies: List[float], event_count: int, seconds: float, error_count: int) -> Result:
+    return Result(events_per_second=event_count / seconds,
+                  p50=_percentile(latencies, .5),
+                  p99=_percentile(latencies, .99),
+                  request_seconds=sum(latencies),
+                  error_count=error_count)
+
+
+def _print_result(name: str, result: Result):
+    errors = f', {result.error_count} errors' if result.error_count else ''
+    print(f'{name:>20}: {result.events_per_second:12.0f} events/sec, '
+          f'p50 {result.p50 * 1000:8.2f} ms, p99 {result.p99 * 1000:8.2f} ms{errors}')
+
+
+def _postgres_available() -> bool:
+    try:
+        get_db_connection(get_config_postgres()).close()
+        return True
+    except Exception:
+        return False
+
+
+def _scenario_config(base_config: CollectorConfig, mode: str, output: str, directory: str) -> CollectorConfig:
+    """ Give the collector config of a scenario: only the given output, no buffering. """
+    output_config = base_config.output._replace(
+        postgres=get_config_postgres() if output == 'postgres' else None,
+        aws=None,
+        file_system=FileSystemOutputConfig(path=directory) if output == 'file_system' else None,
+        parquet=ParquetOutputConfig(path=directory) if output == 'parquet' else None
+    )
+    return base_config._replace(async_mode=mode == 'async', output=output_config, buffer=None)
+
+
+def _delete_events(event_ids: List[str]):
+    """ Delete the events that a scenario inserted, from all tables. """
+    connection = get_db_connection(get_config_postgres())
+    try:
+        with connection:
+            with connection.cursor() as cursor:
+                for table in ('data', 'nok_data', 'queue_entry', 'queue_finalize'):
+                    cursor.execute(f'delete from {table} where event_id = any(%s::uuid[])', (event_ids,))
+    finally:
+        connection.close()
+
+
+def _finish_outputs(output: str):
+    """ Write what the file outputs still buffer, so that is included in the measured time. """
+    if output == 'file_system':
+        extra_output.rotate_segments()
+    elif output == 'parquet':
+        from objectiv_backend.end_points.parquet_output import get_parquet_sink
+        parquet_config = get_collector_config().output.parquet
+        assert parquet_config is not None  # help out mypy
+        get_parquet_sink(parquet_config).flush()
+
+
+def _run_workers() -> int:
+    """ Process the entry and finalize queues until they are empty. Return the number of processed events. """
+    connection = get_db_connection(get_config_postgres())
+    try:
+        total = 0
+        while True:
+            event_count = main_all(connection, batch_size=1000)
+            if event_count == 0:
+                return total
+            total += event_count
+    finally:
+        connection.close()
+
+
+def run_in_process(client: Any,
+                   generator: PayloadGenerator,
+                   mode: str,
+                   output: str,
+                   request_count: int,
+                   batch_size: int,
+                   profiler: Optional[StageProfiler]) -> Result:
+    """
+    Post request_count payloads to collect() with the flask test client, with the scenario's config.
+    :param client: test client of the app. Must be created before, as create_app() loads the config.
+    """
+    base_config = get_collector_config()
+    with tempfile.TemporaryDirectory() as directory:
+        config._CACHED_COLLECTOR_CONFIG = _scenario_config(base_config, mode, output, directory)
+        if output == 'parquet':
+            # extra_output only imports the Parquet output if it's configured at import time
+            from objectiv_backend.end_points.parquet_output import get_parquet_sink
+            setattr(extra_output, 'get_parquet_sink', get_parquet_sink)
+        payloads = [generator.make_payload(batch_size) for _ in range(request_count + 1)]
+        event_ids = [event['id'] for payload in payloads for event in json.loads(payload)['events']]
+        try:
+            # warm up, e.g. the connection pool
+            client.post('/', data=payloads.pop(), content_type='text/plain')
+            latencies = []
+            error_count = 0
+            with profiler.patch() if profiler else contextlib.nullcontext():
+                start = time.perf_counter()
+                for payload in payloads:
+                    request_start = time.perf_counter()
+                    response = client.post('/', data=payload, content_type='text/plain')
+                    latencies.append(time.perf_counter() - request_start)
+                    error_count += json.loads(response.data)['error_count']
+                _finish_outputs(output)
+                if mode == 'async':
+                    _run_workers()
+                seconds = time.perf_counter() - start
+        finally:
+            config._CACHED_COLLECTOR_CONFIG = base_config
+            if output == 'postgres':
+                _delete_events(event_ids)
+    return _get_result(latencies, request_count * batch_size, seconds, error_count)
+
+
+def run_against_server(generator: PayloadGenerator,
+                       url: str,
+                       request_count: int,
+                       batch_size: int,
+                       concurrency: int) -> Result:
+    """ Post request_count payloads to a running collector, from concurrency threads. """
+    payloads = [generator.make_payload(batch_size) for _ in range(request_count)]
+
+    def post(payload: bytes) -> Any:
+        request = urllib.request.Request(url, data=payload, headers={'Content-Type': 'text/plain'})
+        request_start = time.perf_counter()
+        with urllib.request.urlopen(request) as response:
+            response_data = json.loads(response.read())
+        return time.perf_counter() - request_start, response_data['error_count']
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        start = time.perf_counter()
+        results = list(executor.map(post, payloads))
+        seconds = time.perf_counter() - start
+    return _get_result([latency for latency, _ in results],
+                       request_count * batch_size,
+                       seconds,
+                       sum(error_count for _, error_count in results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the ingestion of events, end-to-end')
+    parser.add_argument('--requests', type=int, default=200, help='number of requests per scenario')
+    parser.add_argument('--batch-size', type=int, default=10, help='number of events per request')
+    parser.add_argument('--global-contexts', type=int, default=2,
+                        help='number of optional global contexts per event')
+    parser.add_argument('--location-depth', type=int, default=3,
+                        help='minimal number of contexts in the location stack')
+    parser.add_argument('--event-mix', type=parse_event_mix, default=None,
+                        help='relative frequency per event type, e.g. PressEvent=4,VisibleEvent=1')
+    parser.add_argument('--modes', nargs='+', choices=['sync', 'async'], default=['sync', 'async'])
+    parser.add_argument('--outputs', nargs='+', choices=['none', 'postgres', 'file_system', 'parquet'],
+                        default=['none', 'postgres', 'file_system', 'parquet'])
+    parser.add_argument('--profile', action='store_true', help='report the time spent per stage')
+    parser.add_argument('--url', help='post to the collector at this url, instead of in-process')
+    parser.add_argument('--concurrency', type=int, default=8, help='number of threads, only used with --url')
+    args = parser.parse_args(sys.argv[1:])
+
+    generator = PayloadGenerator(get_collector_config().event_schema,
+                                 event_mix=args.event_mix,
+                                 global_contexts=args.global_contexts,
+                                 location_depth=args.location_depth)
+    if args.url:
+        result = run_against_server(generator, args.url, args.requests, args.batch_size, args.concurrency)
+        _print_result('server', result)
+        return
+
+    client = create_app().test_client()
+    postgres_available = _postgres_available()
+    for mode in args.modes:
+        for output in args.outputs:
+            name = f'{mode}/{output}'
+            if mode == 'async' and output != 'postgres':
+                continue
+            if output == 'postgres' and not postgres_available:
+                print(f'{name:>20}: skipped, Postgres is not available')
+                continue
+            if output == 'parquet':
+                try:
+                    import pyarrow  # noqa: F401
+                except ImportError:
+                    print(f'{name:>20}: skipped, pyarrow is not installed')
+                    continue
+            profiler = StageProfiler() if args.profile else None
+            result = run_in_process(client, generator, mode, output, args.requests, args.batch_size, profiler)
+            _print_result(name, result)
+            if profiler:
+                profiler.print_report(result.request_seconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Copyright 2022 Objectiv B.V.
+
+Benchmark of inserting events into the data table, as done by the collector (sync mode) and the finalize
+worker (async mode). Requires a Postgres database that was initialized with objectiv-db-init, configured
+with the usual POSTGRES_* environment variables. Every run is rolled back, so no data is left behind.
+
+Compares:
+ * values: multi-row insert statements, this is used for batches smaller than BULK_INSERT_MIN_EVENTS.
+ * copy: COPY into a staging table, followed by a single insert-select.
+
+Usage, from the backend directory:
+    PYTHONPATH=. python benchmarks/bench_pg_insert.py [--events 1000 10000 100000] [--repeat 3]
+"""
+import argparse
+import sys
+import time
+from typing import Callable, List, Tuple
+
+from objectiv_backend.common.config import get_config_postgres
+from objectiv_backend.common.db import get_db_connection
+from objectiv_backend.common.json_codec import json_dumps
+from objectiv_backend.workers.pg_storage import _event_to_row, _insert_rows_into_data, \
+    _insert_rows_into_data_bulk
+
+from fixtures import make_events
+
+
+def _events_per_second(connection,
+                       function: Callable[[object, List[Tuple]], List],
+                       event_count: int,
+                       repeat: int) -> float:
+    """ Insert event_count new events with function, repeat times. Return the events/sec of the fastest run. """
+    best = float('inf')
+    for _ in range(repeat):
+        values = [_event_to_row(event, json_dumps(event)) for event in make_events(event_count)]
+        try:
+            start = time.perf_counter()
+            inserted_event_ids = function(connection, values)
+            best = min(best, time.perf_counter() - start)
+            assert len(inserted_event_ids) == event_count
+        finally:
+            connection.rollback()
+    return event_count / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark inserting events into the data table')
+    parser.add_argument('--events', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='number of events per run')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs, the fastest run is reported')
+    args = parser.parse_args(sys.argv[1:])
+
+    pg_config = get_config_postgres()
+    if pg_config is None:
+        raise Exception('Missing Postgres configuration')
+    connection = get_db_connection(pg_config)
+    try:
+        for event_count in args.events:
+            results = {}
+            for name, function in (('values', _insert_rows_into_data),
+                                   ('copy', _insert_rows_into_data_bulk)):
+                results[name] = _events_per_second(connection, function, event_count, args.repeat)
+                print(f'{event_count:>8} events {name:>8}: {results[name]:12.0f} events/sec')
+            print(f'{event_count:>8} events  speedup: {results["copy"] / results["values"]:12.1f}x')
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Copyright 2022 Objectiv B.V.
+
+Micro-benchmark of preparing a batch of invalid events for the Snowplow 'bad' stream, as done by
+write_data_to_aws_pipeline() and write_data_to_gcp_pubsub() with good=False.
+
+Compares:
+ * scan: for every event, scan the complete list of errors for the event's error, and decode the payload
+   and custom context again to build the schema violation. This is how bad rows were prepared before the
+   errors were indexed.
+ * indexed: index the errors by event id once per batch, and reuse the payload data and custom context.
+
+Usage, from the backend directory:
+    PYTHONPATH=. python benchmarks/bench_snowplow_bad_rows.py [--events 1000] [--repeat 3]
+"""
+import argparse
+import json
+import sys
+import time
+from typing import Callable, List
+
+from objectiv_backend.common.config import get_collector_config, SnowplowConfig
+from objectiv_backend.common.types import EventDataList
+from objectiv_backend.schema.validate_events import EventError, ErrorInfo
+from objectiv_backend.snowplow.snowplow_helper import objectiv_event_to_snowplow_payload, \
+    snowplow_schema_violation_json, prepare_event_for_snowplow_pipeline, index_event_errors
+
+from fixtures import make_events
+
+
+def _prepare_scan(events: EventDataList, event_errors: List[EventError], config: SnowplowConfig) -> List[bytes]:
+    result = []
+    for event in events:
+        payload = objectiv_event_to_snowplow_payload(event=event, config=config)
+        event_error = None
+        for ee in event_errors:
+            if ee.event_id == event['id']:
+                event_error = ee
+        failed_event = snowplow_schema_violation_json(payload=payload, config=config, event_error=event_error)
+        result.append(json.dumps(failed_event, separators=(',', ':')).encode('utf-8'))
+    return result
+
+
+def _prepare_indexed(events: EventDataList, event_errors: List[EventError], config: SnowplowConfig) -> List[bytes]:
+    event_errors_by_id = index_event_errors(event_errors)
+    return [prepare_event_for_snowplow_pipeline(event=event, good=False, config=config,
+                                                event_errors_by_id=event_errors_by_id)
+            for event in events]
+
+
+def _events_per_second(function: Callable[[EventDataList, List[EventError], SnowplowConfig], List[bytes]],
+                       events: EventDataList,
+                       event_errors: List[EventError],
+                       config: SnowplowConfig,
+                       repeat: int) -> float:
+    """ Prepare all events, repeat times. Return the events/sec of the fastest run. """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(events, event_errors, config)
+        best = min(best, time.perf_counter() - start)
+    return len(events) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark preparing invalid events for Snowplow')
+    parser.add_argument('--events', type=int, default=1000, help='number of events per run')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs, the fastest run is reported')
+    args = parser.parse_args(sys.argv[1:])
+
+    config = get_collector_config().output.snowplow
+    events = make_events(args.events)
+    event_errors = [EventError(event_id=event['id'],
+                               error_info=[ErrorInfo(data=event, info='Missing required context')])
+                    for event in events]
+
+    results = {}
+    for name, function in (('scan', _prepare_scan),
+                           ('indexed', _prepare_indexed)):
+        results[name] = _events_per_second(function, events, event_errors, config, args.repeat)
+        print(f'{name:>10}: {results[name]:12.0f} events/sec')
+    print(f'   speedup: {results["indexed"] / results["scan"]:12.1f}x (indexed vs scan)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Copyright 2022 Objectiv B.V.
+
+Micro-benchmark of the per-event schema validation, as done by the collector (sync mode) and the entry
+worker (async mode).
+
+Compares:
+ * uncached: build a json-schema per event/context, and validate with jsonschema.validate(). This is how
+   validation worked before validators were pre-compiled per type.
+ * cached: validate with the validators that EventSchema compiled when it was loaded.
+ * full: validate_event_adheres_to_schema(), i.e. cached plus all other schema checks.
+
+Usage, from the backend directory:
+    PYTHONPATH=. python benchmarks/bench_validation.py [--events 1000] [--repeat 3]
+"""
+import argparse
+import sys
+import time
+from typing import Callable
+
+import jsonschema
+
+from objectiv_backend.common.config import get_collector_config
+from objectiv_backend.common.types import EventDataList, EventData
+from objectiv_backend.schema.event_schemas import EventSchema
+from objectiv_backend.schema.validate_events import validate_event_adheres_to_schema, \
+    _validate_event_item, _validate_context_item
+
+from fixtures import make_events
+
+
+def _validate_uncached(event_schema: EventSchema, event: EventData):
+    jsonschema.validate(instance=event, schema=event_schema.get_event_schema(event['_type']))
+    for context in event['global_contexts'] + event['location_stack']:
+        jsonschema.validate(instance=context, schema=event_schema.get_context_schema(context['_type']))
+
+
+def _validate_cached(event_schema: EventSchema, event: EventData):
+    assert not _validate_event_item(event_schema, event)
+    for context in event['global_contexts'] + event['location_stack']:
+        assert not _validate_context_item(event_schema, context)
+
+
+def _validate_full(event_schema: EventSchema, event: EventData):
+    assert not validate_event_adheres_to_schema(event_schema, event)
+
+
+def _events_per_second(function: Callable[[EventSchema, EventData], None],
+                       event_schema: EventSchema,
+                       events: EventDataList,
+                       repeat: int) -> float:
+    """ Run function on all events, repeat times. Return the events/sec of the fastest run. """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for event in events:
+            function(event_schema, event)
+        best = min(best, time.perf_counter() - start)
+    return len(events) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark event validation')
+    parser.add_argument('--events', type=int, default=1000, help='number of events per run')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs, the fastest run is reported')
+    args = parser.parse_args(sys.argv[1:])
+
+    event_schema = get_collector_config().event_schema
+    events = make_events(args.events)
+
+    results = {}
+    for name, function in (('uncached', _validate_uncached),
+                           ('cached', _validate_cached),
+                           ('full', _validate_full)):
+        results[name] = _events_per_second(function, event_schema, events, args.repeat)
+        print(f'{name:>10}: {results[name]:12.0f} events/sec')
+    print(f'   speedup: {results["cached"] / results["uncached"]:12.1f}x (cached vs uncached)')
+
+
+if __name__ == '__main__':
+    main()
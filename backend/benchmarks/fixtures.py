@@ -0,0 +1,49 @@
+"""
+Copyright 2022 Objectiv B.V.
+
+Realistic event fixtures for the benchmarks in this directory. The events resemble what the browser
+tracker sends, after the collector added its enrichment contexts.
+"""
+import uuid
+from copy import deepcopy
+from typing import List
+
+from objectiv_backend.common.types import EventData, EventDataList
+
+# Time of the fixture events, in milliseconds since the epoch
+FIXTURE_TIME_MILLIS = 1_650_000_000_000
+
+PRESS_EVENT: EventData = {
+    '_type': 'PressEvent',
+    'location_stack': [
+        {'_type': 'RootLocationContext', 'id': 'home'},
+        {'_type': 'NavigationContext', 'id': 'navigation'},
+        {'_type': 'ExpandableContext', 'id': 'menu'},
+        {'_type': 'PressableContext', 'id': 'open-drawer'}
+    ],
+    'global_contexts': [
+        {'_type': 'ApplicationContext', 'id': 'objectiv-website'},
+        {'_type': 'PathContext', 'id': 'https://objectiv.io/docs/?utm_source=benchmark&utm_medium=test'},
+        {'_type': 'CookieIdContext', 'id': 'cookie_id', 'cookie_id': 'f31b3e0c-a7b5-4c3a-8b2e-5ae1b3e3d3d4'},
+        {
+            '_type': 'HttpContext',
+            'id': 'http_context',
+            'referrer': 'https://objectiv.io/',
+            'user_agent': 'Mozilla/5.0 (X11; Linux x86_64; rv:99.0) Gecko/20100101 Firefox/99.0',
+            'remote_address': '192.0.2.1'
+        },
+        {'_type': 'LocaleContext', 'id': 'en', 'language_code': 'en', 'country_code': None}
+    ],
+    'time': FIXTURE_TIME_MILLIS,
+    'id': 'd8b0f1ca-4ebe-45b6-b7fb-7858cf46082a'
+}
+
+
+def make_events(count: int, template: EventData = PRESS_EVENT) -> EventDataList:
+    """ Give a list of count independent copies of template, each with a unique event id. """
+    events: List[EventData] = []
+    for _ in range(count):
+        event = deepcopy(template)
+        event['id'] = str(uuid.uuid4())
+        events.append(event)
+    return events
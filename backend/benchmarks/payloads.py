@@ -0,0 +1,164 @@
+"""
+Copyright 2022 Objectiv B.V.
+
+Synthetic tracker payloads, generated from the event schema (base_schema.json5 plus any configured schema
+extensions), for the load-generation benchmarks in this directory.
+
+Every generated event is valid: it has the contexts that its type requires, and a value for every property
+of the event and its contexts. The collector adds the CookieIdContext, HttpContext and MarketingContext
+itself, so those are never generated.
+"""
+import json
+import random
+import string
+import time
+import uuid
+from typing import Any, Dict, List, Mapping, Optional
+
+from objectiv_backend.common.types import EventData, EventDataList
+from objectiv_backend.schema.event_schemas import EventSchema
+
+# Relative frequencies of event types, roughly what the browser tracker sends for a website
+DEFAULT_EVENT_MIX = {
+    'PressEvent': 40,
+    'VisibleEvent': 15,
+    'HiddenEvent': 10,
+    'ApplicationLoadedEvent': 10,
+    'InputChangeEvent': 10,
+    'MediaStartEvent': 5,
+    'SuccessEvent': 5,
+    'FailureEvent': 5
+}
+
+# Contexts that the collector adds, trackers don't send these
+_COLLECTOR_CONTEXTS = {'CookieIdContext', 'HttpContext', 'MarketingContext'}
+# Properties that are filled in separately, not from the property's json-schema type
+_STANDARD_PROPERTIES = {'_type', 'id', 'time', 'location_stack', 'global_contexts'}
+# Location contexts that are used to pad the location stack to the requested depth
+_FILLER_LOCATION_CONTEXTS = ['NavigationContext', 'ContentContext', 'OverlayContext', 'ExpandableContext']
+
+
+def parse_event_mix(value: str) -> Dict[str, int]:
+    """ Parse an event mix from the command line, e.g. 'PressEvent=4,VisibleEvent=1' """
+    event_mix = {}
+    for item in value.split(','):
+        event_type, _, weight = item.partition('=')
+        event_mix[event_type.strip()] = int(weight) if weight else 1
+    return event_mix
+
+
+class PayloadGenerator:
+    """
+    Generates the request bodies that a tracker would post to the collector.
+    :param event_schema: schema from which the event types, contexts and properties are taken
+    :param event_mix: relative frequency per event type
+    :param global_contexts: number of optional global contexts per event, on top of the ApplicationContext
+        and PathContext that every event has
+    :param location_depth: minimal number of contexts in the location stack of an event
+    :param seed: seed of the random generator, so runs with the same settings get the same payloads,
+        except for the event ids and times.
+    """
+
+    def __init__(self,
+                 event_schema: EventSchema,
+                 event_mix: Mapping[str, int] = None,
+                 global_contexts: int = 2,
+                 location_depth: int = 3,
+                 seed: int = 0):
+        event_mix = event_mix or DEFAULT_EVENT_MIX
+        for event_type in event_mix:
+            if not event_schema.is_valid_event_type(event_type):
+                raise ValueError(f'Not a valid event type: {event_type}')
+        self.event_schema = event_schema
+        self.global_contexts = global_contexts
+        self.location_depth = location_depth
+        self._random = random.Random(seed)
+        self._event_types = list(event_mix)
+        self._weights = [event_mix[event_type] for event_type in self._event_types]
+        self._optional_global_types = [
+            context_type for context_type in sorted(event_schema.list_context_types())
+            if self._is_global(context_type) and not context_type.startswith('Abstract')
+            and context_type not in _COLLECTOR_CONTEXTS | {'ApplicationContext', 'PathContext'}
+        ]
+        self._filler_location_types = [context_type for context_type in _FILLER_LOCATION_CONTEXTS
+                                       if context_type in event_schema.list_context_types()]
+
+    def make_payload(self, batch_size: int, time_millis: Optional[int] = None) -> bytes:
+        """ Give the body of a request with batch_size new events. """
+        if time_millis is None:
+            time_millis = round(time.time() * 1000)
+        event_list = {
+            'events': self.make_events(batch_size, time_millis),
+            'transport_time': time_millis
+        }
+        return json.dumps(event_list).encode('utf-8')
+
+    def make_events(self, count: int, time_millis: int) -> EventDataList:
+        """ Give count new events, with event types according to the event mix. """
+        event_types = self._random.choices(self._event_types, weights=self._weights, k=count)
+        return [self.make_event(event_type, time_millis) for event_type in event_types]
+
+    def make_event(self, event_type: str, time_millis: int) -> EventData:
+        """ Give a new event of the given type, with all the contexts that the type requires. """
+        required = self.event_schema.get_all_required_contexts_for_event(event_type)
+        location_types = [context_type for context_type in sorted(required)
+                          if not self._is_global(context_type) and not context_type.startswith('Abstract')
+                          and context_type != 'RootLocationContext']
+        filler_count = max(0, self.location_depth - 1 - len(location_types))
+        location_types = ['RootLocationContext'] + \
+            [self._random.choice(self._filler_location_types) for _ in range(filler_count)] + \
+            location_types
+
+        global_types = ['ApplicationContext', 'PathContext']
+        if self._optional_global_types:
+            global_types += [self._random.choice(self._optional_global_types)
+                             for _ in range(self.global_contexts)]
+
+        event = {
+            '_type': event_type,
+            'id': str(uuid.uuid4()),
+            'time': time_millis,
+            'location_stack': [self._make_context(context_type, index)
+                               for index, context_type in enumerate(location_types)],
+            'global_contexts': [self._make_context(context_type, index)
+                                for index, context_type in enumerate(global_types)]
+        }
+        json_schema = self.event_schema.get_event_schema(event_type)
+        assert json_schema is not None  # help out mypy
+        event.update(self._make_properties(json_schema))
+        return event
+
+    def _is_global(self, context_type: str) -> bool:
+        return 'AbstractGlobalContext' in self.event_schema.get_all_parent_context_types(context_type)
+
+    def _make_context(self, context_type: str, index: int) -> Dict[str, Any]:
+        # the index makes the ids unique within the list, contexts with the same type and id are invalid
+        context = {'_type': context_type, 'id': f'{context_type.lower()}-{index}'}
+        json_schema = self.event_schema.get_context_schema(context_type)
+        assert json_schema is not None  # help out mypy
+        context.update(self._make_properties(json_schema))
+        return context
+
+    def _make_properties(self, json_schema: Dict[str, Any]) -> Dict[str, Any]:
+        """ Give a value for every property in json_schema, except for the standard properties. """
+        properties = {}
+        for name, property_schema in json_schema.get('properties', {}).items():
+            if name not in _STANDARD_PROPERTIES:
+                properties[name] = self._make_value(property_schema)
+        return properties
+
+    def _make_value(self, property_schema: Dict[str, Any]) -> Any:
+        property_types: List[str] = property_schema.get('type', 'string')
+        if isinstance(property_types, str):
+            property_types = [property_types]
+        property_type = next((t for t in property_types if t != 'null'), 'null')
+        if property_type == 'integer':
+            return self._random.randint(0, 10_000)
+        if property_type == 'number':
+            return self._random.random() * 10_000
+        if property_type == 'boolean':
+            return self._random.random() < 0.5
+        if property_type == 'string':
+            length = self._random.randint(4, 40)
+            return ''.join(self._random.choices(string.ascii_lowercase, k=length))
+        return None
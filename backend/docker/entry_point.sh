@@ -5,11 +5,12 @@
 # 2. Run an objectiv worker, i.e. process data on the queues and write the result to the database.
 #
 # By default option 1 happens. Only if ASYNC_MODE=true and ASYNC_WORK_TYPE=worker does option two happen
+# The worker processes both queues ('all'), unless WORKER_TYPE is set (e.g. WORKER_TYPE=pipeline)
 #
 
 if [[ "$ASYNC_MODE" == "true" && "$ASYNC_WORKER_TYPE" == "worker" ]]; then
   echo "starting worker"
-  objectiv-workers all --loop
+  objectiv-workers "${WORKER_TYPE:-all}" --loop
   exit 0
 fi;
 
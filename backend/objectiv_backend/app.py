@@ -1,21 +1,28 @@
 from flask import Flask
 from flask_cors import CORS
 
-from objectiv_backend.common.config import init_collector_config
+from objectiv_backend.common.config import init_collector_config, get_collector_config, init_logging
+from objectiv_backend.common.metrics import METRICS_AVAILABLE
 
 
 def create_app() -> Flask:
     from objectiv_backend.end_points import collector
+    from objectiv_backend.end_points import metrics
     from objectiv_backend.end_points import schema
 
+    init_logging()
     # load config - this will raise an error if there are configuration problems, and will cache the
     # result for later calls.
     init_collector_config()
+    if get_collector_config().metrics and not METRICS_AVAILABLE:
+        raise ValueError('METRICS_ENABLED = true, but the prometheus_client package is not installed.')
 
     flask_app = Flask(__name__, static_folder=None)  # type: ignore
     flask_app.add_url_rule(rule='/schema', view_func=schema.schema, methods=['GET'])
     flask_app.add_url_rule(rule='/jsonschema', view_func=schema.json_schema, methods=['GET'])
     flask_app.add_url_rule(rule='/', view_func=collector.collect, methods=['POST'])
+    if get_collector_config().metrics:
+        flask_app.add_url_rule(rule='/metrics', view_func=metrics.metrics, methods=['GET'])
     init_cors(flask_app)
     return flask_app
 
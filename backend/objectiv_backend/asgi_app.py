@@ -0,0 +1,66 @@
+"""
+Copyright 2022 Objectiv B.V.
+
+ASGI version of the collector app in app.py, with the same end points. Requires the `asgi` extra:
+pip install objectiv-backend[asgi]
+
+Run with an ASGI server, e.g.:
+    uvicorn objectiv_backend.asgi_app:app
+"""
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.routing import Route
+
+from objectiv_backend.common.config import init_collector_config, get_collector_config, init_logging
+from objectiv_backend.common.db_async import create_async_connection_pool
+from objectiv_backend.common.metrics import METRICS_AVAILABLE
+
+
+def create_asgi_app() -> Starlette:
+    from objectiv_backend.end_points import asgi
+
+    init_logging()
+    # load config - this will raise an error if there are configuration problems, and will cache the
+    # result for later calls.
+    init_collector_config()
+    if get_collector_config().metrics and not METRICS_AVAILABLE:
+        raise ValueError('METRICS_ENABLED = true, but the prometheus_client package is not installed.')
+
+    routes = [
+        Route('/schema', endpoint=asgi.schema, methods=['GET']),
+        Route('/jsonschema', endpoint=asgi.json_schema, methods=['GET']),
+        Route('/', endpoint=asgi.collect, methods=['POST'])
+    ]
+    if get_collector_config().metrics:
+        routes.append(Route('/metrics', endpoint=asgi.metrics, methods=['GET']))
+    # Same CORS settings as app.init_cors(): allow all origins, including credentials (cookies). A
+    # regex that matches everything makes the middleware echo the request's origin, which is what
+    # browsers require if credentials are allowed.
+    middleware = [
+        Middleware(CORSMiddleware,
+                   allow_origin_regex='.*',
+                   allow_credentials=True,
+                   allow_methods=['*'],
+                   allow_headers=['*'],
+                   max_age=3600 * 24)
+    ]
+    return Starlette(routes=routes, middleware=middleware, lifespan=_lifespan)
+
+
+@asynccontextmanager
+async def _lifespan(app: Starlette) -> AsyncIterator[None]:
+    """ Open the Postgres connection pool when the app starts, and close it when the app stops. """
+    pg_config = get_collector_config().output.postgres
+    app.state.pg_pool = await create_async_connection_pool(pg_config) if pg_config else None
+    try:
+        yield
+    finally:
+        if app.state.pg_pool is not None:
+            await app.state.pg_pool.close()
+
+
+app = create_asgi_app()
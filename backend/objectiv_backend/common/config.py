@@ -2,14 +2,16 @@
 Copyright 2021 Objectiv B.V.
 """
 
+import logging
 import os
-from typing import NamedTuple, Optional
+from typing import NamedTuple, Optional, Any
 
 # All settings that are controlled through environment variables are listed at the top here, for a
 # complete overview.
 # These settings should not be accessed by the constants here, but through the functions defined
 # below (e.g. get_config_output())
-from objectiv_backend.schema.event_schemas import EventSchema, get_event_schema, get_event_list_schema
+from objectiv_backend.schema.event_schemas import EventSchema, get_event_schema, get_event_list_schema, \
+    get_structural_event_list_schema, compile_validator
 from objectiv_backend.common.types import EventListSchema
 
 LOAD_BASE_SCHEMA = os.environ.get('LOAD_BASE_SCHEMA', 'true') == 'true'
@@ -32,6 +34,10 @@ _PG_PORT = os.environ.get('POSTGRES_PORT', '5432')
 _PG_DATABASE_NAME = os.environ.get('POSTGRES_DB', 'objectiv')
 _PG_USER = os.environ.get('POSTGRES_USER', 'objectiv')
 _PG_PASSWORD = os.environ.get('POSTGRES_PASSWORD', '')
+# Connection pool settings. The pool is per process.
+_PG_POOL_MIN_SIZE = os.environ.get('POSTGRES_POOL_MIN_SIZE', '0')
+_PG_POOL_MAX_SIZE = os.environ.get('POSTGRES_POOL_MAX_SIZE', '10')
+_PG_POOL_TIMEOUT_SECONDS = os.environ.get('POSTGRES_POOL_TIMEOUT_SECONDS', '5')
 
 # ### AWS S3 values, for writing data to S3.
 # default access keys to an empty string, otherwise the boto library will default ot user defaults.
@@ -46,6 +52,18 @@ _AWS_S3_PREFIX = os.environ.get('AWS_S3_PREFIX', '')
 _OUTPUT_ENABLE_FILESYSTEM = os.environ.get('OUTPUT_ENABLE_FILESYSTEM', '') == 'true'
 _FILESYSTEM_OUTPUT_DIR = os.environ.get('FILESYSTEM_OUTPUT_DIR')
 
+# ### Settings for outputting data to Parquet files on the filesystem
+_OUTPUT_ENABLE_PARQUET = os.environ.get('OUTPUT_ENABLE_PARQUET', '') == 'true'
+_PARQUET_OUTPUT_DIR = os.environ.get('PARQUET_OUTPUT_DIR')
+_PARQUET_MAX_EVENTS = int(os.environ.get('PARQUET_MAX_EVENTS', 100_000))
+_PARQUET_MAX_SECONDS = float(os.environ.get('PARQUET_MAX_SECONDS', 300))
+
+# ### Segment settings, for the file system and S3 outputs. These append the events to segment files,
+# which are rotated by size and age.
+_SEGMENT_COMPRESSION = os.environ.get('OUTPUT_SEGMENT_COMPRESSION', 'gzip')
+_SEGMENT_MAX_BYTES = int(os.environ.get('OUTPUT_SEGMENT_MAX_BYTES', 128 * 1024 * 1024))
+_SEGMENT_MAX_SECONDS = float(os.environ.get('OUTPUT_SEGMENT_MAX_SECONDS', 300))
+
 # ### Snowplow settings
 _SP_SCHEMA_COLLECTOR_PAYLOAD = 'iglu:com.snowplowanalytics.snowplow/CollectorPayload/thrift/1-0-0'
 _SP_SCHEMA_CONTEXTS = 'iglu:com.snowplowanalytics.snowplow/contexts/jsonschema/1-0-0'
@@ -70,9 +88,41 @@ _OBJ_COOKIE_SAMESITE = str(os.environ.get('COOKIE_SAMESITE', 'Lax'))
 _OBJ_COOKIE_SECURE = bool(os.environ.get('COOKIE_SECURE', False))
 
 # Maximum number of events that a worker will process in a single batch. Only relevant in async mode
-WORKER_BATCH_SIZE = 200
+WORKER_BATCH_SIZE = int(os.environ.get('WORKER_BATCH_SIZE', 200))
+# Number of worker processes that process batches in parallel. Only relevant in async mode
+WORKER_CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', 1))
 # Time to sleep, if there is no work to do for the workers. Only relevant in async mode
-WORKER_SLEEP_SECONDS = 5
+# Workers start sleeping WORKER_MIN_SLEEP_SECONDS, and double that for every consecutive time they find no
+# work, up to WORKER_SLEEP_SECONDS.
+WORKER_MIN_SLEEP_SECONDS = float(os.environ.get('WORKER_MIN_SLEEP_SECONDS', 0.1))
+WORKER_SLEEP_SECONDS = float(os.environ.get('WORKER_SLEEP_SECONDS', 5))
+
+# Buffering: if enabled, the collector acknowledges events as soon as they are added to an in-memory buffer,
+# and a background thread writes the buffered events to the outputs in batches.
+_BUFFER_ENABLED = os.environ.get('BUFFER_ENABLED', '') == 'true'
+_BUFFER_MAX_EVENTS = int(os.environ.get('BUFFER_MAX_EVENTS', 50_000))
+_BUFFER_FLUSH_EVENTS = int(os.environ.get('BUFFER_FLUSH_EVENTS', 5_000))
+_BUFFER_FLUSH_MILLIS = int(os.environ.get('BUFFER_FLUSH_MILLIS', 500))
+
+# Maximum number of events that the collector accepts in a single request
+DATA_MAX_EVENT_COUNT = 1_000
+
+# Metrics: if enabled, the collector serves metrics in the Prometheus format on /metrics, and the workers
+# serve them on port WORKER_METRICS_PORT. Requires the prometheus_client package.
+_METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '') == 'true'
+_WORKER_METRICS_PORT = int(os.environ.get('WORKER_METRICS_PORT', 8001))
+
+# Log level of the collector and the workers: DEBUG, INFO, WARNING, or ERROR
+_LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+
+
+class SegmentConfig(NamedTuple):
+    # 'gzip', 'zstd' (requires the zstandard package), or 'none'
+    compression: str = 'gzip'
+    # a segment is rotated once max_bytes (uncompressed) are written to it, or max_seconds after it was
+    # opened, whichever comes first
+    max_bytes: int = 128 * 1024 * 1024
+    max_seconds: float = 300
 
 
 class AwsOutputConfig(NamedTuple):
@@ -81,10 +131,20 @@ class AwsOutputConfig(NamedTuple):
     region: str
     bucket: str
     s3_prefix: str
+    segment: SegmentConfig = SegmentConfig()
 
 
 class FileSystemOutputConfig(NamedTuple):
     path: str
+    segment: SegmentConfig = SegmentConfig()
+
+
+class ParquetOutputConfig(NamedTuple):
+    path: str
+    # events are buffered, and written to a file per day once there are max_events events, or max_seconds
+    # after the oldest event was buffered, whichever comes first
+    max_events: int = 100_000
+    max_seconds: float = 300
 
 
 class PostgresConfig(NamedTuple):
@@ -93,6 +153,11 @@ class PostgresConfig(NamedTuple):
     database_name: str
     user: str
     password: str
+    # number of connections the connection pool opens at start, and keeps open at most
+    pool_min_size: int = 0
+    pool_max_size: int = 10
+    # maximum number of seconds to wait for a connection if all connections of the pool are in use
+    pool_timeout: float = 5
 
 
 class SnowplowConfig(NamedTuple):
@@ -118,6 +183,7 @@ class OutputConfig(NamedTuple):
     aws: Optional[AwsOutputConfig]
     file_system: Optional[FileSystemOutputConfig]
     snowplow: SnowplowConfig
+    parquet: Optional[ParquetOutputConfig] = None
 
 
 class CookieConfig(NamedTuple):
@@ -135,19 +201,49 @@ class TimestampValidationConfig(NamedTuple):
     max_delay: int
 
 
+class WorkerConfig(NamedTuple):
+    # maximum number of events per batch
+    batch_size: int
+    # number of processes that process batches in parallel
+    concurrency: int
+    # bounds of the adaptive sleep time, when there is no work
+    min_sleep_seconds: float
+    max_sleep_seconds: float
+
+
+class BufferConfig(NamedTuple):
+    # maximum number of events in the buffer. If the buffer is full, the collector refuses new events.
+    max_events: int
+    # the buffer is flushed if it contains flush_events events, or if the oldest event in the buffer was
+    # added flush_interval_seconds ago, whichever comes first
+    flush_events: int
+    flush_interval_seconds: float
+
+
+class MetricsConfig(NamedTuple):
+    # port on which the workers serve their metrics. The collector serves them on /metrics.
+    worker_port: int
+
+
 class CollectorConfig(NamedTuple):
     async_mode: bool
     cookie: Optional[CookieConfig]
     error_reporting: bool
     output: OutputConfig
     event_schema: EventSchema
+    # json-schema for the structure of a list of events, and the validator compiled from it.
     event_list_schema: EventListSchema
+    event_list_validator: Any
+    # None if buffering is disabled
+    buffer: Optional[BufferConfig] = None
+    # None if metrics are disabled
+    metrics: Optional[MetricsConfig] = None
 
 
 def get_config_output_aws() -> Optional[AwsOutputConfig]:
     if not _OUTPUT_ENABLE_AWS:
         return None
-    if _AWS_REGION and _AWS_ACCESS_KEY_ID and _AWS_SECRET_ACCESS_KEY and _AWS_BUCKET and _AWS_S3_PREFIX:
+    if not (_AWS_REGION and _AWS_ACCESS_KEY_ID and _AWS_SECRET_ACCESS_KEY and _AWS_BUCKET and _AWS_S3_PREFIX):
         raise ValueError(f'OUTPUT_ENABLE_AWS = true, but not all required values specified. '
                          f'Must specify AWS_REGION, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_BUCKET, '
                          f'and AWS_S3_PREFIX')
@@ -156,7 +252,8 @@ def get_config_output_aws() -> Optional[AwsOutputConfig]:
         secret_access_key=_AWS_SECRET_ACCESS_KEY,
         region=_AWS_REGION,
         bucket=_AWS_BUCKET,
-        s3_prefix=_AWS_S3_PREFIX
+        s3_prefix=_AWS_S3_PREFIX,
+        segment=get_config_segment()
     )
 
 
@@ -165,7 +262,34 @@ def get_config_output_file_system() -> Optional[FileSystemOutputConfig]:
         return None
     if not _FILESYSTEM_OUTPUT_DIR:
         raise ValueError('OUTPUT_ENABLE_FILESYSTEM = true, but FILESYSTEM_OUTPUT_DIR not specified.')
-    return FileSystemOutputConfig(path=_FILESYSTEM_OUTPUT_DIR)
+    return FileSystemOutputConfig(path=_FILESYSTEM_OUTPUT_DIR, segment=get_config_segment())
+
+
+def get_config_output_parquet() -> Optional[ParquetOutputConfig]:
+    if not _OUTPUT_ENABLE_PARQUET:
+        return None
+    if not _PARQUET_OUTPUT_DIR:
+        raise ValueError('OUTPUT_ENABLE_PARQUET = true, but PARQUET_OUTPUT_DIR not specified.')
+    if _PARQUET_MAX_EVENTS < 1 or _PARQUET_MAX_SECONDS <= 0:
+        raise ValueError('PARQUET_MAX_EVENTS and PARQUET_MAX_SECONDS must be positive.')
+    return ParquetOutputConfig(
+        path=_PARQUET_OUTPUT_DIR,
+        max_events=_PARQUET_MAX_EVENTS,
+        max_seconds=_PARQUET_MAX_SECONDS
+    )
+
+
+def get_config_segment() -> SegmentConfig:
+    if _SEGMENT_COMPRESSION not in ('gzip', 'zstd', 'none'):
+        raise ValueError(f'Invalid OUTPUT_SEGMENT_COMPRESSION: {_SEGMENT_COMPRESSION}. '
+                         f'Must be gzip, zstd, or none.')
+    if _SEGMENT_MAX_BYTES < 1 or _SEGMENT_MAX_SECONDS <= 0:
+        raise ValueError('OUTPUT_SEGMENT_MAX_BYTES and OUTPUT_SEGMENT_MAX_SECONDS must be positive.')
+    return SegmentConfig(
+        compression=_SEGMENT_COMPRESSION,
+        max_bytes=_SEGMENT_MAX_BYTES,
+        max_seconds=_SEGMENT_MAX_SECONDS
+    )
 
 
 def get_config_postgres() -> Optional[PostgresConfig]:
@@ -174,12 +298,18 @@ def get_config_postgres() -> Optional[PostgresConfig]:
     if not _PG_HOSTNAME or not _PG_PORT or not _PG_DATABASE_NAME or not _PG_USER:
         raise ValueError(f'OUTPUT_ENABLE_PG = true, but not all required values specified. '
                          f'Must specify PG_HOSTNAME, PG_PORT, PG_DATABASE_NAME, PG_USER, and PG_PASSWORD')
+    if int(_PG_POOL_MAX_SIZE) < 1 or int(_PG_POOL_MIN_SIZE) > int(_PG_POOL_MAX_SIZE):
+        raise ValueError(f'Invalid connection pool size. POSTGRES_POOL_MAX_SIZE must be at least 1, and '
+                         f'POSTGRES_POOL_MIN_SIZE must not exceed POSTGRES_POOL_MAX_SIZE.')
     return PostgresConfig(
         hostname=_PG_HOSTNAME,
         port=int(_PG_PORT),
         database_name=_PG_DATABASE_NAME,
         user=_PG_USER,
-        password=_PG_PASSWORD
+        password=_PG_PASSWORD,
+        pool_min_size=int(_PG_POOL_MIN_SIZE),
+        pool_max_size=int(_PG_POOL_MAX_SIZE),
+        pool_timeout=float(_PG_POOL_TIMEOUT_SECONDS)
     )
 
 
@@ -223,13 +353,15 @@ def get_config_output() -> OutputConfig:
         postgres=get_config_postgres(),
         aws=get_config_output_aws(),
         file_system=get_config_output_file_system(),
-        snowplow=get_config_output_snowplow()
+        snowplow=get_config_output_snowplow(),
+        parquet=get_config_output_parquet()
     )
     if not output_config.postgres \
             and not output_config.aws \
             and not output_config.file_system \
-            and not output_config.snowplow:
-        raise Exception('No output configured. At least configure either Postgres, S3 or FileSystem '
+            and not output_config.snowplow \
+            and not output_config.parquet:
+        raise Exception('No output configured. At least configure either Postgres, S3, FileSystem or Parquet '
                         'output.')
     return output_config
 
@@ -247,8 +379,51 @@ def get_config_event_schema() -> EventSchema:
     return get_event_schema(SCHEMA_EXTENSION_DIRECTORY)
 
 
-def get_config_event_list_schema() -> EventListSchema:
-    return get_event_list_schema()
+def get_config_event_list_schema(event_schema: EventSchema) -> EventListSchema:
+    return get_structural_event_list_schema(event_schema=event_schema,
+                                            event_list_schema=get_event_list_schema())
+
+
+def get_config_worker() -> WorkerConfig:
+    if WORKER_BATCH_SIZE < 1 or WORKER_CONCURRENCY < 1:
+        raise ValueError('WORKER_BATCH_SIZE and WORKER_CONCURRENCY must be at least 1.')
+    return WorkerConfig(
+        batch_size=WORKER_BATCH_SIZE,
+        concurrency=WORKER_CONCURRENCY,
+        min_sleep_seconds=WORKER_MIN_SLEEP_SECONDS,
+        max_sleep_seconds=max(WORKER_MIN_SLEEP_SECONDS, WORKER_SLEEP_SECONDS)
+    )
+
+
+def get_config_buffer() -> Optional[BufferConfig]:
+    if not _BUFFER_ENABLED:
+        return None
+    if _BUFFER_FLUSH_EVENTS < 1 or _BUFFER_MAX_EVENTS < _BUFFER_FLUSH_EVENTS or _BUFFER_FLUSH_MILLIS < 1:
+        raise ValueError('BUFFER_FLUSH_EVENTS and BUFFER_FLUSH_MILLIS must be at least 1, and '
+                         'BUFFER_MAX_EVENTS must be at least BUFFER_FLUSH_EVENTS.')
+    if _BUFFER_MAX_EVENTS < DATA_MAX_EVENT_COUNT:
+        # The buffer would never have room for a request with the maximum number of events
+        raise ValueError(f'BUFFER_MAX_EVENTS must be at least {DATA_MAX_EVENT_COUNT}, the maximum number of '
+                         f'events per request.')
+    return BufferConfig(
+        max_events=_BUFFER_MAX_EVENTS,
+        flush_events=_BUFFER_FLUSH_EVENTS,
+        flush_interval_seconds=_BUFFER_FLUSH_MILLIS / 1000
+    )
+
+
+def get_config_metrics() -> Optional[MetricsConfig]:
+    if not _METRICS_ENABLED:
+        return None
+    return MetricsConfig(worker_port=_WORKER_METRICS_PORT)
+
+
+def init_logging():
+    """
+    Configure the root logger with the level from LOG_LEVEL. Does nothing if the root logger already has
+    handlers, e.g. because the app server configured logging.
+    """
+    logging.basicConfig(level=_LOG_LEVEL, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
 
 
 def get_config_timestamp_validation() -> TimestampValidationConfig:
@@ -263,13 +438,18 @@ _CACHED_COLLECTOR_CONFIG: Optional[CollectorConfig] = None
 def init_collector_config():
     """ Load collector config into cache. """
     global _CACHED_COLLECTOR_CONFIG
+    event_schema = get_config_event_schema()
+    event_list_schema = get_config_event_list_schema(event_schema)
     _CACHED_COLLECTOR_CONFIG = CollectorConfig(
         async_mode=_ASYNC_MODE,
         cookie=get_config_cookie(),
         error_reporting=SCHEMA_VALIDATION_ERROR_REPORTING,
         output=get_config_output(),
-        event_schema=get_config_event_schema(),
-        event_list_schema=get_config_event_list_schema()
+        event_schema=event_schema,
+        event_list_schema=event_list_schema,
+        event_list_validator=compile_validator(event_list_schema),
+        buffer=get_config_buffer(),
+        metrics=get_config_metrics()
     )
 
 
@@ -1,12 +1,23 @@
 """
 Copyright 2021 Objectiv B.V.
 """
+import io
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Tuple, Optional, Iterator, NamedTuple, Iterable, Sequence, Any
+
 import psycopg2
 from psycopg2 import extras
-from psycopg2.extensions import ISOLATION_LEVEL_READ_COMMITTED
+from psycopg2.extensions import ISOLATION_LEVEL_READ_COMMITTED, TRANSACTION_STATUS_IDLE
+from psycopg2.pool import PoolError
 
 from objectiv_backend.common.config import PostgresConfig
 
+# Connections that have been idle in the pool for longer than this are checked before they are handed out.
+_HEALTH_CHECK_IDLE_SECONDS = 30
+
 
 def get_db_connection(pg_config: PostgresConfig):
     """
@@ -29,5 +40,241 @@ def get_db_connection(pg_config: PostgresConfig):
     # than 5 seconds, something is wrong.
     with conn.cursor() as cursor:
         cursor.execute("set lock_timeout='5s';")
+    conn.commit()
     extras.register_uuid()
     return conn
+
+
+class PoolStats(NamedTuple):
+    # number of connections handed out by the pool
+    checkouts: int
+    # total and maximum time that callers had to wait for a connection
+    total_wait_seconds: float
+    max_wait_seconds: float
+    # number of open connections (idle + in use), and number of idle connections
+    size: int
+    idle: int
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of database connections, as returned by get_db_connection().
+
+    Connections are opened on demand, up to pg_config.pool_max_size. If all connections are in use, then
+    get_connection() waits for a connection to be returned, for at most pg_config.pool_timeout seconds.
+    Connections that have been idle for a while are checked before being handed out, broken connections are
+    discarded and replaced.
+
+    A pool should only be used by the process that created it. get_connection_pool() takes care of that.
+    """
+
+    def __init__(self, pg_config: PostgresConfig):
+        self.pg_config = pg_config
+        self.pid = os.getpid()
+        self._condition = threading.Condition()
+        # idle connections, with the time they were returned to the pool
+        self._idle: List[Tuple[object, float]] = []
+        # number of open connections: idle and in use
+        self._size = 0
+        self._checkouts = 0
+        self._total_wait_seconds = 0.0
+        self._max_wait_seconds = 0.0
+        # set by close_all(), after which connections are closed when they are returned
+        self._closed = False
+        for _ in range(pg_config.pool_min_size):
+            self._idle.append((get_db_connection(pg_config), time.monotonic()))
+            self._size += 1
+
+    def get_connection(self):
+        """
+        Get a connection from the pool. The connection must be returned with put_connection().
+        :raise PoolError: if no connection became available within pg_config.pool_timeout seconds, or if
+            the pool has been closed with close_all()
+        :raise psycopg2.OperationalError: if a new connection could not be opened
+        """
+        start = time.monotonic()
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise PoolError('Connection pool is closed')
+                if self._idle:
+                    connection, idle_since = self._idle.pop()
+                    break
+                if self._size < self.pg_config.pool_max_size:
+                    # reserve a spot, we'll open the connection outside of the lock
+                    connection, idle_since = None, start
+                    self._size += 1
+                    break
+                remaining = self.pg_config.pool_timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    raise PoolError(f'No connection available within {self.pg_config.pool_timeout} seconds')
+                self._condition.wait(remaining)
+            wait_seconds = time.monotonic() - start
+            self._checkouts += 1
+            self._total_wait_seconds += wait_seconds
+            self._max_wait_seconds = max(self._max_wait_seconds, wait_seconds)
+
+        if connection is not None and not self._is_healthy(connection, idle_since):
+            self._close(connection)
+            connection = None
+        if connection is None:
+            try:
+                connection = get_db_connection(self.pg_config)
+            except Exception:
+                self._release_spot()
+                raise
+        return connection
+
+    def put_connection(self, connection):
+        """
+        Return a connection to the pool. A transaction that is still open on the connection is rolled back.
+        Broken connections, and connections that are returned after close_all(), are closed.
+        """
+        try:
+            if not connection.closed and connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+        except psycopg2.Error:
+            pass
+        if connection.closed or connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            self._close(connection)
+            self._release_spot()
+            return
+        with self._condition:
+            if not self._closed:
+                self._idle.append((connection, time.monotonic()))
+                self._condition.notify()
+                return
+        self._close(connection)
+        self._release_spot()
+
+    @contextmanager
+    def connection(self) -> Iterator:
+        """ Context manager that gets a connection from the pool, and returns it afterwards. """
+        connection = self.get_connection()
+        try:
+            yield connection
+        finally:
+            self.put_connection(connection)
+
+    def close_all(self):
+        """
+        Close all idle connections. Connections that are in use are closed when they are returned. After this,
+        the pool doesn't hand out connections anymore.
+        """
+        with self._condition:
+            self._closed = True
+            idle = self._idle
+            self._idle = []
+            self._size -= len(idle)
+            self._condition.notify_all()
+        for connection, _ in idle:
+            self._close(connection)
+
+    def get_stats(self) -> PoolStats:
+        with self._condition:
+            return PoolStats(
+                checkouts=self._checkouts,
+                total_wait_seconds=self._total_wait_seconds,
+                max_wait_seconds=self._max_wait_seconds,
+                size=self._size,
+                idle=len(self._idle)
+            )
+
+    def _release_spot(self):
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+    @staticmethod
+    def _is_healthy(connection, idle_since: float) -> bool:
+        if connection.closed:
+            return False
+        if time.monotonic() - idle_since < _HEALTH_CHECK_IDLE_SECONDS:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('select 1')
+            connection.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+
+# Process-wide connection pool, see get_connection_pool()
+_CONNECTION_POOL: Optional[ConnectionPool] = None
+_CONNECTION_POOL_LOCK = threading.Lock()
+
+
+def get_connection_pool(pg_config: PostgresConfig) -> ConnectionPool:
+    """
+    Get the process-wide connection pool, create it if it doesn't exist yet.
+
+    A pool that was inherited from a parent process (e.g. a gunicorn master that forked its workers) is not
+    used, nor closed: closing would also close the connections of the parent process. Instead, a new pool is
+    created for the current process.
+
+    If pg_config differs from the configuration of the current pool, then the current pool is closed and
+    replaced by a new pool.
+    """
+    global _CONNECTION_POOL
+    with _CONNECTION_POOL_LOCK:
+        if _CONNECTION_POOL is not None \
+                and _CONNECTION_POOL.pid == os.getpid() \
+                and _CONNECTION_POOL.pg_config != pg_config:
+            _CONNECTION_POOL.close_all()
+            _CONNECTION_POOL = None
+        if _CONNECTION_POOL is None or _CONNECTION_POOL.pid != os.getpid():
+            _CONNECTION_POOL = ConnectionPool(pg_config)
+        return _CONNECTION_POOL
+
+
+@contextmanager
+def get_pooled_db_connection(pg_config: PostgresConfig) -> Iterator:
+    """
+    Context manager that gives a connection from the process-wide connection pool. The connection has the
+    same settings as a connection returned by get_db_connection(), and is returned to the pool afterwards.
+
+    Usage:
+        with get_pooled_db_connection(pg_config) as connection:
+            with connection:
+                # transaction
+    """
+    with get_connection_pool(pg_config).connection() as connection:
+        yield connection
+
+
+def _copy_text_value(value: Any) -> str:
+    """ Format a value for the text format of COPY, escaping the characters that have a special meaning. """
+    if value is None:
+        return '\\N'
+    return str(value)\
+        .replace('\\', '\\\\')\
+        .replace('\t', '\\t')\
+        .replace('\n', '\\n')\
+        .replace('\r', '\\r')
+
+
+def copy_rows(cursor, table_name: str, columns: Sequence[str], rows: Iterable[Sequence[Any]]):
+    """
+    Bulk load rows into a table with `COPY ... FROM STDIN`. This is a lot faster than inserting the same
+    rows with multi-row insert statements.
+
+    Does not do any transaction management.
+    :param cursor: psycopg2 cursor
+    :param table_name: table to load the data in. Must be a trusted value, it's not escaped.
+    :param columns: names of the columns of the table, in the order of the values in the rows.
+    :param rows: rows of values. Values are converted with str(); None is loaded as null.
+    """
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(_copy_text_value(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    cursor.copy_expert(f'copy {table_name} ({", ".join(columns)}) from stdin', buffer)
@@ -0,0 +1,30 @@
+"""
+Copyright 2022 Objectiv B.V.
+
+Postgres connections for the ASGI collector, using asyncpg. Requires the `asgi` extra:
+pip install objectiv-backend[asgi]
+"""
+import asyncpg
+
+from objectiv_backend.common.config import PostgresConfig
+
+
+async def create_async_connection_pool(pg_config: PostgresConfig) -> asyncpg.Pool:
+    """
+    Create an asyncpg connection pool. The connections have the same settings as the connections of
+    get_db_connection():
+     * read committed isolation level (the Postgres default)
+     * 5 second lock_timeout
+
+    Connections are opened on demand, up to pg_config.pool_max_size.
+    The pool must be closed by the caller.
+    """
+    return await asyncpg.create_pool(user=pg_config.user,
+                                     password=pg_config.password,
+                                     host=pg_config.hostname,
+                                     port=pg_config.port,
+                                     database=pg_config.database_name,
+                                     min_size=pg_config.pool_min_size,
+                                     max_size=pg_config.pool_max_size,
+                                     # See get_db_connection() for why we set a lock_timeout
+                                     server_settings={'lock_timeout': '5s'})
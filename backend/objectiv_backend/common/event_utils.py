@@ -1,7 +1,8 @@
 """
 Copyright 2021 Objectiv B.V.
 """
-from typing import Optional, List, cast
+from itertools import chain
+from typing import Optional, List, Iterator, Sequence, cast
 
 from objectiv_backend.common.types import EventData, ContextData, ContextType
 from objectiv_backend.schema.schema import AbstractGlobalContext
@@ -9,29 +10,28 @@ from objectiv_backend.schema.schema import AbstractGlobalContext
 
 def get_optional_context(event: EventData, context_type: ContextType) -> Optional[ContextData]:
     """ Get the first Context of the given type, or None if there is none. """
-    result = get_contexts(event=event, context_type=context_type)
-    if not result:
-        return None
-    return result[0]
+    return next(_iterate_contexts(event=event, context_type=context_type), None)
 
 
 def get_context(event: EventData, context_type: ContextType) -> ContextData:
     """ Get the first Context of the given type. """
-    result = get_contexts(event=event, context_type=context_type)
-    if not result:
+    result = get_optional_context(event=event, context_type=context_type)
+    if result is None:
         raise ValueError(f'context-type {context_type} not present in event. data: {event}')
-    return result[0]
+    return result
 
 
 def get_contexts(event: EventData, context_type: ContextType) -> List[ContextData]:
     """ Given all the Contexts of the given type."""
-    contexts = get_global_contexts(event) + get_location_stack(event)
-    result = []
-    for context in contexts:
-        _contexts_types = cast(List[ContextType], context.get("_types", []))
-        if context.get("_type") == context_type or context_type in _contexts_types:
-            result.append(context)
-    return result
+    return list(_iterate_contexts(event=event, context_type=context_type))
+
+
+def _iterate_contexts(event: EventData, context_type: ContextType) -> Iterator[ContextData]:
+    """ Yield the Contexts of the given type, first the global contexts, then the location stack. """
+    for context in chain(get_global_contexts(event), get_location_stack(event)):
+        if context.get("_type") == context_type or \
+                context_type in cast(Sequence[ContextType], context.get("_types", ())):
+            yield context
 
 
 def get_global_contexts(event: EventData) -> List[ContextData]:
@@ -48,4 +48,3 @@ def add_global_context_to_event(event: EventData, context: AbstractGlobalContext
     """ Add the global context to the event. Returns the modified event """
     event['global_contexts'].append(context)
     return event
-
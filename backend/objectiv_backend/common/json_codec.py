@@ -0,0 +1,66 @@
+"""
+Copyright 2022 Objectiv B.V.
+
+JSON encoding and decoding for the collector's hot path.
+
+Uses orjson if it's installed (pip install objectiv-backend[fast-json]), and falls back to the json module
+of the standard library otherwise. Both produce compact json (no whitespace between items). orjson writes
+non-ascii characters as utf-8, the standard library escapes them, as it always did.
+
+Strings with lone surrogates (e.g. "\ud800") are valid json for the standard library, but not for orjson.
+As the collector has always accepted them, they are decoded and encoded with the standard library. Encoding
+escapes them, so the result can always be encoded as utf-8, e.g. by psycopg2.
+"""
+import json
+from typing import Any, List, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore
+
+# Name of the library that is used for encoding and decoding, either 'orjson' or 'json'
+JSON_LIBRARY = 'orjson' if orjson is not None else 'json'
+
+_STDLIB_SEPARATORS = (',', ':')
+
+
+def json_loads(data: Union[bytes, str]) -> Any:
+    """
+    Decode json. Prefer passing bytes, e.g. straight from a request body, that saves decoding the data to a
+    string first.
+    :raise ValueError: if data is not valid json
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # Either invalid json, or json that only the standard library accepts, e.g. lone surrogates
+            pass
+    return json.loads(data)
+
+
+def json_dumps(obj: Any) -> str:
+    """
+    Encode obj as compact json.
+
+    orjson is stricter than the standard library, e.g. it doesn't support named tuples, integers of more
+    than 64 bits, or strings with lone surrogates. If orjson cannot serialize obj then the standard library
+    is tried.
+    :raise TypeError: if obj cannot be serialized
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj).decode('utf-8')
+        except TypeError:
+            pass
+    # ensure_ascii: a lone surrogate cannot be encoded as utf-8, so it must be escaped
+    return json.dumps(obj, separators=_STDLIB_SEPARATORS, ensure_ascii=True)
+
+
+def json_dumps_list(serialized_items: List[str]) -> str:
+    """
+    Combine items that are already serialized with json_dumps() to a json list. This makes it possible to
+    serialize a list of events once, and use the result both per event and as a whole.
+    """
+    return '[' + ','.join(serialized_items) + ']'
@@ -0,0 +1,142 @@
+"""
+Copyright 2022 Objectiv B.V.
+
+Metrics of the collector and the workers, in the Prometheus text format. Requires the `metrics` extra:
+pip install objectiv-backend[metrics]
+
+If prometheus_client is not installed, then all metrics below are no-ops. So instrumented code can use
+them unconditionally.
+
+The collector serves the metrics on /metrics, and the workers on their own http port, if METRICS_ENABLED
+is set. If the collector or the workers run in multiple processes (e.g. multiple gunicorn workers, or
+WORKER_CONCURRENCY > 1), then set PROMETHEUS_MULTIPROC_DIR to an empty directory that all processes can
+write to, so the metrics of all processes are aggregated. See the prometheus_client documentation.
+"""
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, Sequence, Tuple
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None  # type: ignore
+
+METRICS_AVAILABLE = prometheus_client is not None
+
+_SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+_LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+class _NoopMetric:
+    """ Stand-in for a metric, if prometheus_client is not installed. """
+
+    def labels(self, *args: Any, **kwargs: Any) -> '_NoopMetric':
+        return self
+
+    def inc(self, amount: float = 1):
+        pass
+
+    def set(self, value: float):
+        pass
+
+    def observe(self, amount: float):
+        pass
+
+
+def _counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Any:
+    if prometheus_client is None:
+        return _NoopMetric()
+    return prometheus_client.Counter(name, documentation, labelnames)
+
+
+def _gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Any:
+    if prometheus_client is None:
+        return _NoopMetric()
+    # In multiprocess mode: sum the values of the processes that are alive
+    return prometheus_client.Gauge(name, documentation, labelnames, multiprocess_mode='livesum')
+
+
+def _histogram(name: str, documentation: str, buckets: Sequence[float], labelnames: Sequence[str] = ()) -> Any:
+    if prometheus_client is None:
+        return _NoopMetric()
+    return prometheus_client.Histogram(name, documentation, labelnames, buckets=buckets)
+
+
+# ### Collector
+# result: 'ok', 'data_error' (the request was refused as a whole), or 'buffer_full'
+COLLECTOR_REQUESTS = _counter(
+    'objectiv_collector_requests', 'Number of requests to the collector end point', ['result'])
+COLLECTOR_REQUEST_BYTES = _histogram(
+    'objectiv_collector_request_bytes', 'Size of the posted data of collector requests', _SIZE_BUCKETS)
+COLLECTOR_REQUEST_EVENTS = _histogram(
+    'objectiv_collector_request_events', 'Number of events per collector request', _COUNT_BUCKETS)
+# result: 'ok' or 'nok' (failed validation). Only counted in sync mode, in async mode the workers validate.
+COLLECTOR_EVENTS = _counter(
+    'objectiv_collector_events', 'Number of validated events received by the collector', ['result'])
+# stage: 'parse', 'enrich', or 'validate'
+COLLECTOR_STAGE_SECONDS = _histogram(
+    'objectiv_collector_stage_seconds', 'Time spent per processing stage of collector requests',
+    _LATENCY_BUCKETS, ['stage'])
+
+# ### Outputs, of the collector and the workers
+# output: 'postgres', 'postgres_queue', 'snowplow', 'file_system', 'aws', or 'parquet'
+OUTPUT_WRITE_SECONDS = _histogram(
+    'objectiv_output_write_seconds', 'Time spent writing a batch of events to an output',
+    _LATENCY_BUCKETS, ['output'])
+DUPLICATE_EVENTS = _counter(
+    'objectiv_duplicate_events', 'Number of events that were already in the data table')
+
+# ### Workers
+# worker: last part of the name of the worker function, e.g. 'entry' or 'finalize'
+WORKER_BATCH_SECONDS = _histogram(
+    'objectiv_worker_batch_seconds', 'Time spent processing a batch, for batches with events',
+    _LATENCY_BUCKETS, ['worker'])
+WORKER_EVENTS = _counter(
+    'objectiv_worker_events', 'Number of events processed by the workers', ['worker'])
+# queue: 'entry' or 'finalize'
+QUEUE_DEPTH = _gauge(
+    'objectiv_queue_depth', 'Number of events in the Postgres queues', ['queue'])
+
+
+@contextmanager
+def timed(histogram: Any) -> Iterator[None]:
+    """ Context manager that observes the number of seconds that the block took on histogram. """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start)
+
+
+def _get_registry() -> Any:
+    """ Give the registry with the metrics of this process, or of all processes in multiprocess mode. """
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return prometheus_client.REGISTRY
+    registry = prometheus_client.CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """
+    Render the current metrics in the Prometheus text format.
+    :return: tuple: the response body, and its content type
+    :raise ValueError: if prometheus_client is not installed
+    """
+    if prometheus_client is None:
+        raise ValueError('Metrics require the prometheus_client package')
+    return prometheus_client.generate_latest(_get_registry()), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def start_metrics_server(port: int):
+    """
+    Serve the metrics on http://<host>:port/ from a background thread, for processes without an http
+    server of their own, such as the workers.
+    :raise ValueError: if prometheus_client is not installed
+    """
+    if prometheus_client is None:
+        raise ValueError('Metrics require the prometheus_client package')
+    prometheus_client.start_http_server(port, registry=_get_registry())
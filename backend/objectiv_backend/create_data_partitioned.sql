@@ -0,0 +1,99 @@
+-- Alternative layout of the data table: range partitioned by day, with one partition per day and a default
+-- partition for days that have no partition of their own.
+-- objectiv-db-init --partition-data-by-day uses this instead of the data table definition in
+-- create_tables.sql. All other objects are the same for both layouts.
+
+create table data (
+    event_id uuid not null,
+    day date not null,
+    moment timestamp not null,
+    cookie_id uuid not null,
+    value json not null,
+    -- The primary key of a partitioned table must contain the partition key, so this only guarantees that
+    -- an event_id is unique within a partition. See data_event_id for uniqueness over all partitions.
+    primary key(event_id, day)
+) partition by range(day);
+
+create index on data(day);
+
+create table data_default partition of data default;
+
+-- The event_ids of all rows in the data table. The data_skip_duplicate_event trigger uses this to enforce
+-- that event_ids are unique over all partitions. This table is not partitioned, as its primary key would
+-- then have to contain the day, and only guarantee uniqueness within a day. Use drop_data_partitions() to
+-- remove old data, that removes the event_ids of the dropped rows from this table too.
+create table data_event_id (
+    event_id uuid not null,
+    day date not null, -- day of the row in the data table, so the ids can be cleaned up with the partition
+    primary key(event_id)
+);
+
+create index on data_event_id(day);
+
+-- Skip rows of which the event_id is already in the data table, in any partition. Skipped rows are not
+-- inserted and not returned by the `returning` clause of the insert, just like rows that are skipped by
+-- `on conflict do nothing`. And just like `on conflict do nothing` this blocks if another transaction is
+-- inserting the same event_id, until that transaction ends.
+create function data_skip_duplicate_event() returns trigger
+language plpgsql set search_path from current as $$
+begin
+    insert into data_event_id(event_id, day) values (new.event_id, new.day) on conflict do nothing;
+    if not found then
+        return null;
+    end if;
+    return new;
+end;
+$$;
+
+create trigger data_skip_duplicate_event before insert on data
+    for each row execute function data_skip_duplicate_event();
+
+-- Create the missing partitions of the data table for the days first_day up to and including last_day.
+-- Returns the number of created partitions.
+-- Partitions should be created before the first event of a day arrives, as a partition cannot be created
+-- if the default partition already contains rows for that day.
+create function create_data_partitions(first_day date, last_day date) returns integer
+language plpgsql set search_path from current as $$
+declare
+    partition_day date;
+    partition_name text;
+    created integer := 0;
+begin
+    for partition_day in select generate_series(first_day, last_day, interval '1 day')::date loop
+        partition_name := 'data_' || to_char(partition_day, 'YYYYMMDD');
+        if to_regclass(partition_name) is null then
+            execute format('create table %I partition of data for values from (%L) to (%L)',
+                           partition_name, partition_day, partition_day + 1);
+            created := created + 1;
+        end if;
+    end loop;
+    return created;
+end;
+$$;
+
+-- Remove all data of the days before before_day: drop the partitions of the data table for those days,
+-- delete the rows for those days from the default partition, and delete their event_ids from data_event_id.
+-- After this, events with those event_ids are no longer considered duplicates.
+-- Returns the number of dropped partitions.
+create function drop_data_partitions(before_day date) returns integer
+language plpgsql set search_path from current as $$
+declare
+    partition_name text;
+    dropped integer := 0;
+begin
+    for partition_name in
+        select child.relname
+        from pg_inherits
+        join pg_class child on child.oid = pg_inherits.inhrelid
+        where pg_inherits.inhparent = 'data'::regclass
+            and child.relname ~ '^data_[0-9]{8}$'
+            and to_date(substring(child.relname from 6), 'YYYYMMDD') < before_day
+    loop
+        execute format('drop table %I', partition_name);
+        dropped := dropped + 1;
+    end loop;
+    delete from data where day < before_day;
+    delete from data_event_id where day < before_day;
+    return dropped;
+end;
+$$;
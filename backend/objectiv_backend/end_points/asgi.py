@@ -0,0 +1,256 @@
+"""
+Copyright 2022 Objectiv B.V.
+
+ASGI versions of the end points, see objectiv_backend/asgi_app.py. Requires the `asgi` extra:
+pip install objectiv-backend[asgi]
+
+The collect end point does the same enrichment, validation and writing as the flask end point in
+collector.py, and gives the same response. The difference is that all I/O is non-blocking: Postgres is
+accessed with asyncpg, and the other outputs, which only have blocking clients, run in the default thread
+pool executor. The outputs are written concurrently.
+"""
+import asyncio
+import functools
+import logging
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Awaitable, List, NamedTuple, Optional, Union
+
+import asyncpg
+from starlette.datastructures import Headers
+from starlette.requests import Request
+from starlette.responses import Response
+
+from objectiv_backend.common.config import get_collector_config
+from objectiv_backend.common.json_codec import json_dumps
+from objectiv_backend.common.metrics import COLLECTOR_REQUEST_EVENTS, COLLECTOR_REQUESTS, COLLECTOR_STAGE_SECONDS, \
+    OUTPUT_WRITE_SECONDS, render_metrics, timed
+from objectiv_backend.common.types import EventDataList
+from objectiv_backend.end_points.collector import DATA_MAX_SIZE_BYTES, add_enriched_contexts, \
+    get_collector_response_message, parse_event_data, set_time_in_events, validate_events
+from objectiv_backend.end_points.extra_output import events_to_json, write_data_to_fs_if_configured, \
+    write_data_to_parquet_if_configured, write_data_to_s3_if_configured, write_data_to_snowplow_if_configured
+from objectiv_backend.end_points.schema import RenderedBody, get_rendered_json_schema, get_rendered_schema, \
+    get_schema_response
+from objectiv_backend.schema.validate_events import EventError
+from objectiv_backend.workers.pg_queues import ProcessingStage
+from objectiv_backend.workers.pg_storage_async import insert_events_into_data_async, \
+    insert_events_into_nok_data_async, put_events_async
+
+logger = logging.getLogger(__name__)
+
+
+class _RequestInfo(NamedTuple):
+    """ The parts of a request that add_enriched_contexts() uses, with the same names as flask uses. """
+    headers: Headers
+    remote_addr: Optional[str]
+
+
+async def collect(request: Request) -> Response:
+    """
+    Endpoint that accepts event data from the tracker and stores it for further processing.
+    See collector.collect()
+    """
+    current_millis = round(time.time() * 1000)
+    cookie_id = _get_cookie_id(request)
+    try:
+        content_length = request.headers.get('Content-Length')
+        if content_length and content_length.isdigit() and int(content_length) > DATA_MAX_SIZE_BYTES:
+            raise ValueError(f'Data size exceeds limit')
+        post_data = await request.body()
+        with timed(COLLECTOR_STAGE_SECONDS.labels(stage='parse')):
+            event_data = parse_event_data(post_data)
+        events: EventDataList = event_data['events']
+        transport_time: int = event_data['transport_time']
+    except ValueError as exc:
+        logger.info('Data problem: %s', exc)
+        COLLECTOR_REQUESTS.labels(result='data_error').inc()
+        return _get_collector_response(cookie_id, error_count=1, event_count=-1, data_error=exc.__str__())
+    COLLECTOR_REQUEST_EVENTS.observe(len(events))
+
+    # Do all the enrichment steps that can only be done in this phase
+    request_info = _RequestInfo(headers=request.headers,
+                                remote_addr=request.client.host if request.client else None)
+    with timed(COLLECTOR_STAGE_SECONDS.labels(stage='enrich')):
+        add_enriched_contexts(events, request=request_info, cookie_id=cookie_id)
+        set_time_in_events(events, current_millis, transport_time)
+
+    pg_pool: Optional[asyncpg.Pool] = request.app.state.pg_pool
+    if not get_collector_config().async_mode:
+        ok_events, nok_events, event_errors = validate_events(events=events, current_millis=current_millis)
+        await write_sync_events(pg_pool, ok_events=ok_events, nok_events=nok_events, event_errors=event_errors)
+        COLLECTOR_REQUESTS.labels(result='ok').inc()
+        return _get_collector_response(
+            cookie_id, error_count=len(nok_events), event_count=len(events), event_errors=event_errors)
+    else:
+        await write_async_events(pg_pool, events=events)
+        COLLECTOR_REQUESTS.labels(result='ok').inc()
+        return _get_collector_response(cookie_id, error_count=0, event_count=len(events))
+
+
+async def schema(request: Request) -> Response:
+    """ Endpoint that returns the event schema in our own notation. See schema.schema() """
+    event_schema = get_collector_config().event_schema
+    return _get_schema_response(request, get_rendered_schema(event_schema))
+
+
+async def json_schema(request: Request) -> Response:
+    """ Endpoint that returns a jsonschema that describes the event schema. See schema.json_schema() """
+    event_schema = get_collector_config().event_schema
+    return _get_schema_response(request, get_rendered_json_schema(event_schema))
+
+
+async def metrics(request: Request) -> Response:
+    """ Endpoint that returns the metrics of the collector. See metrics.metrics() """
+    body, content_type = render_metrics()
+    return Response(body, status_code=200, media_type=content_type)
+
+
+async def write_sync_events(pg_pool: Optional[asyncpg.Pool],
+                            ok_events: EventDataList,
+                            nok_events: EventDataList,
+                            event_errors: List[EventError] = None):
+    """
+    Write the events to the configured sinks concurrently. See collector.write_sync_events()
+    :param pg_pool: pool of asyncpg connections. Must be set if postgres output is configured.
+    """
+    output_config = get_collector_config().output
+    serialized_ok_events = [json_dumps(event) for event in ok_events]
+    serialized_nok_events = [json_dumps(event) for event in nok_events]
+    writes: List[Awaitable] = []
+    if output_config.postgres and pg_pool:
+        writes.append(_write_sync_events_to_postgres(
+            pg_pool, ok_events, nok_events, serialized_ok_events, serialized_nok_events))
+
+    if output_config.snowplow:
+        writes.append(_run_blocking(write_data_to_snowplow_if_configured, events=ok_events, good=True))
+        writes.append(_run_blocking(write_data_to_snowplow_if_configured,
+                                    events=nok_events, good=False, event_errors=event_errors))
+
+    if output_config.parquet:
+        writes.append(_run_blocking(write_data_to_parquet_if_configured, events=ok_events))
+
+    for prefix, events, serialized_events in (('OK', ok_events, serialized_ok_events),
+                                              ('NOK', nok_events, serialized_nok_events)):
+        if events:
+            writes.extend(_write_events_to_files(events, serialized_events, prefix))
+    await asyncio.gather(*writes)
+
+
+async def write_async_events(pg_pool: Optional[asyncpg.Pool], events: EventDataList):
+    """
+    Write the events to the configured sinks concurrently. See collector.write_async_events()
+    :param pg_pool: pool of asyncpg connections. Must be set if postgres output is configured.
+    """
+    output_config = get_collector_config().output
+    serialized_events = [json_dumps(event) for event in events]
+    writes: List[Awaitable] = []
+    if output_config.postgres and pg_pool:
+        writes.append(_write_async_events_to_postgres(pg_pool, events, serialized_events))
+    if events:
+        writes.extend(_write_events_to_files(events, serialized_events, 'RAW'))
+    await asyncio.gather(*writes)
+
+
+async def _write_sync_events_to_postgres(pg_pool: asyncpg.Pool,
+                                         ok_events: EventDataList,
+                                         nok_events: EventDataList,
+                                         serialized_ok_events: List[str],
+                                         serialized_nok_events: List[str]):
+    pool_timeout = _get_pool_timeout()
+    try:
+        with timed(OUTPUT_WRITE_SECONDS.labels(output='postgres')):
+            async with pg_pool.acquire(timeout=pool_timeout) as connection:
+                async with connection.transaction():
+                    await insert_events_into_data_async(
+                        connection, events=ok_events, serialized_events=serialized_ok_events)
+                    await insert_events_into_nok_data_async(
+                        connection, events=nok_events, serialized_events=serialized_nok_events)
+    except (asyncpg.PostgresError, OSError, asyncio.TimeoutError) as oe:
+        logger.error('Error occurred in postgres: %s', oe)
+
+
+async def _write_async_events_to_postgres(pg_pool: asyncpg.Pool,
+                                          events: EventDataList,
+                                          serialized_events: List[str]):
+    pool_timeout = _get_pool_timeout()
+    with timed(OUTPUT_WRITE_SECONDS.labels(output='postgres_queue')):
+        async with pg_pool.acquire(timeout=pool_timeout) as connection:
+            async with connection.transaction():
+                await put_events_async(
+                    connection, queue=ProcessingStage.ENTRY, events=events, serialized_events=serialized_events)
+
+
+def _get_pool_timeout() -> float:
+    pg_config = get_collector_config().output.postgres
+    return pg_config.pool_timeout if pg_config else 0
+
+
+def _write_events_to_files(events: EventDataList, serialized_events: List[str], prefix: str) -> List[Awaitable]:
+    """ Give the awaitables that write the events to the file system and S3, if those are configured. """
+    output_config = get_collector_config().output
+    if not output_config.file_system and not output_config.aws:
+        return []
+    data = events_to_json(events, serialized_events=serialized_events)
+    moment = datetime.utcnow()
+    return [_run_blocking(write_data_to_fs_if_configured, data=data, prefix=prefix, moment=moment),
+            _run_blocking(write_data_to_s3_if_configured, data=data, prefix=prefix, moment=moment)]
+
+
+def _run_blocking(function, **kwargs: Any) -> asyncio.Future:
+    """ Run a blocking function in the default thread pool executor. """
+    return asyncio.get_running_loop().run_in_executor(None, functools.partial(function, **kwargs))
+
+
+def _get_cookie_id(request: Request) -> Optional[str]:
+    """
+    Get the tracking cookie uuid from the request, or generate a random one if the request doesn't have
+    one. Returns None if cookies are not configured. See common.get_cookie_id()
+    """
+    cookie_config = get_collector_config().cookie
+    if not cookie_config:
+        return None
+    cookie_id = request.cookies.get(cookie_config.name)
+    if not cookie_id:
+        cookie_id = str(uuid.uuid4())
+        logger.debug('Generating cookie_id: %s', cookie_id)
+    return cookie_id
+
+
+def _get_collector_response(cookie_id: Optional[str],
+                            error_count: int,
+                            event_count: int,
+                            event_errors: List[EventError] = None,
+                            data_error: str = '') -> Response:
+    msg = get_collector_response_message(error_count=error_count,
+                                         event_count=event_count,
+                                         event_errors=event_errors,
+                                         data_error=data_error)
+    # we always return a HTTP 200 status code, so we can handle any errors
+    # on the application layer.
+    return _get_json_response(status=200, msg=msg, cookie_id=cookie_id)
+
+
+def _get_schema_response(request: Request, rendered_body: RenderedBody) -> Response:
+    schema_response = get_schema_response(rendered_body,
+                                          if_none_match=request.headers.get('If-None-Match'),
+                                          accept_encoding=request.headers.get('Accept-Encoding'))
+    response = _get_json_response(status=schema_response.status,
+                                  msg=schema_response.body,
+                                  cookie_id=_get_cookie_id(request))
+    response.headers.update(schema_response.headers)
+    return response
+
+
+def _get_json_response(status: int, msg: Union[str, bytes], cookie_id: Optional[str]) -> Response:
+    """
+    Create a Response object, with json content, and a cookie set if needed. See common.get_json_response()
+    """
+    response = Response(content=msg, status_code=status, media_type='application/json')
+    cookie_config = get_collector_config().cookie
+    if cookie_config and cookie_id:
+        response.set_cookie(key=cookie_config.name, value=cookie_id,
+                            max_age=cookie_config.duration, samesite=cookie_config.samesite.lower(),  # type: ignore
+                            secure=cookie_config.secure)
+    return response
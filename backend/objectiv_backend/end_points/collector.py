@@ -1,22 +1,28 @@
-import json
+import logging
+import os
+import threading
 import urllib.parse
 from datetime import datetime
 
 import flask
 import time
 from urllib.parse import urlparse, parse_qs
-from typing import List
+from typing import List, Optional, Any, Tuple
 
 import psycopg2
 from flask import Response, Request
 
-from objectiv_backend.common.config import get_collector_config
+from objectiv_backend.common.config import DATA_MAX_EVENT_COUNT, get_collector_config
 from objectiv_backend.common.types import EventData, EventDataList, EventList
-from objectiv_backend.common.db import get_db_connection
-from objectiv_backend.common.event_utils import add_global_context_to_event, get_contexts
+from objectiv_backend.common.db import get_pooled_db_connection
+from objectiv_backend.common.event_utils import add_global_context_to_event, get_optional_context
+from objectiv_backend.common.json_codec import json_dumps, json_loads
+from objectiv_backend.common.metrics import COLLECTOR_EVENTS, COLLECTOR_REQUEST_BYTES, COLLECTOR_REQUEST_EVENTS, \
+    COLLECTOR_REQUESTS, COLLECTOR_STAGE_SECONDS, OUTPUT_WRITE_SECONDS, timed
 from objectiv_backend.end_points.common import get_json_response, get_cookie_id
+from objectiv_backend.end_points.event_buffer import EventBuffer
 from objectiv_backend.end_points.extra_output import events_to_json, write_data_to_fs_if_configured, \
-    write_data_to_s3_if_configured, write_data_to_snowplow_if_configured
+    write_data_to_parquet_if_configured, write_data_to_s3_if_configured, write_data_to_snowplow_if_configured
 from objectiv_backend.schema.validate_events import validate_structure_event_list, EventError
 from objectiv_backend.workers.pg_queues import PostgresQueues, ProcessingStage
 from objectiv_backend.workers.pg_storage import insert_events_into_nok_data
@@ -27,7 +33,8 @@ from objectiv_backend.schema.schema import HttpContext, CookieIdContext, Marketi
 
 # Some limits on the inputs we accept
 DATA_MAX_SIZE_BYTES = 1_000_000
-DATA_MAX_EVENT_COUNT = 1_000
+
+logger = logging.getLogger(__name__)
 
 
 def collect() -> Response:
@@ -36,28 +43,77 @@ def collect() -> Response:
     """
     current_millis = round(time.time() * 1000)
     try:
-        event_data: EventList = _get_event_data(flask.request)
+        with timed(COLLECTOR_STAGE_SECONDS.labels(stage='parse')):
+            event_data: EventList = _get_event_data(flask.request)
         events: EventDataList = event_data['events']
         transport_time: int = event_data['transport_time']
     except ValueError as exc:
-        print(f'Data problem: {exc}')  # todo: real error logging
+        logger.info('Data problem: %s', exc)
+        COLLECTOR_REQUESTS.labels(result='data_error').inc()
         return _get_collector_response(error_count=1, event_count=-1, data_error=exc.__str__())
+    COLLECTOR_REQUEST_EVENTS.observe(len(events))
 
     # Do all the enrichment steps that can only be done in this phase
-    add_enriched_contexts(events)
-
-    set_time_in_events(events, current_millis, transport_time)
+    with timed(COLLECTOR_STAGE_SECONDS.labels(stage='enrich')):
+        add_enriched_contexts(events)
+        set_time_in_events(events, current_millis, transport_time)
 
+    buffered = get_collector_config().buffer is not None
     if not get_collector_config().async_mode:
-        ok_events, nok_events, event_errors = process_events_entry(events=events, current_millis=current_millis)
-        print(f'ok_events: {len(ok_events)}, nok_events: {len(nok_events)}')
-        write_sync_events(ok_events=ok_events, nok_events=nok_events, event_errors=event_errors)
+        ok_events, nok_events, event_errors = validate_events(events=events, current_millis=current_millis)
+        if not buffered:
+            write_sync_events(ok_events=ok_events, nok_events=nok_events, event_errors=event_errors)
+        elif not _get_event_buffer().add(ok_events, nok_events, event_errors):
+            return _get_buffer_full_response(event_count=len(events))
+        COLLECTOR_REQUESTS.labels(result='ok').inc()
         return _get_collector_response(error_count=len(nok_events), event_count=len(events), event_errors=event_errors)
     else:
-        write_async_events(events=events)
+        if not buffered:
+            write_async_events(events=events)
+        elif not _get_event_buffer().add(events):
+            return _get_buffer_full_response(event_count=len(events))
+        COLLECTOR_REQUESTS.labels(result='ok').inc()
         return _get_collector_response(error_count=0, event_count=len(events))
 
 
+def validate_events(events: EventDataList, current_millis: int) -> \
+        Tuple[EventDataList, EventDataList, List[EventError]]:
+    """ Validate and hydrate the events with process_events_entry(), and record the metrics of that. """
+    with timed(COLLECTOR_STAGE_SECONDS.labels(stage='validate')):
+        ok_events, nok_events, event_errors = process_events_entry(events=events, current_millis=current_millis)
+    COLLECTOR_EVENTS.labels(result='ok').inc(len(ok_events))
+    COLLECTOR_EVENTS.labels(result='nok').inc(len(nok_events))
+    logger.debug('ok_events: %d, nok_events: %d', len(ok_events), len(nok_events))
+    return ok_events, nok_events, event_errors
+
+
+_EVENT_BUFFER: Optional[EventBuffer] = None
+_EVENT_BUFFER_LOCK = threading.Lock()
+
+
+def _get_event_buffer() -> EventBuffer:
+    """
+    Get the process-wide event buffer, create it if it doesn't exist yet. Should only be called if buffering
+    is configured.
+    """
+    global _EVENT_BUFFER
+    with _EVENT_BUFFER_LOCK:
+        if _EVENT_BUFFER is None or _EVENT_BUFFER.pid != os.getpid():
+            buffer_config = get_collector_config().buffer
+            assert buffer_config is not None  # help out mypy
+            _EVENT_BUFFER = EventBuffer(write_function=_write_buffered_events, buffer_config=buffer_config)
+        return _EVENT_BUFFER
+
+
+def _write_buffered_events(ok_events: EventDataList, nok_events: EventDataList, event_errors: List[EventError]):
+    """ Write a batch of events from the event buffer to the outputs. """
+    logger.debug('Writing buffered events, ok_events: %d, nok_events: %d', len(ok_events), len(nok_events))
+    if not get_collector_config().async_mode:
+        write_sync_events(ok_events=ok_events, nok_events=nok_events, event_errors=event_errors)
+    else:
+        write_async_events(events=ok_events)
+
+
 def _get_event_data(request: Request) -> EventList:
     """
     Parse the requests data as json and return as a list
@@ -74,11 +130,25 @@ def _get_event_data(request: Request) -> EventList:
     :param request: Request from which to parse the data
     :return: the parsed data, an EventList (structure as sent by the tracker)
     """
-    post_data = request.data
+    if request.content_length is not None and request.content_length > DATA_MAX_SIZE_BYTES:
+        # refuse before reading the data, if the client already told us it's too big
+        raise ValueError(f'Data size exceeds limit')
+    # Read the raw bytes without caching them on the request, and parse those directly. No need to decode
+    # them to a string first.
+    post_data = request.get_data(cache=False)
+    return parse_event_data(post_data)
+
+
+def parse_event_data(post_data: bytes) -> EventList:
+    """
+    Parse the posted data as json and return as a list. See _get_event_data() for the checks that are done.
+    :raise ValueError: if the data is not valid
+    """
+    COLLECTOR_REQUEST_BYTES.observe(len(post_data))
     if len(post_data) > DATA_MAX_SIZE_BYTES:
         # if it's more than a megabyte, we'll refuse to process
         raise ValueError(f'Data size exceeds limit')
-    event_data: EventList = json.loads(post_data)
+    event_data: EventList = json_loads(post_data)
     if not isinstance(event_data, dict):
         raise ValueError('Parsed post data is not a dict')
     if 'events' not in event_data:
@@ -99,7 +169,35 @@ def _get_collector_response(
     """
     Create a Response object, with a json message with event counts, and a cookie set if needed.
     """
+    msg = get_collector_response_message(error_count=error_count,
+                                         event_count=event_count,
+                                         event_errors=event_errors,
+                                         data_error=data_error)
+    # we always return a HTTP 200 status code, so we can handle any errors
+    # on the application layer.
+    return get_json_response(status=200, msg=msg)
+
 
+def _get_buffer_full_response(event_count: int) -> Response:
+    """
+    Create a Response object that tells the tracker that none of the events were accepted, because the event
+    buffer is full. Unlike other errors this uses HTTP status 503, so the tracker will retry later.
+    """
+    logger.warning('Event buffer full, refused %d events', event_count)
+    COLLECTOR_REQUESTS.labels(result='buffer_full').inc()
+    msg = get_collector_response_message(error_count=event_count,
+                                         event_count=event_count,
+                                         data_error='Event buffer is full')
+    response = get_json_response(status=503, msg=msg)
+    response.headers['Retry-After'] = '1'
+    return response
+
+
+def get_collector_response_message(
+        error_count: int, event_count: int, event_errors: List[EventError] = None, data_error: str = '') -> str:
+    """
+    Create the json message with event counts, that the collector returns to the tracker.
+    """
     if not get_collector_config().error_reporting:
         event_errors = []
         data_error = ''
@@ -108,37 +206,43 @@ def _get_collector_response(
             event_errors = []
 
     status = 200 if error_count == 0 else 400
-    msg = json.dumps({
+    msg = json_dumps({
         "status": f"{status}",
         "error_count": error_count,
         "event_count": event_count,
         "event_errors": event_errors,
         "data_error": data_error
     })
-    # we always return a HTTP 200 status code, so we can handle any errors
-    # on the application layer.
-    return get_json_response(status=200, msg=msg)
+    return msg
 
 
-def add_enriched_contexts(events: EventDataList):
+def add_enriched_contexts(events: EventDataList, request: Any = None, cookie_id: Optional[str] = None):
     """
     Enrich the list of events
+    :param events: events to enrich
+    :param request: request that contained the events, flask.request if not set. Only the `headers` and
+        `remote_addr` attributes are used.
+    :param cookie_id: cookie id of the request, get_cookie_id() if not set. Not used if cookies are not
+        enabled.
     """
-
-    add_cookie_id_contexts(events)
+    if request is None:
+        request = flask.request
+    add_cookie_id_contexts(events, cookie_id=cookie_id)
     for event in events:
-        add_http_context_to_event(event=event, request=flask.request)
+        add_http_context_to_event(event=event, request=request)
         add_marketing_context_to_event(event=event)
 
 
-def add_cookie_id_contexts(events: EventDataList):
+def add_cookie_id_contexts(events: EventDataList, cookie_id: Optional[str] = None):
     """
     Modify the given list of events: Add the CookieIdContext to each event, if cookies are enabled.
+    :param cookie_id: cookie id of the request, get_cookie_id() if not set.
     """
     cookie_config = get_collector_config().cookie
     if not cookie_config:
         return
-    cookie_id = get_cookie_id()
+    if cookie_id is None:
+        cookie_id = get_cookie_id()
     cookie_id_context = CookieIdContext(id=cookie_id, cookie_id=cookie_id)
     for event in events:
         add_global_context_to_event(event, cookie_id_context)
@@ -159,7 +263,7 @@ def set_time_in_events(events: EventDataList, current_millis: int, client_millis
         client_millis = current_millis
 
     offset = current_millis - client_millis
-    print(f'debug - time offset: {offset}')
+    logger.debug('time offset: %d', offset)
     for event in events:
         # here we correct the tracking time with the calculated offset
         # the assumption here is that transport time should be the same as the server time (current_millis)
@@ -211,9 +315,8 @@ def add_http_context_to_event(event: EventData, request: Request):
 
     # check if there is a pre-existing http_context
     # if so, use that.
-    contexts = get_contexts(event, 'HttpContext')
-    if contexts:
-        tracker_http_context = contexts[0]
+    tracker_http_context = get_optional_context(event, 'HttpContext')
+    if tracker_http_context:
         tracker_http_context['remote_address'] = remote_address
     else:
         # if a pre-existing context cannot be found, we create one from scratch
@@ -234,13 +337,11 @@ def add_marketing_context_to_event(event: EventData) -> None:
     :param event: EventData
     :return:
     """
-    path_contexts = get_contexts(event, 'PathContext')
+    path_context = get_optional_context(event, 'PathContext')
 
-    if not path_contexts:
+    if not path_context:
         # without a PathContext, we have no query_string
         return
-    else:
-        path_context = path_contexts[0]
 
     query_string = urlparse(str(path_context.get('id', ''))).query
     parsed_qs = parse_qs(query_string)
@@ -292,30 +393,39 @@ def write_sync_events(ok_events: EventDataList, nok_events: EventDataList, event
         * postgres
         * aws
         * file system
+        * parquet - only the ok events
+
+    Each event is serialized to json only once, the result is used for all sinks.
     """
     output_config = get_collector_config().output
+    serialized_ok_events = [json_dumps(event) for event in ok_events]
+    serialized_nok_events = [json_dumps(event) for event in nok_events]
     # todo: add exception handling. if one output fails, continue to next if configured.
     if output_config.postgres:
         try:
-            connection = get_db_connection(output_config.postgres)
-            try:
+            with timed(OUTPUT_WRITE_SECONDS.labels(output='postgres')), \
+                    get_pooled_db_connection(output_config.postgres) as connection:
                 with connection:
-                    insert_events_into_data(connection, events=ok_events)
-                    insert_events_into_nok_data(connection, events=nok_events)
-            finally:
-                connection.close()
-        except psycopg2.DatabaseError as oe:
-            print(f'Error occurred in postgres: {oe}')
+                    insert_events_into_data(connection, events=ok_events, serialized_events=serialized_ok_events)
+                    insert_events_into_nok_data(connection,
+                                                events=nok_events,
+                                                serialized_events=serialized_nok_events)
+        except psycopg2.Error as oe:
+            logger.error('Error occurred in postgres: %s', oe)
 
     if output_config.snowplow:
         write_data_to_snowplow_if_configured(events=ok_events, good=True)
         write_data_to_snowplow_if_configured(events=nok_events, good=False, event_errors=event_errors)
 
+    if output_config.parquet:
+        write_data_to_parquet_if_configured(events=ok_events)
+
     if not output_config.file_system and not output_config.aws:
         return
-    for prefix, events in ('OK', ok_events), ('NOK', nok_events):
+    for prefix, events, serialized_events in (('OK', ok_events, serialized_ok_events),
+                                              ('NOK', nok_events, serialized_nok_events)):
         if events:
-            data = events_to_json(events)
+            data = events_to_json(events, serialized_events=serialized_events)
             moment = datetime.utcnow()
             write_data_to_fs_if_configured(data=data, prefix=prefix, moment=moment)
             write_data_to_s3_if_configured(data=data, prefix=prefix, moment=moment)
@@ -327,23 +437,24 @@ def write_async_events(events: EventDataList):
         * postgres - To the entry queue
         * aws - to the 'RAW' prefix
         * file system - to the 'RAW' directory
+
+    Each event is serialized to json only once, the result is used for all sinks.
     """
     output_config = get_collector_config().output
+    serialized_events = [json_dumps(event) for event in events]
     # todo: add exception handling. if one output fails, continue to next if configured.
     if output_config.postgres:
-        connection = get_db_connection(output_config.postgres)
-        try:
+        with timed(OUTPUT_WRITE_SECONDS.labels(output='postgres_queue')), \
+                get_pooled_db_connection(output_config.postgres) as connection:
             with connection:
                 pg_queue = PostgresQueues(connection=connection)
-                pg_queue.put_events(queue=ProcessingStage.ENTRY, events=events)
-        finally:
-            connection.close()
+                pg_queue.put_events(queue=ProcessingStage.ENTRY, events=events, serialized_events=serialized_events)
 
     if not output_config.file_system and not output_config.aws:
         return
     prefix = 'RAW'
     if events:
-        data = events_to_json(events)
+        data = events_to_json(events, serialized_events=serialized_events)
         moment = datetime.utcnow()
         write_data_to_fs_if_configured(data=data, prefix=prefix, moment=moment)
         write_data_to_s3_if_configured(data=data, prefix=prefix, moment=moment)
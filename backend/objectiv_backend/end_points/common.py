@@ -1,11 +1,14 @@
 """
 Copyright 2021 Objectiv B.V.
 """
+import logging
 import uuid
 import flask
 from flask import Response
 from objectiv_backend.common.config import get_collector_config
 
+logger = logging.getLogger(__name__)
+
 
 def get_json_response(status: int, msg: str) -> Response:
     """
@@ -46,6 +49,6 @@ def get_cookie_id() -> str:
         # use uuid4 (random), so there is no predictability and bad actors cannot ruin sessions of others
         cookie_id = str(uuid.uuid4())
         flask.g.G_COOKIE_ID = cookie_id
-        print(f'Generating cookie_id: {cookie_id}')
+        logger.debug('Generating cookie_id: %s', cookie_id)
 
     return str(cookie_id)
@@ -0,0 +1,157 @@
+"""
+Copyright 2022 Objectiv B.V.
+
+In-process buffer, that lets the collector write events to the outputs in batches instead of per request.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+from objectiv_backend.common.config import BufferConfig
+from objectiv_backend.common.types import EventDataList
+from objectiv_backend.schema.validate_events import EventError
+
+# A write function takes a list of ok events, a list of not-ok events and the errors of the not-ok events
+WriteFunction = Callable[[EventDataList, EventDataList, List[EventError]], None]
+
+logger = logging.getLogger(__name__)
+
+
+class EventBuffer:
+    """
+    Thread-safe, bounded buffer of events, with a background thread that writes the buffered events.
+
+    add() only appends the events to the buffer. The background thread calls write_function with all
+    buffered events, as soon as the buffer contains buffer_config.flush_events events, or the oldest
+    buffered events were added buffer_config.flush_interval_seconds ago.
+
+    The buffer holds at most buffer_config.max_events events, including the events that are being written.
+    If the outputs cannot keep up, then add() will refuse new events, which the collector should pass on
+    to the tracker.
+
+    Events in the buffer are lost if the process is killed. close() writes the remaining events, it's
+    called automatically when the Python interpreter exits normally.
+
+    A buffer should only be used by the process that created it, the background thread does not survive
+    a fork.
+    """
+
+    def __init__(self, write_function: WriteFunction, buffer_config: BufferConfig):
+        self.write_function = write_function
+        self.buffer_config = buffer_config
+        self.pid = os.getpid()
+        self._condition = threading.Condition()
+        self._ok_events: EventDataList = []
+        self._nok_events: EventDataList = []
+        self._event_errors: List[EventError] = []
+        # time.monotonic() of when the oldest events in the buffer were added, None if the buffer is empty
+        self._oldest_added: Optional[float] = None
+        # number of events that the background thread is writing
+        self._writing_count = 0
+        self._flush_requested = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._flush_loop, name='event-buffer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def add(self,
+            ok_events: EventDataList,
+            nok_events: EventDataList = None,
+            event_errors: List[EventError] = None) -> bool:
+        """
+        Add events to the buffer.
+        :param ok_events: events to write
+        :param nok_events: events that failed validation
+        :param event_errors: errors of the events in nok_events
+        :return: True if the events were added. False if the buffer is full or closed, in that case none of
+            the events were added.
+        """
+        nok_events = nok_events or []
+        event_count = len(ok_events) + len(nok_events)
+        with self._condition:
+            if self._closed or \
+                    self._buffered_count() + self._writing_count + event_count > self.buffer_config.max_events:
+                return False
+            if event_count == 0:
+                return True
+            self._ok_events.extend(ok_events)
+            self._nok_events.extend(nok_events)
+            self._event_errors.extend(event_errors or [])
+            if self._oldest_added is None:
+                self._oldest_added = time.monotonic()
+                # the background thread needs to start the flush timer
+                self._condition.notify_all()
+            if self._buffered_count() >= self.buffer_config.flush_events:
+                self._condition.notify_all()
+        return True
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Write all buffered events now, and wait until they are written.
+        :return: True if all events were written, False if the timeout expired first.
+        """
+        with self._condition:
+            self._flush_requested = True
+            self._condition.notify_all()
+            return self._condition.wait_for(
+                lambda: self._buffered_count() == 0 and self._writing_count == 0, timeout=timeout)
+
+    def close(self, timeout: float = None):
+        """
+        Refuse new events, write the buffered events, and stop the background thread.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(timeout=timeout)
+        atexit.unregister(self.close)
+
+    def _buffered_count(self) -> int:
+        return len(self._ok_events) + len(self._nok_events)
+
+    def _is_flush_due(self) -> bool:
+        if self._buffered_count() == 0:
+            return False
+        if self._closed or self._flush_requested or self._buffered_count() >= self.buffer_config.flush_events:
+            return True
+        assert self._oldest_added is not None  # help out mypy
+        return time.monotonic() - self._oldest_added >= self.buffer_config.flush_interval_seconds
+
+    def _seconds_until_flush(self) -> Optional[float]:
+        if self._oldest_added is None:
+            return None
+        return max(0.0, self._oldest_added + self.buffer_config.flush_interval_seconds - time.monotonic())
+
+    def _take(self) -> Tuple[EventDataList, EventDataList, List[EventError]]:
+        """ Take all events from the buffer. Must be called while holding the lock. """
+        batch = self._ok_events, self._nok_events, self._event_errors
+        self._ok_events, self._nok_events, self._event_errors = [], [], []
+        self._oldest_added = None
+        self._flush_requested = False
+        self._writing_count = len(batch[0]) + len(batch[1])
+        return batch
+
+    def _flush_loop(self):
+        while True:
+            with self._condition:
+                while not self._is_flush_due():
+                    if self._closed:
+                        return
+                    if self._flush_requested:
+                        # nothing to flush
+                        self._flush_requested = False
+                        self._condition.notify_all()
+                    self._condition.wait(timeout=self._seconds_until_flush())
+                ok_events, nok_events, event_errors = self._take()
+            try:
+                self.write_function(ok_events, nok_events, event_errors)
+            except Exception as exc:
+                # The events were already acknowledged, so there is nobody to pass the error on to.
+                logger.error('Error writing %d buffered events: %s', len(ok_events) + len(nok_events), exc)
+            finally:
+                with self._condition:
+                    self._writing_count = 0
+                    self._condition.notify_all()
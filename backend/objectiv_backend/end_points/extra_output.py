@@ -3,77 +3,217 @@ Copyright 2021 Objectiv B.V.
 
 Functions to write data to S3 and the local filesystem.
 
+The file system and S3 outputs append the events to segment files, that are compressed and rotated by size
+and age, see segment_writer.py and SegmentConfig.
+
 This is experimental code, and not ready for production use.
 """
-import json
+import logging
+import os
+import tempfile
+import threading
 from datetime import datetime
-from io import BytesIO
-
-from typing import List
-
+from functools import lru_cache, partial
+from typing import Any, Dict, List, Optional, Tuple
 
 from objectiv_backend.common.config import get_collector_config, SnowplowConfig
+from objectiv_backend.common.json_codec import json_dumps
+from objectiv_backend.common.metrics import OUTPUT_WRITE_SECONDS, timed
 from objectiv_backend.common.types import EventDataList
+from objectiv_backend.end_points.segment_writer import SegmentWriter
 from objectiv_backend.schema.validate_events import EventError
 from objectiv_backend.snowplow.snowplow_helper import write_data_to_aws_pipeline, write_data_to_gcp_pubsub
 
 if get_collector_config().output.aws:
     import boto3
+    from boto3.exceptions import S3UploadFailedError
+    from boto3.s3.transfer import TransferConfig
     from botocore.exceptions import ClientError
 
+if get_collector_config().output.parquet:
+    from objectiv_backend.end_points.parquet_output import get_parquet_sink
+
+# Segments larger than this are uploaded to S3 in parts of this size, with a multipart upload
+S3_MULTIPART_THRESHOLD = 16 * 1024 * 1024
+S3_MULTIPART_CHUNKSIZE = 16 * 1024 * 1024
+
+# Local directory of the S3 output, the segments are written to <S3_SPOOL_DIRECTORY>/<prefix>/ until they
+# are uploaded
+S3_SPOOL_DIRECTORY = os.path.join(tempfile.gettempdir(), 'objectiv-segments')
+
+# Segment writers per output and prefix
+_SEGMENT_WRITERS: Dict[Tuple[str, str], SegmentWriter] = {}
+_SEGMENT_WRITERS_LOCK = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
 
-def events_to_json(events: EventDataList) -> str:
+def events_to_json(events: EventDataList, serialized_events: Optional[List[str]] = None) -> str:
     """
     Convert list of events to a string with on each line a json object representing a single event.
     Note that the returned string is not a json list; This format makes it suitable as raw input to AWS
-    Athena.
+    Athena, and it can be appended to a segment file as is.
+    :param events: list of events
+    :param serialized_events: optional, the events serialized with json_dumps(). If set, these are reused
+        instead of serializing the events again.
     """
-    return json.dumps(events)
+    if serialized_events is None:
+        serialized_events = [json_dumps(event) for event in events]
+    return '\n'.join(serialized_events)
 
 
 def write_data_to_fs_if_configured(data: str, prefix: str, moment: datetime) -> None:
     """
     Write data to disk, if file_system output is configured. If file_system output is not configured, then
     this function returns directly.
-    :param data: data to write
-    :param prefix: directory prefix, added to path after the configured path/ and before /filename.json
+
+    The data is appended to the current segment file of the prefix. Closed segments are moved to the
+    configured path/prefix/ directory, see SegmentWriter for the naming.
+    :param data: data to write, newline-delimited json
+    :param prefix: directory prefix, added to path after the configured path/ and before /filename
     :param moment: timestamp that the data arrived
     """
     fs_config = get_collector_config().output.file_system
     if not fs_config:
         return
-    timestamp = moment.timestamp()
-    path = f'{fs_config.path}/{prefix}/{timestamp}.json'
-    with open(path, 'w') as of:
-        of.write(data)
+    with timed(OUTPUT_WRITE_SECONDS.labels(output='file_system')):
+        _get_segment_writer('file_system', prefix).write(data, moment)
 
 
 def write_data_to_s3_if_configured(data: str, prefix: str, moment: datetime) -> None:
     """
     Write data to AWS S3, if S3 output is configured. if aws s3 output is not configured, then this
     function returns directly.
-    :param data: data to write
+
+    The data is appended to the current segment file of the prefix, in S3_SPOOL_DIRECTORY. Closed
+    segments are uploaded, and then removed locally. Segments that fail to upload are kept, and uploaded
+    again once a writer for the prefix is created, e.g. after a restart.
+    :param data: data to write, newline-delimited json
     :param prefix: prefix, included in the keyname after the configured path/ and datestamp/ and
-        before /filename.json
+        before /filename
     :param moment: timestamp that the data arrived
     """
     aws_config = get_collector_config().output.aws
     if not aws_config:
         return
+    with timed(OUTPUT_WRITE_SECONDS.labels(output='aws')):
+        _get_segment_writer('aws', prefix).write(data, moment)
+
+
+def rotate_segments() -> None:
+    """ Close and publish the current segments of the file system and S3 outputs of this process. """
+    with _SEGMENT_WRITERS_LOCK:
+        writers = [writer for writer in _SEGMENT_WRITERS.values() if writer.pid == os.getpid()]
+    for writer in writers:
+        writer.rotate()
 
-    timestamp = moment.timestamp()
+
+def _get_segment_writer(output: str, prefix: str) -> SegmentWriter:
+    """
+    Get the segment writer of this process for an output and prefix, create it if needed.
+    :param output: 'file_system' or 'aws'
+    """
+    with _SEGMENT_WRITERS_LOCK:
+        writer = _SEGMENT_WRITERS.get((output, prefix))
+        # a forked process must not use the writer of its parent
+        if writer is None or writer.pid != os.getpid():
+            writer = _create_segment_writer(output, prefix)
+            _SEGMENT_WRITERS[(output, prefix)] = writer
+        return writer
+
+
+def _create_segment_writer(output: str, prefix: str) -> SegmentWriter:
+    output_config = get_collector_config().output
+    if output == 'file_system':
+        assert output_config.file_system is not None  # help out mypy
+        directory = os.path.join(output_config.file_system.path, prefix)
+        return SegmentWriter(directory=directory,
+                             publish=partial(_publish_segment_to_fs, directory),
+                             segment_config=output_config.file_system.segment)
+    assert output_config.aws is not None  # help out mypy
+    directory = os.path.join(S3_SPOOL_DIRECTORY, prefix)
+    writer = SegmentWriter(directory=directory,
+                           publish=partial(_publish_segment_to_s3, prefix),
+                           segment_config=output_config.aws.segment)
+    # Upload the segments that failed to upload before, in the background, so the write that creates the
+    # writer doesn't wait for it
+    threading.Thread(target=_publish_pending_segments_to_s3, args=(prefix, directory),
+                     name='segment-retry', daemon=True).start()
+    return writer
+
+
+def _publish_segment_to_fs(directory: str, path: str, name: str, moment: datetime):
+    os.replace(path, os.path.join(directory, name))
+
+
+def _publish_segment_to_s3(prefix: str, path: str, name: str, moment: datetime):
+    aws_config = get_collector_config().output.aws
+    assert aws_config is not None  # help out mypy
     datestamp = moment.strftime('%Y/%m/%d')
-    object_name = f'{aws_config.s3_prefix}/{datestamp}/{prefix}/{timestamp}.json'
-    file_obj = BytesIO(data.encode('utf-8'))
-    s3_client = boto3.client(
+    object_name = f'{aws_config.s3_prefix}/{datestamp}/{prefix}/{name}'
+    transfer_config = TransferConfig(multipart_threshold=S3_MULTIPART_THRESHOLD,
+                                     multipart_chunksize=S3_MULTIPART_CHUNKSIZE)
+    try:
+        with timed(OUTPUT_WRITE_SECONDS.labels(output='aws_upload')):
+            _get_s3_client(os.getpid()).upload_file(path, aws_config.bucket, object_name, Config=transfer_config)
+    except (ClientError, S3UploadFailedError) as e:
+        # Keep the segment under its own name, it's uploaded again once a writer for the prefix is created
+        pending_path = os.path.join(os.path.dirname(path), name)
+        os.replace(path, pending_path)
+        logger.error('Error uploading to s3: %s. Segment is kept at %s', e, pending_path)
+        return
+    os.remove(path)
+
+
+def _publish_pending_segments_to_s3(prefix: str, directory: str):
+    """
+    Upload the segments in directory that failed to upload before, e.g. in an earlier run of the collector.
+    Hidden files are skipped: these are segments that are still being written, or that were being written
+    when their process was killed.
+    """
+    for name in sorted(os.listdir(directory)):
+        if name.startswith('.'):
+            continue
+        try:
+            # the name starts with the moment the segment was opened, see get_segment_name()
+            moment = datetime.strptime(name[:15], '%Y%m%dT%H%M%S')
+        except ValueError:
+            logger.warning('Not a segment, not uploading: %s', os.path.join(directory, name))
+            continue
+        try:
+            _publish_segment_to_s3(prefix, os.path.join(directory, name), name, moment)
+        except OSError as e:
+            # e.g. another process that uploaded it first has already removed it
+            logger.warning('Error uploading pending segment %s: %s', name, e)
+
+
+@lru_cache(maxsize=None)
+def _get_s3_client(pid: int) -> Any:
+    """
+    Get the S3 client. Created once per process, and reused; boto3 clients are thread-safe, but should not
+    be shared with forked processes.
+    :param pid: id of the current process
+    """
+    aws_config = get_collector_config().output.aws
+    assert aws_config is not None  # help out mypy
+    return boto3.client(
         service_name='s3',
         region_name=aws_config.region,
         aws_access_key_id=aws_config.access_key_id,
         aws_secret_access_key=aws_config.secret_access_key)
-    try:
-        s3_client.upload_fileobj(file_obj, aws_config.bucket, object_name)
-    except ClientError as e:
-        print(f'Error uploading to s3: {e} ')
+
+
+def write_data_to_parquet_if_configured(events: EventDataList) -> None:
+    """
+    Write events to Parquet files, if Parquet output is configured. If Parquet output is not configured,
+    then this function returns directly.
+    The events are buffered, and written in batches, see ParquetSink.
+    :param events: valid events, with their types hydrated
+    """
+    parquet_config = get_collector_config().output.parquet
+    if not parquet_config or not events:
+        return
+    get_parquet_sink(parquet_config).add(events)
 
 
 def write_data_to_snowplow_if_configured(events: EventDataList,
@@ -88,8 +228,9 @@ def write_data_to_snowplow_if_configured(events: EventDataList,
     """
     config: SnowplowConfig = get_collector_config().output.snowplow
 
-    if config.aws_enabled:
-        write_data_to_aws_pipeline(events=events, config=config, good=good, event_errors=event_errors)
+    with timed(OUTPUT_WRITE_SECONDS.labels(output='snowplow')):
+        if config.aws_enabled:
+            write_data_to_aws_pipeline(events=events, config=config, good=good, event_errors=event_errors)
 
-    if config.gcp_enabled:
-        write_data_to_gcp_pubsub(events=events, config=config, good=good, event_errors=event_errors)
+        if config.gcp_enabled:
+            write_data_to_gcp_pubsub(events=events, config=config, good=good, event_errors=event_errors)
@@ -0,0 +1,14 @@
+"""
+Copyright 2022 Objectiv B.V.
+
+The metrics end point, only served if metrics are enabled. See objectiv_backend/common/metrics.py
+"""
+from flask import Response
+
+from objectiv_backend.common.metrics import render_metrics
+
+
+def metrics() -> Response:
+    """ Endpoint that returns the metrics of the collector, in the Prometheus text format. """
+    body, content_type = render_metrics()
+    return Response(body, status=200, content_type=content_type)
@@ -0,0 +1,165 @@
+"""
+Copyright 2022 Objectiv B.V.
+
+Parquet output: writes validated events to Parquet files, with a flattened schema, partitioned by day.
+Requires the `parquet` extra: pip install objectiv-backend[parquet]
+
+Files are written to <path>/day=<YYYY-MM-DD>/<name>.parquet, the hive partitioning layout that Athena,
+Spark, and pyarrow.dataset understand. Each event is a row, with the columns of PARQUET_SCHEMA:
+    * event_id, moment, cookie_id: same as the columns of the data table in Postgres. The day is not
+        stored in the files, readers get it from the directory name.
+    * _type, _types: the event type, and all its parent types
+    * properties: all other fields of the event, e.g. 'time', json encoded per field
+    * global_contexts, location_stack: lists of structs with the _type, _types and id of the context, and
+        its other fields json encoded per field in properties.
+Queries that only need some columns, only have to read those columns.
+"""
+import os
+import threading
+from datetime import datetime, date
+from itertools import groupby
+from typing import Any, Dict, List, Optional
+
+import pyarrow
+import pyarrow.parquet
+
+from objectiv_backend.common.config import BufferConfig, ParquetOutputConfig
+from objectiv_backend.common.event_utils import get_optional_context
+from objectiv_backend.common.json_codec import json_dumps
+from objectiv_backend.common.metrics import OUTPUT_WRITE_SECONDS, timed
+from objectiv_backend.common.types import ContextData, EventData, EventDataList
+from objectiv_backend.end_points.event_buffer import EventBuffer
+from objectiv_backend.end_points.segment_writer import get_segment_name
+from objectiv_backend.schema.validate_events import EventError
+from objectiv_backend.workers.pg_storage import _millis_to_datetime
+
+PARQUET_COMPRESSION = 'zstd'
+
+_CONTEXT_TYPE = pyarrow.struct([
+    ('_type', pyarrow.string()),
+    ('_types', pyarrow.list_(pyarrow.string())),
+    ('id', pyarrow.string()),
+    ('properties', pyarrow.map_(pyarrow.string(), pyarrow.string()))
+])
+
+PARQUET_SCHEMA = pyarrow.schema([
+    ('event_id', pyarrow.string()),
+    ('moment', pyarrow.timestamp('ms')),
+    ('cookie_id', pyarrow.string()),
+    ('_type', pyarrow.string()),
+    ('_types', pyarrow.list_(pyarrow.string())),
+    ('properties', pyarrow.map_(pyarrow.string(), pyarrow.string())),
+    ('global_contexts', pyarrow.list_(_CONTEXT_TYPE)),
+    ('location_stack', pyarrow.list_(_CONTEXT_TYPE))
+])
+
+# Fields of events and contexts that have their own column or struct field
+_EVENT_FIELDS = {'id', '_type', '_types', 'global_contexts', 'location_stack'}
+_CONTEXT_FIELDS = {'id', '_type', '_types'}
+
+# The sink of this process, see get_parquet_sink()
+_PARQUET_SINK: Optional['ParquetSink'] = None
+_PARQUET_SINK_LOCK = threading.Lock()
+
+
+class ParquetSink:
+    """
+    Buffers events, and writes them to Parquet files. Per day a file is written, once the buffer contains
+    parquet_config.max_events events, or parquet_config.max_seconds after the oldest buffered event was
+    added. If the buffer cannot keep up, then events are written directly by the caller.
+
+    Buffered events are lost if the process is killed. They are written when the Python interpreter exits
+    normally. A sink should only be used by the process that created it, see EventBuffer.
+    """
+
+    def __init__(self, parquet_config: ParquetOutputConfig):
+        self.parquet_config = parquet_config
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._sequence = 0
+        buffer_config = BufferConfig(max_events=parquet_config.max_events * 2,
+                                     flush_events=parquet_config.max_events,
+                                     flush_interval_seconds=parquet_config.max_seconds)
+        self._buffer = EventBuffer(write_function=self._write_buffered_events, buffer_config=buffer_config)
+
+    def add(self, events: EventDataList):
+        """ Add events to the buffer. The events must have been hydrated, see hydrate_types_into_event(). """
+        if not self._buffer.add(events):
+            self.write_events(events)
+
+    def flush(self, timeout: float = None) -> bool:
+        """ Write all buffered events now. See EventBuffer.flush() """
+        return self._buffer.flush(timeout=timeout)
+
+    def close(self, timeout: float = None):
+        """ Write all buffered events, and stop accepting new events. """
+        self._buffer.close(timeout=timeout)
+
+    def write_events(self, events: EventDataList):
+        """ Write events to Parquet files, a file per day. """
+        rows = sorted((event_to_parquet_row(event) for event in events), key=_get_day)
+        for day, day_rows in groupby(rows, key=_get_day):
+            self._write_file(day, list(day_rows))
+
+    def _write_buffered_events(self,
+                               ok_events: EventDataList,
+                               nok_events: EventDataList,
+                               event_errors: List[EventError]):
+        self.write_events(ok_events)
+
+    def _write_file(self, day: date, rows: List[Dict[str, Any]]):
+        with self._lock:
+            self._sequence += 1
+            name = get_segment_name(datetime.utcnow(), self._sequence, '.parquet')
+        directory = os.path.join(self.parquet_config.path, f'day={day.isoformat()}')
+        os.makedirs(directory, exist_ok=True)
+        with timed(OUTPUT_WRITE_SECONDS.labels(output='parquet')):
+            table = pyarrow.Table.from_pylist(rows, schema=PARQUET_SCHEMA)
+            # Write to a hidden file first, so readers never see incomplete files
+            temp_path = os.path.join(directory, f'.{name}.tmp')
+            pyarrow.parquet.write_table(table, temp_path, compression=PARQUET_COMPRESSION)
+            os.replace(temp_path, os.path.join(directory, name))
+
+
+def event_to_parquet_row(event: EventData) -> Dict[str, Any]:
+    """ Convert an event to a dictionary with the columns of PARQUET_SCHEMA. """
+    moment = _millis_to_datetime(event['time'])
+    cookie_context = get_optional_context(event, 'CookieIdContext')
+    return {
+        'event_id': event['id'],
+        'moment': moment,
+        'cookie_id': cookie_context['cookie_id'] if cookie_context else None,
+        '_type': event['_type'],
+        '_types': event.get('_types'),
+        'properties': _get_properties(event, _EVENT_FIELDS),
+        'global_contexts': [_context_to_struct(context) for context in event.get('global_contexts', [])],
+        'location_stack': [_context_to_struct(context) for context in event.get('location_stack', [])]
+    }
+
+
+def _get_day(row: Dict[str, Any]) -> date:
+    return row['moment'].date()
+
+
+def _context_to_struct(context: ContextData) -> Dict[str, Any]:
+    return {
+        '_type': context['_type'],
+        '_types': context.get('_types'),
+        'id': context.get('id'),
+        'properties': _get_properties(context, _CONTEXT_FIELDS)
+    }
+
+
+def _get_properties(data: Dict[str, Any], skip_fields: set) -> List[tuple]:
+    """ Give the fields of data that are not in skip_fields, as (name, json value) tuples. """
+    return [(key, json_dumps(value)) for key, value in data.items() if key not in skip_fields]
+
+
+def get_parquet_sink(parquet_config: ParquetOutputConfig) -> ParquetSink:
+    """ Get the Parquet sink of this process, create it if needed. """
+    global _PARQUET_SINK
+    with _PARQUET_SINK_LOCK:
+        # a forked process must not use the sink of its parent
+        if _PARQUET_SINK is None or _PARQUET_SINK.pid != os.getpid():
+            _PARQUET_SINK = ParquetSink(parquet_config)
+        return _PARQUET_SINK
@@ -1,24 +1,174 @@
 """
 Copyright 2021 Objectiv B.V.
+
+The schema end points. The schema only changes when the collector config is (re)loaded, so the response
+bodies are rendered and compressed once per EventSchema object, and served with a strong ETag. Clients that
+poll these end points with If-None-Match get a 304 response without a body.
+
+Brotli compression is only offered if the brotli package is installed:
+pip install objectiv-backend[brotli]
 """
+import gzip
+import hashlib
 import json
+from functools import lru_cache
+from typing import Dict, NamedTuple, Optional
 
-from flask import Response
+from flask import Response, request
 
 from objectiv_backend.common.config import get_collector_config
 from objectiv_backend.end_points.common import get_json_response
+from objectiv_backend.schema.event_schemas import EventSchema
 from objectiv_backend.schema.generate_json_schema import generate_json_schema
 
+try:
+    import brotli
+except ImportError:
+    brotli = None  # type: ignore
+
+# Clients may use a cached schema for this long before revalidating it with If-None-Match. Private, as the
+# responses can set the tracking cookie.
+SCHEMA_CACHE_CONTROL = 'private, max-age=60'
+
+# Compression levels, these are only used once per config load, so we can afford the maximum
+GZIP_COMPRESS_LEVEL = 9
+BROTLI_QUALITY = 11
+
+IDENTITY = 'identity'
+
+
+class RenderedBody(NamedTuple):
+    """
+    A response body, in all encodings that we serve.
+    :param bodies: per content-encoding the encoded body, the 'identity' encoding is always present.
+        Encodings are in order of preference.
+    :param etags: per content-encoding the strong ETag of the encoded body, including the quotes.
+    """
+    bodies: Dict[str, bytes]
+    etags: Dict[str, str]
+
+
+class SchemaResponse(NamedTuple):
+    """ Framework independent response of a schema end point. """
+    status: int
+    body: bytes
+    headers: Dict[str, str]
+
 
 def schema() -> Response:
     """ Endpoint that returns the event schema in our own notation. """
     event_schema = get_collector_config().event_schema
-    msg = str(event_schema)
-    return get_json_response(status=200, msg=msg)
+    return _get_flask_response(get_rendered_schema(event_schema))
 
 
 def json_schema() -> Response:
     """ Endpoint that returns a jsonschema that describes the event schema. """
     event_schema = get_collector_config().event_schema
-    msg = json.dumps(generate_json_schema(event_schema), indent=4)
-    return get_json_response(status=200, msg=msg)
+    return _get_flask_response(get_rendered_json_schema(event_schema))
+
+
+@lru_cache(maxsize=2)
+def get_rendered_schema(event_schema: EventSchema) -> RenderedBody:
+    """ Give the rendered body of the /schema end point. Rendered once per EventSchema object. """
+    return render_body(str(event_schema))
+
+
+@lru_cache(maxsize=2)
+def get_rendered_json_schema(event_schema: EventSchema) -> RenderedBody:
+    """ Give the rendered body of the /jsonschema end point. Rendered once per EventSchema object. """
+    return render_body(json.dumps(generate_json_schema(event_schema), indent=4))
+
+
+def render_body(msg: str) -> RenderedBody:
+    """ Encode msg with all content-encodings that we serve. """
+    identity = msg.encode('utf-8')
+    bodies = {}
+    if brotli is not None:
+        bodies['br'] = brotli.compress(identity, quality=BROTLI_QUALITY)
+    # mtime=0 makes the gzip output, and thus the ETag, only depend on the content
+    bodies['gzip'] = gzip.compress(identity, compresslevel=GZIP_COMPRESS_LEVEL, mtime=0)
+    bodies[IDENTITY] = identity
+    digest = hashlib.sha256(identity).hexdigest()[:32]
+    # Each encoding is a different representation, and must have a different strong ETag
+    etags = {encoding: f'"{digest}"' if encoding == IDENTITY else f'"{digest}-{encoding}"'
+             for encoding in bodies}
+    return RenderedBody(bodies=bodies, etags=etags)
+
+
+def get_schema_response(rendered_body: RenderedBody,
+                        if_none_match: Optional[str],
+                        accept_encoding: Optional[str]) -> SchemaResponse:
+    """
+    Give the response for a request for a rendered body: a 304 if the client's cached copy is still
+    current, otherwise a 200 with the body in the best encoding that the client accepts.
+    :param rendered_body: body to serve
+    :param if_none_match: value of the request's If-None-Match header
+    :param accept_encoding: value of the request's Accept-Encoding header
+    """
+    encoding = _select_encoding(rendered_body, accept_encoding)
+    etag = rendered_body.etags[encoding]
+    headers = {
+        'ETag': etag,
+        'Cache-Control': SCHEMA_CACHE_CONTROL,
+        'Vary': 'Accept-Encoding'
+    }
+    if if_none_match and _etag_matches(etag, if_none_match):
+        return SchemaResponse(status=304, body=b'', headers=headers)
+    if encoding != IDENTITY:
+        headers['Content-Encoding'] = encoding
+    return SchemaResponse(status=200, body=rendered_body.bodies[encoding], headers=headers)
+
+
+def _select_encoding(rendered_body: RenderedBody, accept_encoding: Optional[str]) -> str:
+    """ Give the first content-encoding of rendered_body that is acceptable according to accept_encoding. """
+    if not accept_encoding:
+        return IDENTITY
+    qualities = _parse_accept_encoding(accept_encoding)
+    for encoding in rendered_body.bodies:
+        if encoding == IDENTITY:
+            return IDENTITY
+        if qualities.get(encoding, qualities.get('*', 0.0)) > 0:
+            return encoding
+    return IDENTITY
+
+
+def _parse_accept_encoding(accept_encoding: str) -> Dict[str, float]:
+    """ Parse an Accept-Encoding header to a dictionary: content-encoding to quality. """
+    qualities = {}
+    for item in accept_encoding.split(','):
+        encoding, _, parameters = item.partition(';')
+        encoding = encoding.strip().lower()
+        if not encoding:
+            continue
+        quality = 1.0
+        name, _, value = parameters.partition('=')
+        if name.strip().lower() == 'q':
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        qualities[encoding] = quality
+    return qualities
+
+
+def _etag_matches(etag: str, if_none_match: str) -> bool:
+    """ Weak comparison of etag with the ETags in an If-None-Match header, as RFC 7232 prescribes. """
+    if if_none_match.strip() == '*':
+        return True
+    return any(_strip_weak(tag) == etag for tag in if_none_match.split(','))
+
+
+def _strip_weak(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+def _get_flask_response(rendered_body: RenderedBody) -> Response:
+    schema_response = get_schema_response(rendered_body,
+                                          if_none_match=request.headers.get('If-None-Match'),
+                                          accept_encoding=request.headers.get('Accept-Encoding'))
+    response = get_json_response(status=schema_response.status, msg='')
+    # set the body as bytes, so werkzeug doesn't encode it again
+    response.set_data(schema_response.body)
+    response.headers.update(schema_response.headers)
+    return response
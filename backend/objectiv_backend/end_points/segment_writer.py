@@ -0,0 +1,194 @@
+"""
+Copyright 2022 Objectiv B.V.
+
+Rolling writer, that appends newline-delimited json to compressed segment files, and rotates these by size
+and age. Used by the file system and S3 outputs, see extra_output.py.
+
+zstd compression requires the zstandard package: pip install objectiv-backend[zstd]
+"""
+import atexit
+import gzip
+import logging
+import os
+import re
+import socket
+import threading
+import time
+from datetime import datetime
+from typing import Any, BinaryIO, Callable, NamedTuple, Optional
+
+from objectiv_backend.common.config import SegmentConfig
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # type: ignore
+
+SEGMENT_EXTENSIONS = {
+    'gzip': '.json.gz',
+    'zstd': '.json.zst',
+    'none': '.json'
+}
+
+# Segments are compressed while the events come in, so trade some compression for speed
+GZIP_COMPRESS_LEVEL = 6
+ZSTD_COMPRESS_LEVEL = 3
+
+# A publish function is called with the path of a closed segment file, the name of the segment, and the
+# moment the segment was opened. It should move the file to its final destination.
+PublishFunction = Callable[[str, str, datetime], None]
+
+# Only characters that are safe in file names and S3 keys
+_HOSTNAME = re.sub(r'[^a-zA-Z0-9.-]', '_', socket.gethostname())
+
+logger = logging.getLogger(__name__)
+
+
+def get_segment_name(moment: datetime, sequence: int, extension: str) -> str:
+    """
+    Give a file name that no other process, on this host or another host, will pick: it contains the moment,
+    the host name, the process id, and a sequence number, that the caller should increase per file.
+    """
+    return f'{moment:%Y%m%dT%H%M%S}-{_HOSTNAME}-{os.getpid()}-{sequence:06d}{extension}'
+
+
+class _Segment(NamedTuple):
+    path: str
+    name: str
+    # moment the segment was opened, as passed to SegmentWriter.write()
+    moment: datetime
+    # time.monotonic() of when the segment was opened
+    opened: float
+    file: BinaryIO
+    # compressing stream that writes to file, or file itself if there is no compression
+    stream: Any
+
+
+class SegmentWriter:
+    """
+    Thread-safe writer, that appends data to the current segment file in directory. A segment is closed and
+    published once segment_config.max_bytes (uncompressed) are written to it, or
+    segment_config.max_seconds after it was opened, whichever comes first. A background thread takes care
+    of the latter. The next write opens a new segment.
+
+    Segment names contain the time the segment was opened, the host name, the process id, and a sequence
+    number. So writers in different processes, or on different hosts, never pick the same name.
+
+    The current segment is lost if the process is killed. close() publishes it, it's called automatically
+    when the Python interpreter exits normally. A writer should only be used by the process that created
+    it, the background thread does not survive a fork.
+    """
+
+    def __init__(self, directory: str, publish: PublishFunction, segment_config: SegmentConfig):
+        if segment_config.compression not in SEGMENT_EXTENSIONS:
+            raise ValueError(f'Unsupported compression: {segment_config.compression}')
+        if segment_config.compression == 'zstd' and zstandard is None:
+            raise ValueError('zstd compression requires the zstandard package')
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.publish = publish
+        self.segment_config = segment_config
+        self.pid = os.getpid()
+        self._condition = threading.Condition()
+        self._segment: Optional[_Segment] = None
+        self._written_bytes = 0
+        self._sequence = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._rotate_loop, name='segment-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, data: str, moment: datetime):
+        """
+        Append data to the current segment, followed by a newline if data doesn't end with one.
+        :param data: newline-delimited json
+        :param moment: moment the data arrived. Only used if this opens a new segment.
+        """
+        encoded = data.encode('utf-8')
+        if not encoded.endswith(b'\n'):
+            encoded += b'\n'
+        with self._condition:
+            if self._closed:
+                raise ValueError('SegmentWriter is closed')
+            if self._segment is None:
+                self._segment = self._open_segment(moment)
+                # the background thread needs to start the rotation timer
+                self._condition.notify_all()
+            self._segment.stream.write(encoded)
+            self._written_bytes += len(encoded)
+            segment = None
+            if self._written_bytes >= self.segment_config.max_bytes:
+                segment = self._take_segment()
+        if segment:
+            self._publish_segment(segment)
+
+    def rotate(self):
+        """ Close and publish the current segment, if any. """
+        with self._condition:
+            segment = self._take_segment()
+        if segment:
+            self._publish_segment(segment)
+
+    def close(self, timeout: float = None):
+        """ Refuse new writes, publish the current segment, and stop the background thread. """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self.rotate()
+        self._thread.join(timeout=timeout)
+        atexit.unregister(self.close)
+
+    def _open_segment(self, moment: datetime) -> _Segment:
+        """ Open a new segment. Must be called while holding the lock. """
+        self._sequence += 1
+        extension = SEGMENT_EXTENSIONS[self.segment_config.compression]
+        name = get_segment_name(moment, self._sequence, extension)
+        # hidden and with a different extension, so it's clear that the file is still being written
+        path = os.path.join(self.directory, f'.{name}.tmp')
+        file: BinaryIO = open(path, 'wb')
+        stream: Any
+        if self.segment_config.compression == 'gzip':
+            stream = gzip.GzipFile(filename='', mode='wb', fileobj=file, compresslevel=GZIP_COMPRESS_LEVEL)
+        elif self.segment_config.compression == 'zstd':
+            stream = zstandard.ZstdCompressor(level=ZSTD_COMPRESS_LEVEL).stream_writer(file)
+        else:
+            stream = file
+        self._written_bytes = 0
+        return _Segment(path=path, name=name, moment=moment, opened=time.monotonic(), file=file, stream=stream)
+
+    def _take_segment(self) -> Optional[_Segment]:
+        """ Take the current segment, so a new one will be opened. Must be called while holding the lock. """
+        segment = self._segment
+        self._segment = None
+        self._written_bytes = 0
+        if segment is not None:
+            # Close before releasing the lock, so no other thread can write to it anymore. Closing the
+            # stream writes the end of the compressed data, GzipFile doesn't close the file itself.
+            segment.stream.close()
+            segment.file.close()
+        return segment
+
+    def _publish_segment(self, segment: _Segment):
+        try:
+            self.publish(segment.path, segment.name, segment.moment)
+        except Exception as exc:
+            logger.error('Error publishing segment %s: %s', segment.path, exc)
+
+    def _seconds_until_rotation(self) -> Optional[float]:
+        if self._segment is None:
+            return None
+        return max(0.0, self._segment.opened + self.segment_config.max_seconds - time.monotonic())
+
+    def _rotate_loop(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._closed:
+                        return
+                    timeout = self._seconds_until_rotation()
+                    if timeout == 0:
+                        break
+                    self._condition.wait(timeout=timeout)
+                segment = self._take_segment()
+            if segment:
+                self._publish_segment(segment)
@@ -7,14 +7,28 @@ import os
 import re
 import sys
 from copy import deepcopy
-from typing import Set, List, Dict, Any, Optional, Tuple
+from types import MappingProxyType
+from typing import Set, List, Dict, Any, Optional, Tuple, Mapping
 import pkgutil
 
+from jsonschema.validators import validator_for
+
 from objectiv_backend.common.types import EventType, ContextType, EventListSchema
 
 MAX_HIERARCHY_DEPTH = 100
 
 
+def compile_validator(schema: Dict[str, Any]) -> Any:
+    """
+    Create a jsonschema validator for the given json-schema. The schema is checked once here, so the
+    returned validator can be reused to validate any number of instances without further overhead.
+    :raise jsonschema.SchemaError: if schema is not a valid json-schema
+    """
+    validator_class = validator_for(schema)
+    validator_class.check_schema(schema)
+    return validator_class(schema)
+
+
 class EventSubSchema:
     """
     Immutable sub-schema containing events, their inheritance hierarchy and required contexts for events.
@@ -32,6 +46,9 @@ class EventSubSchema:
         self._compiled_list_event_types: List[EventType] = []
         self._compiled_all_parents_and_required_contexts: \
             Dict[EventType, Tuple[Set[EventType], Set[ContextType]]] = {}
+        self._compiled_sorted_parent_event_types: Mapping[EventType, Tuple[EventType, ...]] = \
+            MappingProxyType({})
+        self._compiled_validators: Mapping[EventType, Any] = MappingProxyType({})
 
     def get_extended_schema(self, event_schema: Dict[str, Any]) -> 'EventSubSchema':
         """
@@ -63,8 +80,8 @@ class EventSubSchema:
 
     def _compile(self):
         """
-        1) Pre calculate the return values of list_event_types(), get_all_parent_event_types(), and
-        get_all_required_contexts.
+        1) Pre calculate the return values of list_event_types(), get_all_parent_event_types(),
+        get_sorted_parent_event_types(), get_all_required_contexts, and get_event_validator().
         2) Makes sure the event hierarchy has no cycles
         Must be called after the schema has changed.
         """
@@ -73,6 +90,14 @@ class EventSubSchema:
         self._compiled_all_parents_and_required_contexts = {}
         for event_type in self._compiled_list_event_types:
             self._compile_parents_and_contexts(event_type)
+        self._compiled_sorted_parent_event_types = MappingProxyType({
+            event_type: tuple(sorted(self._compiled_all_parents_and_required_contexts[event_type][0]))
+            for event_type in self._compiled_list_event_types
+        })
+        self._compiled_validators = MappingProxyType({
+            event_type: compile_validator(self.get_event_schema(event_type))
+            for event_type in self._compiled_list_event_types
+        })
 
     def _compile_parents_and_contexts(
             self,
@@ -127,6 +152,16 @@ class EventSubSchema:
             raise ValueError(f'Not a valid event_type {event_type}')
         return {e for e in self._compiled_all_parents_and_required_contexts[event_type][0]}
 
+    def get_sorted_parent_event_types(self, event_type: EventType) -> Tuple[EventType, ...]:
+        """
+        Given an event_type, give an alphabetically sorted tuple with that event_type and all its parent
+        event_types. Same as sorted(get_all_parent_event_types()), but pre-calculated and shared between calls.
+        :param event_type: event type. Must be a valid event_type
+        """
+        if not self.is_valid_event_type(event_type):
+            raise ValueError(f'Not a valid event_type {event_type}')
+        return self._compiled_sorted_parent_event_types[event_type]
+
     def get_all_required_contexts(self, event_type: EventType) -> Set[ContextType]:
         """
         Get all contexts that are required by the given event. This includes context types that are
@@ -166,6 +201,13 @@ class EventSubSchema:
         }
         return schema
 
+    def get_event_validator(self, event_type: EventType) -> Optional[Any]:
+        """
+        Give the pre-compiled jsonschema validator for a specific event_type, or None if the event type
+        doesn't exist. The validator validates against the schema as returned by get_event_schema().
+        """
+        return self._compiled_validators.get(event_type)
+
 
 class ContextSubSchema:
     """
@@ -184,6 +226,9 @@ class ContextSubSchema:
         self._compiled_all_parents_and_required_context_types: \
             Dict[ContextType, Dict[str, Set[ContextType]]] = {}
         self._compiled_all_child_context_types = {}
+        self._compiled_sorted_parent_context_types: Mapping[ContextType, Tuple[ContextType, ...]] = \
+            MappingProxyType({})
+        self._compiled_validators: Mapping[ContextType, Any] = MappingProxyType({})
 
     CONTEXT_NAME_REGEX = r'^[A-Z][a-zA-Z0-9]*Context$'
 
@@ -228,7 +273,7 @@ class ContextSubSchema:
     def _compile(self):
         """
         1) Pre calculate the return values of list_context_types(), get_all_parent_context_types(),
-            and get_all_child_context_types().
+            get_sorted_parent_context_types(), get_all_child_context_types(), and get_context_validator().
         2) Makes sure the event hierarchy has no cycles, and all parent-reference exist.
         Must be called after the schema has changed.
         """
@@ -247,6 +292,16 @@ class ContextSubSchema:
                     children.add(ct)
             self._compiled_all_child_context_types[context_type] = children
 
+        self._compiled_sorted_parent_context_types = MappingProxyType({
+            context_type: tuple(sorted(self._compiled_all_parent_and_required_context_types[context_type]['parents']))
+            for context_type in self._compiled_list_context_types
+        })
+
+        self._compiled_validators = MappingProxyType({
+            context_type: compile_validator(self.get_context_schema(context_type))
+            for context_type in self._compiled_list_context_types
+        })
+
     def _compile_parent_and_required_context_types(self, context_type: ContextType, count=MAX_HIERARCHY_DEPTH) -> \
             Tuple[Set[ContextType], Set[ContextType]]:
         """
@@ -292,6 +347,17 @@ class ContextSubSchema:
         return {t for t in self._compiled_all_parent_and_required_context_types.get(context_type, {}).get('parents', {
             context_type})}
 
+    def get_sorted_parent_context_types(self, context_type: ContextType) -> Tuple[ContextType, ...]:
+        """
+        Given a context_type, give an alphabetically sorted tuple with that context_type and all its parent
+        context_types. Same as sorted(get_all_parent_context_types()), but pre-calculated and shared between
+        calls for the context types in the schema.
+        """
+        sorted_types = self._compiled_sorted_parent_context_types.get(context_type)
+        if sorted_types is None:
+            return (context_type, )
+        return sorted_types
+
     def get_all_required_context_types(self, context_type: ContextType) -> Set[ContextType]:
         """
         Given a context_type, give a set with that context_type and all its parent context_types
@@ -332,6 +398,13 @@ class ContextSubSchema:
         }
         return schema
 
+    def get_context_validator(self, context_type: ContextType) -> Optional[Any]:
+        """
+        Give the pre-compiled jsonschema validator for a specific context_type, or None if the context type
+        doesn't exist. The validator validates against the schema as returned by get_context_schema().
+        """
+        return self._compiled_validators.get(context_type)
+
 
 class EventSchema:
     """
@@ -362,12 +435,12 @@ class EventSchema:
             * adding properties to an existing context
             * adding sub-properties to an existing context (e.g. a "minimum" field for an integer)
         """
-        events = deepcopy(self.events)
-        contexts = deepcopy(self.contexts)
+        # The sub-schemas are immutable, get_extended_schema() returns new objects. So there is no need
+        # to copy them first.
         version = deepcopy(self.version)
 
-        events = events.get_extended_schema(schema['events'])
-        contexts = contexts.get_extended_schema(schema['contexts'])
+        events = self.events.get_extended_schema(schema['events'])
+        contexts = self.contexts.get_extended_schema(schema['contexts'])
         version.update(schema['version'])
         # todo: separate version merging, and do some validation on this
         # extension_name = event_schema['name']
@@ -421,6 +494,14 @@ class EventSchema:
         """
         return self.events.get_all_parent_event_types(event_type=event_type)
 
+    def get_sorted_parent_event_types(self, event_type: EventType) -> Tuple[EventType, ...]:
+        """
+        Given an event_type, give a pre-calculated, alphabetically sorted tuple with that event_type and all
+        its parent event_types.
+        :param event_type: event type. Must be a valid event_type
+        """
+        return self.events.get_sorted_parent_event_types(event_type=event_type)
+
     def get_all_required_contexts_for_event(self, event_type: EventType) -> Set[ContextType]:
         return self.events.get_all_required_contexts(event_type=event_type)
 
@@ -436,6 +517,9 @@ class EventSchema:
     def get_all_parent_context_types(self, context_type: ContextType) -> Set[ContextType]:
         return self.contexts.get_all_parent_context_types(context_type=context_type)
 
+    def get_sorted_parent_context_types(self, context_type: ContextType) -> Tuple[ContextType, ...]:
+        return self.contexts.get_sorted_parent_context_types(context_type=context_type)
+
     def get_all_child_context_types(self, context_type: ContextType) -> Set[ContextType]:
         return self.contexts.get_all_child_context_types(context_type=context_type)
 
@@ -445,6 +529,12 @@ class EventSchema:
     def get_event_schema(self, event_type: EventType) -> Optional[Dict[str, Any]]:
         return self.events.get_event_schema(event_type=event_type)
 
+    def get_context_validator(self, context_type: ContextType) -> Optional[Any]:
+        return self.contexts.get_context_validator(context_type=context_type)
+
+    def get_event_validator(self, event_type: EventType) -> Optional[Any]:
+        return self.events.get_event_validator(event_type=event_type)
+
 
 def get_event_list_schema() -> EventListSchema:
     data = pkgutil.get_data(__name__, "event_list.json5")
@@ -453,6 +543,48 @@ def get_event_list_schema() -> EventListSchema:
     return schema_json
 
 
+def get_structural_event_list_schema(event_schema: EventSchema,
+                                     event_list_schema: EventListSchema) -> EventListSchema:
+    """
+    Give a json-schema that validates the overall structure of a list of events, as sent by the tracker.
+    The result is based on event_list_schema, with the AbstractEvent type replaced by the properties of
+    AbstractEvent in event_schema. The inputs are not modified.
+
+    :param event_schema: schema that defines AbstractEvent
+    :param event_list_schema: schema of the list of events, as returned by get_event_list_schema()
+    :return: json-schema
+    """
+    result = deepcopy(event_list_schema)
+    if 'AbstractEvent' not in event_schema.events.schema:
+        return result
+    # we use AbstractEvent as the blueprint for what an event should look like
+    abstract_event = deepcopy(event_schema.events.schema['AbstractEvent'])
+
+    # # list of properties for an event (can be nested)
+    items: Dict[str, dict] = {}
+    for property_name, property_desc in abstract_event['properties'].items():
+
+        if 'items' in property_desc and re.match('^Abstract.*?Context$', property_desc['items']['type']):
+            # we don't want to go into the validation / schema of contexts here
+            # so a simple object will suffice
+            property_desc['items']['type'] = 'object'
+        items[property_name] = property_desc
+
+    # we want a schema for a list of events (the base_schema only specifies a single event)
+    # the schema wants a list of abstract events. As that is not a valid JSON type,
+    # we replace that type with the more generic 'object' type, and the actual definition of
+    # an abstract event
+    if 'events' in result['properties'] and \
+            'items' in result['properties']['events'] and \
+            'type' in result['properties']['events']['items'] and \
+            result['properties']['events']['items']['type'] == 'AbstractEvent':
+        result['properties']['events']['items'] = {
+            'type': 'object',
+            'items': items
+        }
+    return result
+
+
 def get_event_schema(schema_extensions_directory: Optional[str]) -> EventSchema:
     """
     Get the event schema.
@@ -14,25 +14,19 @@ from objectiv_backend.common.types import EventData
 def hydrate_types_into_event(event_schema: EventSchema, event: EventData) -> EventData:
     """
     Modifies the given event:
-        1. adds a "events" field: a list of all inherited event-types (including the event)
-        2. For each context adds a "_types" fields: a list of all inherited context-types
+        1. adds a "_types" field: a sorted tuple of all inherited event-types (including the event)
+        2. For each context adds a "_types" fields: a sorted tuple of all inherited context-types
+    The tuples are pre-calculated by the event_schema, and shared between all events and contexts of the
+    same type.
     :param event_schema: schema to use for type-hydration
     :param event: event object. Must have passed event validation by validate_events.validate_event_data.
     :return: The modified event object.
     """
-    event_name = event['_type']
-    all_event_types = event_schema.get_all_parent_event_types(event_name)
-    event["_types"] = sorted(all_event_types)
-    global_contexts = event['global_contexts']
-    for context in global_contexts:
-        context["_types"] = sorted(
-            event_schema.get_all_parent_context_types(context["_type"])
-        )
-    location_stack = event['location_stack']
-    for context in location_stack:
-        context["_types"] = sorted(
-            event_schema.get_all_parent_context_types(context["_type"])
-        )
+    event["_types"] = event_schema.get_sorted_parent_event_types(event['_type'])
+    for context in event['global_contexts']:
+        context["_types"] = event_schema.get_sorted_parent_context_types(context["_type"])
+    for context in event['location_stack']:
+        context["_types"] = event_schema.get_sorted_parent_context_types(context["_type"])
     return event
 
 
@@ -3,13 +3,13 @@ Copyright 2021 Objectiv B.V.
 """
 import argparse
 import json
+import logging
 import sys
-from typing import List, Any, Dict, NamedTuple, Set
+from typing import List, Any, Dict, NamedTuple, Set, Optional
 import uuid
-import re
 
-import jsonschema
 from jsonschema import ValidationError
+from jsonschema.exceptions import best_match
 
 from objectiv_backend.schema.event_schemas import EventSchema, get_event_schema
 from objectiv_backend.common.config import \
@@ -17,6 +17,8 @@ from objectiv_backend.common.config import \
 
 from objectiv_backend.common.types import EventData
 
+logger = logging.getLogger(__name__)
+
 
 class ErrorInfo(NamedTuple):
     data: Any
@@ -43,36 +45,7 @@ def get_event_list_schema() -> Dict[str, Any]:
 
     :return: a dictionary containing a JSON schema like string to validate an array of events
     """
-    event_schema = get_collector_config().event_schema
-    events = event_schema.events.schema
-
-    # we use AbstractEvent as the blueprint for what an event should look like
-    abstract_event = events['AbstractEvent']
-
-    # # list of properties for an event (can be nested)
-    items: Dict[str, dict] = {}
-    for property_name, property_desc in abstract_event['properties'].items():
-
-        if 'items' in property_desc and re.match('^Abstract.*?Context$', property_desc['items']['type']):
-            # we don't want to go into the validation / schema of contexts here
-            # so a simple object will suffice
-            property_desc['items']['type'] = 'object'
-        items[property_name] = property_desc
-
-    # we want a schema for a list of events (the base_schema only specifies a single event)
-    # the schema wants a list of abstract events. As that is not a valid JSON type,
-    # we replace that type with the more generic 'object' type, and the actual definition of
-    # an abstract event
-    event_list_schema = get_collector_config().event_list_schema
-    if 'events' in event_list_schema['properties'] and \
-            'items' in event_list_schema['properties']['events'] and \
-            'type' in event_list_schema['properties']['events']['items'] and \
-            event_list_schema['properties']['events']['items']['type'] == 'AbstractEvent':
-        event_list_schema['properties']['events']['items'] = {
-            'type': 'object',
-            'items': items
-        }
-    return event_list_schema
+    return get_collector_config().event_list_schema
 
 
 def validate_structure_event_list(event_data: Any) -> List[ErrorInfo]:
@@ -84,10 +57,9 @@ def validate_structure_event_list(event_data: Any) -> List[ErrorInfo]:
     validate_event_adheres_to_schema on each individual event.
     :return: list of found errors. Empty list indicates not errors
     """
-    try:
-        event_list_schema = get_event_list_schema()
-        jsonschema.validate(instance=event_data, schema=event_list_schema)
-    except ValidationError as exc:
+    # The validator is compiled once, when the collector config is loaded
+    exc = _get_validation_error(get_collector_config().event_list_validator, event_data)
+    if exc:
         return [ErrorInfo(event_data, f'Overall structure does not adhere to schema: {exc}')]
     return []
 
@@ -204,28 +176,36 @@ def _validate_context_item(event_schema: EventSchema, context) -> List[ErrorInfo
     context_type = context['_type']
     # theoretically we could generate some json schema with if-then that we could just validate, without
     # having to select the right sub-schema here, but that would be very complex and not very readable.
-    schema = event_schema.get_context_schema(context_type)
-    if not schema:
-        print(f'Unknown context {context_type}, ignoring')
+    validator = event_schema.get_context_validator(context_type)
+    if not validator:
+        logger.debug('Unknown context %s, ignoring', context_type)
         return []
-    try:
-        jsonschema.validate(instance=context, schema=schema)
-    except ValidationError as exc:
+    exc = _get_validation_error(validator, context)
+    if exc:
         return [ErrorInfo(context, f'context validation failed: {exc}')]
     return []
 
 
 def _validate_event_item(event_schema: EventSchema, event) -> List[ErrorInfo]:
     event_type = event['_type']
-    schema = event_schema.get_event_schema(event_type=event_type)
-    try:
-        jsonschema.validate(instance=event, schema=schema)
-    except ValidationError as exc:
+    validator = event_schema.get_event_validator(event_type=event_type)
+    exc = _get_validation_error(validator, event)
+    if exc:
         return [ErrorInfo(event, f'event validation failed {exc}')]
 
     return []
 
 
+def _get_validation_error(validator, instance: Any) -> Optional[ValidationError]:
+    """
+    Validate instance with a pre-compiled validator (see EventSchema.get_event_validator() and
+    EventSchema.get_context_validator()).
+    :return: None if the instance is valid, otherwise the most relevant error. This is the same error that
+        jsonschema.validate() would raise.
+    """
+    return best_match(validator.iter_errors(instance))
+
+
 def validate_events_in_file(event_schema: EventSchema, filename: str) -> List[ErrorInfo]:
     """
     Read given filename, and validate the event data in that file.
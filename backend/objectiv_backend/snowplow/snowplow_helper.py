@@ -1,14 +1,18 @@
-from typing import Dict, List, Union
+from typing import Dict, List, Union, Any, Iterator, Tuple, Mapping, Optional
 
 import base64
 import json
+import logging
+import os
+import time
 from datetime import datetime
+from functools import lru_cache
 from urllib.parse import urlparse
 
 from objectiv_backend.snowplow.schema.ttypes import CollectorPayload  # type: ignore
 
 from objectiv_backend.common.config import SnowplowConfig, get_collector_config
-from objectiv_backend.common.event_utils import get_context
+from objectiv_backend.common.event_utils import get_optional_context
 from objectiv_backend.common.types import EventDataList, EventData
 from objectiv_backend.schema.validate_events import EventError
 
@@ -25,6 +29,25 @@ if snowplow_config.aws_enabled:
     import boto3
     import botocore.exceptions
 
+logger = logging.getLogger(__name__)
+
+# Limits of a single Kinesis put_records call
+KINESIS_MAX_RECORDS = 500
+KINESIS_MAX_BYTES = 5_000_000
+# Limits of a single SQS send_message_batch call. The limit on the size is 256 KiB, including the message
+# attributes, for which we leave some room.
+SQS_MAX_MESSAGES = 10
+SQS_MAX_BYTES = 250_000
+# Pub/Sub publisher batching: a batch is sent when either limit is reached, or after the latency expires
+PUBSUB_MAX_MESSAGES = 500
+PUBSUB_MAX_BYTES = 5_000_000
+PUBSUB_MAX_LATENCY_SECONDS = 0.05
+
+# Number of times that we try to send events that failed with a (possibly) transient error, and the time
+# to wait before the first retry. The wait time doubles with every retry.
+MAX_SEND_ATTEMPTS = 3
+RETRY_WAIT_SECONDS = 0.1
+
 
 def make_snowplow_custom_context(self_describing_event: Dict, config: SnowplowConfig) -> str:
     """
@@ -65,23 +88,26 @@ def objectiv_event_to_snowplow_payload(event: EventData, config: SnowplowConfig)
     :param config: SnowplowConfig
     :return: CollectorPayload
     """
-    snowplow_payload_data_schema = config.schema_payload_data
-    snowplow_collector_payload_schema = config.schema_collector_payload
+    payload, _, _ = _objectiv_event_to_snowplow_payload(event=event, config=config)
+    return payload
 
-    try:
-        http_context = get_context(event, 'HttpContext')
-    except ValueError:
-        http_context = {}
 
-    try:
-        cookie_context = get_context(event, 'CookieIdContext')
-    except ValueError:
-        cookie_context = {}
+def _objectiv_event_to_snowplow_payload(event: EventData, config: SnowplowConfig) \
+        -> Tuple[CollectorPayload, Dict[str, Any], Dict[str, Any]]:
+    """
+    Same as objectiv_event_to_snowplow_payload(), but also returns the intermediate results, so callers
+    don't have to decode those from the payload again.
+    :return: tuple with three items:
+        1) CollectorPayload
+        2) the event data in the payload's body, including the encoded custom context ('cx')
+        3) the objectiv event, as it is included in the custom context
+    """
+    snowplow_payload_data_schema = config.schema_payload_data
+    snowplow_collector_payload_schema = config.schema_collector_payload
 
-    try:
-        path_context = get_context(event, 'PathContext')
-    except ValueError:
-        path_context = {}
+    http_context = get_optional_context(event, 'HttpContext') or {}
+    cookie_context = get_optional_context(event, 'CookieIdContext') or {}
+    path_context = get_optional_context(event, 'PathContext') or {}
 
     query_string = urlparse(str(path_context.get('id', ''))).query
 
@@ -90,18 +116,19 @@ def objectiv_event_to_snowplow_payload(event: EventData, config: SnowplowConfig)
 
     snowplow_event = objectiv_event_to_snowplow(event=rich_event, config=config)
     snowplow_custom_context = make_snowplow_custom_context(self_describing_event=snowplow_event, config=config)
+    payload_data = {
+        "e": "se",  # mandatory: event type: structured event
+        "p": "web",  # mandatory: platform
+        "tv": "objectiv-tracker-0.0.5",  # mandatory: tracker version
+        "eid": event['id'],  # event_id
+        "url": path_context.get('id', ''),
+        "cx": snowplow_custom_context
+    }
     payload = {
         "schema": snowplow_payload_data_schema,
-        "data": [{
-            "e": "se",  # mandatory: event type: structured event
-            "p": "web",  # mandatory: platform
-            "tv": "objectiv-tracker-0.0.5",  # mandatory: tracker version
-            "eid": event['id'],  # event_id
-            "url": path_context.get('id', ''),
-            "cx": snowplow_custom_context
-        }]
+        "data": [payload_data]
     }
-    return CollectorPayload(
+    collector_payload = CollectorPayload(
         schema=snowplow_collector_payload_schema,
         ipAddress=http_context.get('remote_address', ''),
         timestamp=int(datetime.now().timestamp() * 1000),
@@ -117,6 +144,7 @@ def objectiv_event_to_snowplow_payload(event: EventData, config: SnowplowConfig)
         hostname='',
         networkUserId=cookie_context.get('id', '')
     )
+    return collector_payload, payload_data, rich_event
 
 
 def payload_to_thrift(payload: CollectorPayload) -> bytes:
@@ -138,12 +166,18 @@ def payload_to_thrift(payload: CollectorPayload) -> bytes:
 
 
 def snowplow_schema_violation_json(payload: CollectorPayload, config: SnowplowConfig,
-                                   event_error: EventError = None) -> Dict[str, Union[str, Dict]]:
+                                   event_error: Optional[EventError] = None,
+                                   payload_data: Dict[str, Any] = None,
+                                   objectiv_event: Dict[str, Any] = None) -> Dict[str, Union[str, Dict]]:
     """
     Generate Snowplow schema violation JSON object
     :param payload: CollectorPayload object - representation of Event
     :param config: SnowplowConfig
     :param event_error: error for this event
+    :param payload_data: optional, the event data in the payload's body. If not set, it's decoded from the
+        payload's body.
+    :param objectiv_event: optional, the objectiv event in the custom context of payload_data. If not set,
+        it's decoded from the custom context.
     :return: Dictionary representing the schema violation
     """
 
@@ -159,7 +193,7 @@ def snowplow_schema_violation_json(payload: CollectorPayload, config: SnowplowCo
             })
 
     parameters = []
-    data = json.loads(payload.body)['data'][0]
+    data = payload_data if payload_data is not None else json.loads(payload.body)['data'][0]
     for key, value in data.items():
         parameters.append({
             "name": key,
@@ -170,13 +204,17 @@ def snowplow_schema_violation_json(payload: CollectorPayload, config: SnowplowCo
     event = {}
     if 'cx' in data:
         context_container_encoded = data['cx']
-        context_container_decoded = json.loads(base64.b64decode(context_container_encoded).decode('utf-8'))
-        contexts = context_container_decoded['data']
-        for context in contexts:
-            if 'schema' in context and context['schema'] == config.schema_objectiv_taxonomy and 'data' in context:
-                event = context['data']
-                # we pick the first
-                break
+        if objectiv_event is not None:
+            event = objectiv_event
+        else:
+            context_container_decoded = json.loads(base64.b64decode(context_container_encoded).decode('utf-8'))
+            contexts = context_container_decoded['data']
+            for context in contexts:
+                if 'schema' in context and context['schema'] == config.schema_objectiv_taxonomy \
+                        and 'data' in context:
+                    event = context['data']
+                    # we pick the first
+                    break
 
     ts_format = '%Y-%m-%dT%H:%M:%S.%fZ'
     return {
@@ -238,10 +276,20 @@ def snowplow_schema_violation_json(payload: CollectorPayload, config: SnowplowCo
     }
 
 
+def index_event_errors(event_errors: Optional[List[EventError]]) -> Dict[str, EventError]:
+    """
+    Index a list of errors on event id. If there are multiple errors for the same event id, the last one is
+    used.
+    """
+    # event_id is typed as uuid, but the ids of the events are strings
+    return {str(event_error.event_id): event_error for event_error in event_errors or []}
+
+
 def prepare_event_for_snowplow_pipeline(event: EventData,
                                         good: bool,
                                         config: SnowplowConfig,
-                                        event_errors: List[EventError] = None) -> bytes:
+                                        event_errors: List[EventError] = None,
+                                        event_errors_by_id: Mapping[str, EventError] = None) -> bytes:
     """
     Transform event into data suitable for writing to the Snowplow Pipeline. If the event is "good" this means a
     CollectorPayload object, binary-encoded using Thrift. If it's a bad event, it's transformed to a JSON-based schema
@@ -249,20 +297,22 @@ def prepare_event_for_snowplow_pipeline(event: EventData,
     :param event: EventData
     :param good: bool - True if these events should go to the "good" channel
     :param config: SnowplowConfig
-    :param event_errors: list of EventError
+    :param event_errors: list of EventError. Only used if event_errors_by_id is not set.
+    :param event_errors_by_id: EventErrors indexed by event id, as returned by index_event_errors(). When
+        preparing a batch of events, index the errors once, and pass them here.
     :return: bytes object to be ingested by Snowplow pipeline
     """
-    payload: CollectorPayload = objectiv_event_to_snowplow_payload(event=event, config=config)
+    payload, payload_data, objectiv_event = _objectiv_event_to_snowplow_payload(event=event, config=config)
     if good:
         data = payload_to_thrift(payload=payload)
     else:
-        event_error = None
-        # try to find errors for the current event_id
-        if event_errors:
-            for ee in event_errors:
-                if ee.event_id == event['id']:
-                    event_error = ee
-        failed_event = snowplow_schema_violation_json(payload=payload, config=config, event_error=event_error)
+        if event_errors_by_id is None:
+            event_errors_by_id = index_event_errors(event_errors)
+        failed_event = snowplow_schema_violation_json(payload=payload,
+                                                      config=config,
+                                                      event_error=event_errors_by_id.get(event['id']),
+                                                      payload_data=payload_data,
+                                                      objectiv_event=objectiv_event)
 
         # serialize (json) and encode to bytestring for publishing
         data = json.dumps(failed_event, separators=(',', ':')).encode('utf-8')
@@ -273,7 +323,9 @@ def prepare_event_for_snowplow_pipeline(event: EventData,
 def write_data_to_gcp_pubsub(events: EventDataList, config: SnowplowConfig, good: bool = True,
                              event_errors: List[EventError] = None) -> None:
     """
-    Write provided list of events to the Snowplow GCP pipeline, using GCP PubSub
+    Write provided list of events to the Snowplow GCP pipeline, using GCP PubSub.
+    The publisher client batches the messages. This function waits until all messages are published, and
+    retries the messages that failed, up to MAX_SEND_ATTEMPTS times.
     :param events: EventDataList - List of EventData
     :param config:  SnowplowConfig
     :param good: bool - True if these events should go to the "good" channel
@@ -289,23 +341,40 @@ def write_data_to_gcp_pubsub(events: EventDataList, config: SnowplowConfig, good
         # not ok events get sent to the bad topic
         topic = config.gcp_pubsub_topic_bad
 
-    publisher = pubsub_v1.PublisherClient()
+    publisher = _get_pubsub_publisher(os.getpid())
     topic_path = f'projects/{project}/topics/{topic}'
 
-    for event in events:
-        data = prepare_event_for_snowplow_pipeline(event=event, good=good, event_errors=event_errors, config=config)
-
-        try:
-            publisher.publish(topic_path, data=data)
-        except NotFound as e:
-            print(f'PubSub topic {topic} could not be found! {e}')
+    event_errors_by_id = index_event_errors(event_errors)
+    messages = [prepare_event_for_snowplow_pipeline(event=event, good=good, config=config,
+                                                    event_errors_by_id=event_errors_by_id)
+                for event in events]
+    for attempt in range(MAX_SEND_ATTEMPTS):
+        if attempt:
+            time.sleep(RETRY_WAIT_SECONDS * 2 ** (attempt - 1))
+        futures = [publisher.publish(topic_path, data=data) for data in messages]
+        failed_messages = []
+        for data, future in zip(messages, futures):
+            try:
+                future.result()
+            except NotFound as e:
+                logger.error('PubSub topic %s could not be found! %s', topic, e)
+                return
+            except Exception as e:
+                logger.warning('Failed to publish event to PubSub (%s): %s', topic, e)
+                failed_messages.append(data)
+        messages = failed_messages
+        if not messages:
+            return
+    logger.error('Giving up on publishing %d events to PubSub (%s)', len(messages), topic)
 
 
 def write_data_to_aws_pipeline(events: EventDataList, config: SnowplowConfig,
                                good: bool = True,
                                event_errors: List[EventError] = None) -> None:
     """
-    Write provided list of events to Snowplow AWS pipeline, either directly to Kinesis, or to SQS
+    Write provided list of events to Snowplow AWS pipeline, either directly to Kinesis, or to SQS.
+    Events are sent in batches. Events that fail with a (possibly) transient error are retried, up to
+    MAX_SEND_ATTEMPTS times.
     :param events: EventDataList - List of EventData
     :param config:  SnowplowConfig
     :param good: bool - True if these events should go to the "good" channel
@@ -324,45 +393,133 @@ def write_data_to_aws_pipeline(events: EventDataList, config: SnowplowConfig,
         # the bad stream always goes to kinesis
         client_type = 'kinesis'
 
+    if client_type not in ('kinesis', 'sqs'):
+        # this should never happen
+        raise ValueError(f'Unknown Client-Type: {client_type}')
+    if not events:
+        return
+
+    client = _get_aws_client(client_type, os.getpid())
+    event_errors_by_id = index_event_errors(event_errors)
+    messages = [prepare_event_for_snowplow_pipeline(event=event, good=good, config=config,
+                                                    event_errors_by_id=event_errors_by_id)
+                for event in events]
     if client_type == 'kinesis':
-        client = boto3.client('kinesis')
+        _put_kinesis_records(client, stream_name, messages)
     else:
-        client = boto3.client('sqs')
+        # sqs doesn't support binary payloads, so in this case we base64 encode
+        _send_sqs_messages(client, stream_name, [str(base64.b64encode(data), 'UTF-8') for data in messages])
 
-    for event in events:
-        data = prepare_event_for_snowplow_pipeline(event=event, good=good, event_errors=event_errors, config=config)
 
-        if client_type == 'kinesis':
-            try:
-                client.put_record(
-                    StreamName=stream_name,
-                    Data=data,
-                    PartitionKey='event_id')
-            except client.exceptions.ProvisionedThroughputExceededException as e:
-                print(f'Could not deliver event to Kinesis: throughput exceeded in {stream_name}: {e}')
-            except botocore.exceptions.ClientError as e:
-                print(f'Exception sending event to Kinesis ({stream_name}: {e}')
+@lru_cache(maxsize=None)
+def _get_aws_client(client_type: str, pid: int) -> Any:
+    """
+    Get a boto3 client for kinesis or sqs. Clients are created once per process, and reused; boto3 clients
+    are thread-safe, but should not be shared with forked processes.
+    :param client_type: 'kinesis' or 'sqs'
+    :param pid: id of the current process
+    """
+    return boto3.client(client_type)
 
-        elif client_type == 'sqs':
-            # sqs doesn't support binary payloads, so in this case we base64 encode
-            payload = str(base64.b64encode(data), 'UTF-8')
 
-            try:
-                client.send_message(QueueUrl=stream_name,
-                                    MessageBody=payload,
-                                    MessageAttributes={
-                                        #  The sqs message attribute that will be used to set the kinesis partition key
-                                        'kinesisKey': {
-                                            'StringValue': 'event_id',
-                                            'DataType': 'String'
-                                        }
-                                    })
-            except client.exceptions.InvalidMessageContents as e:
-                print(f'Failed to deliver event to SQS: Invalid Message Contents ({stream_name}: {e}')
-            except botocore.exceptions.ClientError as e:
-                print(f'Failed to deliver event to SQS ({stream_name}: {e}')
+@lru_cache(maxsize=None)
+def _get_pubsub_publisher(pid: int) -> Any:
+    """
+    Get a Pub/Sub publisher client. The client is created once per process, and reused; it is thread-safe,
+    but should not be shared with forked processes.
+    :param pid: id of the current process
+    """
+    batch_settings = pubsub_v1.types.BatchSettings(
+        max_messages=PUBSUB_MAX_MESSAGES,
+        max_bytes=PUBSUB_MAX_BYTES,
+        max_latency=PUBSUB_MAX_LATENCY_SECONDS
+    )
+    return pubsub_v1.PublisherClient(batch_settings=batch_settings)
 
-        else:
-            # this should never happen
-            raise ValueError(f'Unknown Client-Type: {client_type}')
 
+def _chunks(messages: List[Any], max_count: int, max_bytes: int) -> Iterator[List[Tuple[int, Any]]]:
+    """
+    Split messages in chunks of at most max_count messages and at most max_bytes bytes. A message that is
+    bigger than max_bytes by itself gets a chunk of its own.
+    :return: iterator of chunks, each chunk is a list of tuples (index in messages, message)
+    """
+    chunk: List[Tuple[int, Any]] = []
+    chunk_bytes = 0
+    for index, message in enumerate(messages):
+        if chunk and (len(chunk) == max_count or chunk_bytes + len(message) > max_bytes):
+            yield chunk
+            chunk = []
+            chunk_bytes = 0
+        chunk.append((index, message))
+        chunk_bytes += len(message)
+    if chunk:
+        yield chunk
+
+
+def _put_kinesis_records(client, stream_name: str, messages: List[bytes]):
+    """
+    Put messages on a Kinesis stream with put_records(), KINESIS_MAX_RECORDS at a time. put_records() is not
+    atomic: records that failed, e.g. because the throughput of a shard was exceeded, are retried.
+    """
+    for attempt in range(MAX_SEND_ATTEMPTS):
+        if attempt:
+            time.sleep(RETRY_WAIT_SECONDS * 2 ** (attempt - 1))
+        failed_messages: List[bytes] = []
+        for chunk in _chunks(messages, KINESIS_MAX_RECORDS, KINESIS_MAX_BYTES):
+            records = [{'Data': data, 'PartitionKey': 'event_id'} for _, data in chunk]
+            try:
+                response = client.put_records(StreamName=stream_name, Records=records)
+            except botocore.exceptions.ClientError as e:
+                logger.warning('Exception sending events to Kinesis (%s): %s', stream_name, e)
+                failed_messages.extend(data for _, data in chunk)
+                continue
+            for (_, data), result in zip(chunk, response['Records']):
+                if 'ErrorCode' in result:
+                    # e.g. ProvisionedThroughputExceededException
+                    failed_messages.append(data)
+        if failed_messages:
+            logger.warning('Could not deliver %d events to Kinesis (%s), attempt %d of %d',
+                           len(failed_messages), stream_name, attempt + 1, MAX_SEND_ATTEMPTS)
+        messages = failed_messages
+        if not messages:
+            return
+    logger.error('Giving up on delivering %d events to Kinesis (%s)', len(messages), stream_name)
+
+
+def _send_sqs_messages(client, queue_url: str, messages: List[str]):
+    """
+    Send messages to an SQS queue with send_message_batch(), SQS_MAX_MESSAGES at a time. Messages that
+    failed because of an error on the side of SQS are retried, messages that are invalid are not.
+    """
+    for attempt in range(MAX_SEND_ATTEMPTS):
+        if attempt:
+            time.sleep(RETRY_WAIT_SECONDS * 2 ** (attempt - 1))
+        failed_messages: List[str] = []
+        for chunk in _chunks(messages, SQS_MAX_MESSAGES, SQS_MAX_BYTES):
+            entries = [{
+                'Id': str(index),
+                'MessageBody': payload,
+                'MessageAttributes': {
+                    #  The sqs message attribute that will be used to set the kinesis partition key
+                    'kinesisKey': {
+                        'StringValue': 'event_id',
+                        'DataType': 'String'
+                    }
+                }
+            } for index, payload in chunk]
+            try:
+                response = client.send_message_batch(QueueUrl=queue_url, Entries=entries)
+            except botocore.exceptions.ClientError as e:
+                logger.warning('Failed to deliver events to SQS (%s): %s', queue_url, e)
+                failed_messages.extend(payload for _, payload in chunk)
+                continue
+            payloads = dict(chunk)
+            for failure in response.get('Failed', []):
+                if failure.get('SenderFault'):
+                    logger.error('Failed to deliver event to SQS (%s): %s', queue_url, failure.get('Message'))
+                else:
+                    failed_messages.append(payloads[int(failure['Id'])])
+        messages = failed_messages
+        if not messages:
+            return
+    logger.error('Giving up on delivering %d events to SQS (%s)', len(messages), queue_url)
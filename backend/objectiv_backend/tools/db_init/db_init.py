@@ -5,10 +5,16 @@ initialized correctly and exit successfully.
 
 This assumes that the user and database already exist.
 
+With --partition-data-by-day the data table is range partitioned by day, see create_data_partitioned.sql.
+Partitions are created for the coming days at initialization. Run with --create-partitions regularly (e.g.
+daily) to create the partitions for the following days. Old data can be removed with the
+drop_data_partitions() function, see create_data_partitioned.sql.
+
 Copyright 2021 Objectiv B.V.
 """
 import argparse
 import os
+import re
 import sys
 from time import sleep
 
@@ -20,11 +26,41 @@ from objectiv_backend.common.db import get_db_connection
 _MAX_RETRIES = 5
 _POSTGRES_DUPLICATE_TABLE_ERROR = '42P07'
 
+# Number of days after today for which data partitions are created
+DEFAULT_PARTITION_DAYS_AHEAD = 7
+
+# The definition of the data table in create_tables.sql, including its index
+_DATA_TABLE_REGEX = re.compile(r'^create table data \(.*?^\);\s*^create index on data\(day\);$',
+                               re.MULTILINE | re.DOTALL)
+
+
+def get_sql(partition_data_by_day: bool = False,
+            partition_days_ahead: int = DEFAULT_PARTITION_DAYS_AHEAD) -> str:
+    """
+    get content of ../../create_tables.sql as string
+    :param partition_data_by_day: if set, the data table definition is replaced with the partitioned layout
+        of ../../create_data_partitioned.sql, and the partitions for the coming days are created.
+    :param partition_days_ahead: number of days after today to create data partitions for
+    """
+    sql = _read_sql_file('create_tables.sql')
+    if not partition_data_by_day:
+        return sql
+    partitioned_sql = _read_sql_file('create_data_partitioned.sql') + '\n' + \
+        get_create_partitions_sql(partition_days_ahead)
+    sql, count = _DATA_TABLE_REGEX.subn(lambda _: partitioned_sql, sql)
+    if count != 1:
+        raise Exception('Cannot find the data table definition in create_tables.sql')
+    return sql
+
+
+def get_create_partitions_sql(days_ahead: int) -> str:
+    """ Get the sql to create the missing data partitions for today up to and including days_ahead. """
+    return f'select create_data_partitions(current_date, current_date + {int(days_ahead)});'
+
 
-def get_sql() -> str:
-    """ get content of ../../create_tables.sql as string """
+def _read_sql_file(name: str) -> str:
     dirname = os.path.dirname(__file__)
-    filename = os.path.join(dirname, '../../create_tables.sql')
+    filename = os.path.join(dirname, '../..', name)
     with open(filename) as f:
         return f.read()
 
@@ -54,8 +90,23 @@ def main():
                              "giving the database time to start up if run at start up. If set won't retry")
     parser.add_argument('--print', dest='print', default=False, action='store_true',
                         help="Instead of running sql to setup schema, print it to stdout")
+    parser.add_argument('--partition-data-by-day', dest='partition_data_by_day', default=False,
+                        action='store_true',
+                        help="Create the data table range partitioned by day. Only has effect if the database "
+                             "is not yet initialized")
+    parser.add_argument('--create-partitions', dest='create_partitions', default=False, action='store_true',
+                        help="Don't initialize the database, only create the missing partitions of an "
+                             "already initialized database with a partitioned data table")
+    parser.add_argument('--partition-days-ahead', dest='partition_days_ahead', type=int,
+                        default=DEFAULT_PARTITION_DAYS_AHEAD,
+                        help=f"Number of days after today to create data partitions for. "
+                             f"Default: {DEFAULT_PARTITION_DAYS_AHEAD}")
     args = parser.parse_args(sys.argv[1:])
-    sql = get_sql()
+    if args.create_partitions:
+        sql = get_create_partitions_sql(args.partition_days_ahead)
+    else:
+        sql = get_sql(partition_data_by_day=args.partition_data_by_day,
+                      partition_days_ahead=args.partition_days_ahead)
 
     if args.print:
         print(sql)
@@ -63,6 +114,11 @@ def main():
 
     connection = get_connection_with_retries(args.retry)
     with connection.cursor() as cursor:
+        if args.create_partitions:
+            with connection:
+                cursor.execute(sql)
+                print(f'Created {cursor.fetchone()[0]} data partition(s).')
+            exit(0)
         try:
             cursor.execute(sql)
             print('Succesfully initialized database.')
@@ -1,14 +1,16 @@
 """
 Copyright 2021 Objectiv B.V.
 """
-import json
+import select
 import uuid
 from enum import Enum
-from typing import List, Tuple
+from typing import List, Tuple, Sequence, Optional
 
 import psycopg2
-from psycopg2.extras import execute_values
+import psycopg2.extras
 
+from objectiv_backend.common.db import copy_rows
+from objectiv_backend.common.json_codec import json_dumps
 from objectiv_backend.common.types import EventDataList
 
 
@@ -27,6 +29,9 @@ class PostgresQueues:
 
     This class assumes that the postgres connection has the isolation level ISOLATION_LEVEL_READ_COMMITTED
     set.
+
+    put_events() notifies listeners on the queue's channel. Workers can use listen() and wait_for_events()
+    to wake up as soon as there are new events, instead of polling the queues.
     """
 
     def __init__(self, connection):
@@ -66,26 +71,77 @@ class PostgresQueues:
         '''
         with self.connection.cursor(cursor_factory=psycopg2.extras.NamedTupleCursor) as cursor:
             cursor.execute(query, (max_items, ))
-            events_with_id: EventDataList = cursor.fetchall()
+            # psycopg2 parses the json value, which contains the complete event, including the id
+            events_with_id: EventDataList = [row.value for row in cursor.fetchall()]
         return events_with_id
 
     def put_events(self,
                    queue: ProcessingStage,
-                   events: EventDataList):
+                   events: EventDataList,
+                   serialized_events: Optional[List[str]] = None):
         """
         Put an event with a given event-id on a queue
 
         :param queue: Which queue to put the event on
         :param events: list of events with ids
+        :param serialized_events: optional, the events serialized with json_dumps(). If not set, the events
+            will be serialized here.
         """
         if not events:
             return
         table_name = self._queue_to_table(queue)
-        insert_query = f'''
-            insert into
-            {table_name}(event_id, value)
-            values %s
-            '''
-        values: List[Tuple[uuid.UUID, str]] = [(event['id'], json.dumps(event)) for event in events]
+        if serialized_events is None:
+            serialized_events = [json_dumps(event) for event in events]
+        values: List[Tuple[uuid.UUID, str]] = [
+            (event['id'], serialized) for event, serialized in zip(events, serialized_events)
+        ]
+        with self.connection.cursor() as cursor:
+            copy_rows(cursor, table_name, ('event_id', 'value'), values)
+            # Wake up the workers that are waiting for events on this queue. Postgres only delivers the
+            # notification when the transaction commits, and delivers it only once per transaction.
+            cursor.execute('select pg_notify(%s, %s)', (table_name, ''))
+
+    def listen(self, queues: Sequence[ProcessingStage]):
+        """
+        Subscribe this connection to notifications of new events on the given queues.
+
+        Unlike the other methods, this does transaction management: it commits the current transaction, as
+        Postgres only starts listening after the transaction commits.
+        :param queues: queues to listen to
+        """
+        with self.connection.cursor() as cursor:
+            for queue in queues:
+                cursor.execute(f'listen {self._queue_to_table(queue)}')
+        self.connection.commit()
+
+    def wait_for_events(self, timeout: float) -> bool:
+        """
+        Block until events are put on one of the queues that we listen to (see listen()), or until timeout
+        seconds have passed. Returns directly if a notification was already received, e.g. during the
+        previous transaction.
+
+        Must not be called while a transaction is in progress.
+        :param timeout: maximum number of seconds to wait
+        :return: True if there was a notification, False on timeout
+        """
+        if not self.connection.notifies:
+            readable, _, _ = select.select([self.connection], [], [], timeout)
+            if not readable:
+                return False
+            self.connection.poll()
+        notified = bool(self.connection.notifies)
+        self.connection.notifies.clear()
+        return notified
+
+    def get_queue_size(self, queue: ProcessingStage) -> int:
+        """
+        Get the number of events in a queue. Counts the queue, so this is not meant to be called per batch
+        on a queue that can grow large.
+        :param queue: Queue of which to count the events
+        :return: number of events in the queue
+        """
+        table_name = self._queue_to_table(queue)
         with self.connection.cursor() as cursor:
-            execute_values(cursor, insert_query, values, template=None, page_size=100)
+            cursor.execute(f'select count(*) from {table_name}')
+            count, = cursor.fetchone()
+        return count
@@ -1,17 +1,33 @@
 """
 Copyright 2021 Objectiv B.V.
 """
-import json
+import logging
+import uuid
 from datetime import datetime, timedelta
+from typing import List, Tuple, Optional
 
 
 from psycopg2.extras import execute_values
 
+from objectiv_backend.common.db import copy_rows
 from objectiv_backend.common.event_utils import get_context
-from objectiv_backend.common.types import FailureReason, EventDataList
+from objectiv_backend.common.json_codec import json_dumps
+from objectiv_backend.common.metrics import DUPLICATE_EVENTS
+from objectiv_backend.common.types import FailureReason, EventDataList, EventData
 
+# Batches with at least this many events are inserted into the data table through a staging table that is
+# filled with COPY. For smaller batches the overhead of the staging table outweighs the gain of COPY.
+BULK_INSERT_MIN_EVENTS = 100
 
-def insert_events_into_data(connection, events: EventDataList):
+_DATA_COLUMNS = ('event_id', 'day', 'moment', 'cookie_id', 'value')
+_NOK_DATA_COLUMNS = ('event_id', 'day', 'moment', 'cookie_id', 'value', 'reason')
+
+logger = logging.getLogger(__name__)
+
+
+def insert_events_into_data(connection,
+                            events: EventDataList,
+                            serialized_events: Optional[List[str]] = None):
     """
     Insert events into the 'data' table.
 
@@ -30,11 +46,90 @@ def insert_events_into_data(connection, events: EventDataList):
 
     :param connection: psycopg2 database connection, must have ISOLATION_LEVEL_READ_COMMITTED set.
     :param events: EventDataList, list of events. Each event must be a valid Event, and must have a CookieIdContext
+    :param serialized_events: optional, the events serialized with json_dumps(). If not set, the events will
+        be serialized here.
     :raise Exception: If the database is not available, or if it blocks longer than lock_timeout.
     """
     if not events:
         return
 
+    # Both insert methods skip events with an event_id that already exists, and return the event_ids of the
+    # events that were actually inserted. See _insert_rows_into_data() for details.
+    serialized_events = _get_serialized_events(events, serialized_events)
+    values = [_event_to_row(event, serialized) for event, serialized in zip(events, serialized_events)]
+    if len(events) >= BULK_INSERT_MIN_EVENTS:
+        inserted_event_ids = _insert_rows_into_data_bulk(connection, values)
+    else:
+        inserted_event_ids = _insert_rows_into_data(connection, values)
+
+    # Determine whether there were any duplicate events that were already in the table
+    # In case of duplicate events, we'll add those to the nok_data table for traceability
+    duplicate_events: EventDataList = []
+    serialized_duplicate_events: List[str] = []
+    if len(inserted_event_ids) < len(events):
+        inserted_event_ids_set = {str(event_id) for event_id, in inserted_event_ids}
+        for event, serialized in zip(events, serialized_events):
+            if event['id'] not in inserted_event_ids_set:
+                duplicate_events.append(event)
+                serialized_duplicate_events.append(serialized)
+    if duplicate_events:
+        logger.info('Duplicate events found, count: %d. Will be inserted in nok_data table.',
+                    len(duplicate_events))
+        DUPLICATE_EVENTS.inc(len(duplicate_events))
+        insert_events_into_nok_data(connection,
+                                    duplicate_events,
+                                    reason=FailureReason.DUPLICATE,
+                                    serialized_events=serialized_duplicate_events)
+
+
+def insert_events_into_nok_data(connection,
+                                events: EventDataList,
+                                reason: FailureReason = FailureReason.FAILED_VALIDATION,
+                                serialized_events: Optional[List[str]] = None):
+    """
+    Insert events into the not-ok data ('nok_data') table
+    Does not do any transaction management, this merely issues insert commands.
+    :param connection: db connection
+    :param events: EventDataList, list of events. Each event must have a CookieIdContext
+    :param reason: Why are these events written to the nok_data table.
+    :param serialized_events: optional, the events serialized with json_dumps(). If not set, the events will
+        be serialized here.
+    """
+    if not events:
+        return
+
+    serialized_events = _get_serialized_events(events, serialized_events)
+    values = [_event_to_row(event, serialized) + (reason.value, )
+              for event, serialized in zip(events, serialized_events)]
+    with connection.cursor() as cursor:
+        copy_rows(cursor, 'nok_data', _NOK_DATA_COLUMNS, values)
+
+
+def _get_serialized_events(events: EventDataList, serialized_events: Optional[List[str]]) -> List[str]:
+    if serialized_events is None:
+        return [json_dumps(event) for event in events]
+    if len(serialized_events) != len(events):
+        raise ValueError(f'Got {len(serialized_events)} serialized events for {len(events)} events')
+    return serialized_events
+
+
+def _event_to_row(event: EventData, serialized_event: str) -> Tuple:
+    """ Give the values for the columns of the data table (_DATA_COLUMNS) for an event. """
+    timestamp = _millis_to_datetime(event['time'])
+    cookie_id = get_context(event, 'CookieIdContext')['cookie_id']
+    return (event['id'],
+            timestamp,
+            timestamp,
+            cookie_id,
+            serialized_event)
+
+
+def _insert_rows_into_data(connection, values: List[Tuple]) -> List[Tuple[uuid.UUID]]:
+    """
+    Insert rows into the data table with a multi-row insert statement. Rows that conflict with an existing
+    event_id are skipped.
+    :return: list of one-tuples with the event_ids of the inserted rows
+    """
     # We use 'on conflict do nothing'. With the read-committed isolation level this guarantees that this
     # transaction will not insert a row that will conflict with another transaction, even if the results
     # of that transaction are not yet visible to this transaction [1]. This guarantees that the transaction
@@ -48,69 +143,47 @@ def insert_events_into_data(connection, events: EventDataList):
     # lock_timeout then this will result in a failed transaction, and this function will raise an
     # exception.
     #
+    # There is no conflict target, as the data table might be partitioned (see create_data_partitioned.sql).
+    # In that case there is no unique index on just event_id, instead a trigger skips the duplicate rows,
+    # with the same guarantees.
+    #
     # [1] https://www.postgresql.org/docs/13/transaction-iso.html
     # [2] https://www.postgresql.org/docs/13/sql-insert.html
     insert_query = f'''
-        insert into data(event_id, day, moment, cookie_id, value)
+        insert into data({", ".join(_DATA_COLUMNS)})
         values %s
-        on conflict(event_id) do nothing
+        on conflict do nothing
         returning event_id
     '''
-    values = []
-    for event in events:
-        timestamp = _millis_to_datetime(event['time'])
-        cookie_id = get_context(event, 'CookieIdContext')['cookie_id']
-        value = (event['id'],
-                 timestamp,
-                 timestamp,
-                 cookie_id,
-                 json.dumps(event))
-        values.append(value)
     with connection.cursor() as cursor:
-        inserted_event_ids = execute_values(
-            cursor, insert_query, values, template=None, page_size=100, fetch=True)
-
-    # Determine whether there were any duplicate events that were already in the table
-    # In case of duplicate events, we'll add those to the nok_data table for traceability
-    duplicate_events: EventDataList = []
-    if len(inserted_event_ids) < len(events):
-        inserted_event_ids_set = set(inserted_event_ids)
-        for event in events:
-            if event['id'] not in inserted_event_ids_set:
-                duplicate_events.append(event)
-    if duplicate_events:
-        print(f'Duplicate events found, count: {len(duplicate_events)}. '
-              f'Will be inserted in nok_data table.')
-        insert_events_into_nok_data(connection, duplicate_events, reason=FailureReason.DUPLICATE)
+        return execute_values(cursor, insert_query, values, template=None, page_size=100, fetch=True)
 
 
-def insert_events_into_nok_data(connection,
-                                events: EventDataList,
-                                reason: FailureReason = FailureReason.FAILED_VALIDATION):
+def _insert_rows_into_data_bulk(connection, values: List[Tuple]) -> List[Tuple[uuid.UUID]]:
     """
-    Insert events into the not-ok data ('nok_data') table
-    Does not do any transaction management, this merely issues insert commands.
-    :param connection: db connection
-    :param events: EventDataList, list of events. Each event must have a CookieIdContext
-    :param reason: Why are these events written to the nok_data table.
+    Same as _insert_rows_into_data(), but first loads the rows with COPY into a temporary staging table, and
+    then moves them to the data table with a single `insert ... select ... on conflict do nothing`. The same
+    guarantees as described in _insert_rows_into_data() apply.
+    :return: list of one-tuples with the event_ids of the inserted rows
     """
-    if not events:
-        return
-
-    insert_query = f'insert into nok_data (event_id, day, moment, cookie_id, value, reason) values %s'
-    values = []
-    for event in events:
-        timestamp = _millis_to_datetime(event['time'])
-        cookie_id = get_context(event, 'CookieIdContext')['cookie_id']
-        value = (event['id'],
-                 timestamp,
-                 timestamp,
-                 cookie_id,
-                 json.dumps(event),
-                 reason.value)
-        values.append(value)
+    columns = ", ".join(_DATA_COLUMNS)
     with connection.cursor() as cursor:
-        execute_values(cursor, insert_query, values, template=None, page_size=100)
+        # The staging table is private to this session. It's emptied when the transaction ends, but might
+        # still contain rows from an earlier call in the same transaction.
+        cursor.execute('''
+            create temporary table if not exists data_staging
+            (like data including defaults)
+            on commit delete rows;
+            truncate data_staging;
+        ''')
+        copy_rows(cursor, 'data_staging', _DATA_COLUMNS, values)
+        cursor.execute(f'''
+            insert into data({columns})
+            select {columns} from data_staging
+            on conflict do nothing
+            returning event_id
+        ''')
+        return cursor.fetchall()
 
 
 def _millis_to_datetime(millis: int) -> datetime:
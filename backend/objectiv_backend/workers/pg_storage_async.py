@@ -0,0 +1,96 @@
+"""
+Copyright 2022 Objectiv B.V.
+
+asyncio versions of the functions in pg_storage.py and of PostgresQueues.put_events(), for the ASGI
+collector. The connections are asyncpg connections, as handed out by the pool of
+create_async_connection_pool(). Requires the `asgi` extra: pip install objectiv-backend[asgi]
+
+Each function inserts all events with a single statement, by passing the values as arrays and unnesting
+those. The same assumptions and guarantees as for the synchronous versions apply, see pg_storage.py.
+"""
+import logging
+from typing import List, Optional
+
+import asyncpg
+
+from objectiv_backend.common.metrics import DUPLICATE_EVENTS
+from objectiv_backend.common.types import FailureReason, EventDataList
+from objectiv_backend.workers.pg_queues import PostgresQueues, ProcessingStage
+from objectiv_backend.workers.pg_storage import _event_to_row, _get_serialized_events
+
+logger = logging.getLogger(__name__)
+
+
+async def insert_events_into_data_async(connection: asyncpg.Connection,
+                                        events: EventDataList,
+                                        serialized_events: Optional[List[str]] = None):
+    """
+    Insert events into the 'data' table, and the duplicate events into the 'nok_data' table.
+    See pg_storage.insert_events_into_data()
+    """
+    if not events:
+        return
+    serialized_events = _get_serialized_events(events, serialized_events)
+    rows = [_event_to_row(event, serialized) for event, serialized in zip(events, serialized_events)]
+    # See pg_storage._insert_rows_into_data() for why we use 'on conflict do nothing'
+    inserted_records = await connection.fetch('''
+        insert into data(event_id, day, moment, cookie_id, value)
+        select * from unnest($1::uuid[], $2::date[], $3::timestamp[], $4::uuid[], $5::json[])
+        on conflict do nothing
+        returning event_id
+    ''', *_columns(rows))
+
+    if len(inserted_records) == len(events):
+        return
+    inserted_event_ids = {str(record['event_id']) for record in inserted_records}
+    duplicates = [(event, serialized) for event, serialized in zip(events, serialized_events)
+                  if event['id'] not in inserted_event_ids]
+    logger.info('Duplicate events found, count: %d. Will be inserted in nok_data table.', len(duplicates))
+    DUPLICATE_EVENTS.inc(len(duplicates))
+    await insert_events_into_nok_data_async(connection,
+                                            events=[event for event, _ in duplicates],
+                                            reason=FailureReason.DUPLICATE,
+                                            serialized_events=[serialized for _, serialized in duplicates])
+
+
+async def insert_events_into_nok_data_async(connection: asyncpg.Connection,
+                                            events: EventDataList,
+                                            reason: FailureReason = FailureReason.FAILED_VALIDATION,
+                                            serialized_events: Optional[List[str]] = None):
+    """
+    Insert events into the not-ok data ('nok_data') table.
+    See pg_storage.insert_events_into_nok_data()
+    """
+    if not events:
+        return
+    serialized_events = _get_serialized_events(events, serialized_events)
+    rows = [_event_to_row(event, serialized) for event, serialized in zip(events, serialized_events)]
+    await connection.execute('''
+        insert into nok_data(event_id, day, moment, cookie_id, value, reason)
+        select *, $6::failure_reason
+        from unnest($1::uuid[], $2::date[], $3::timestamp[], $4::uuid[], $5::json[])
+    ''', *_columns(rows), reason.value)
+
+
+async def put_events_async(connection: asyncpg.Connection,
+                           queue: ProcessingStage,
+                           events: EventDataList,
+                           serialized_events: Optional[List[str]] = None):
+    """
+    Put events on a queue, and notify the workers that listen on that queue.
+    See PostgresQueues.put_events()
+    """
+    if not events:
+        return
+    table_name = PostgresQueues._queue_to_table(queue)
+    serialized_events = _get_serialized_events(events, serialized_events)
+    await connection.execute(f'''
+        insert into {table_name}(event_id, value)
+        select * from unnest($1::uuid[], $2::json[])
+    ''', [event['id'] for event in events], serialized_events)
+    await connection.execute('select pg_notify($1, $2)', table_name, '')
+
+
+def _columns(rows: List[tuple]) -> List[list]:
+    """ Transpose a list of rows to a list of columns. """
+    return [list(column) for column in zip(*rows)]
@@ -1,36 +1,194 @@
 """
 Copyright 2021 Objectiv B.V.
 """
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
 import time
-from typing import Callable, Any
+from typing import Callable, Dict, List, Optional, Sequence, cast
 
-from objectiv_backend.common.config import get_config_postgres
+from objectiv_backend.common.config import get_config_metrics, get_config_postgres, get_config_worker, \
+    init_logging, WorkerConfig
 from objectiv_backend.common.db import get_db_connection
+from objectiv_backend.common.metrics import QUEUE_DEPTH, WORKER_BATCH_SECONDS, WORKER_EVENTS, \
+    start_metrics_server
+from objectiv_backend.workers.pg_queues import PostgresQueues, ProcessingStage
 
+# A worker function takes a connection and a batch size, and returns the number of processed events
+WorkerFunction = Callable[[object, int], int]
 
-def worker_main(function: Callable[[Any], int], loop: bool) -> int:
+# If metrics are enabled, the sizes of the listened queues are counted at most once per this many seconds
+QUEUE_DEPTH_INTERVAL_SECONDS = 10
+
+logger = logging.getLogger(__name__)
+
+
+def worker_main(function: WorkerFunction,
+                loop: bool,
+                worker_config: Optional[WorkerConfig] = None,
+                listen_queues: Sequence[ProcessingStage] = ()) -> int:
     """
-    Run the function once, or in a loop.
-    Will print the last part of the function's name and information about the function's execution time.
+    Run the function once, or in a loop, in worker_config.concurrency processes.
+    Will log the last part of the function's name and information about the throughput of each batch.
+    If metrics are enabled, then these are served on the configured port, see common/metrics.py.
 
-    If running in a loop it will sleep a second between invocations if the function returns 0.
-    :param function: function that will be called. Should take a `connection` as arguments. The connection
-        is a db_connection as delivered by get_db_connection()
+    Each process has its own database connection. The functions are expected to take their work from the
+    queues with `for update skip locked`, so the processes can work on the same queue without blocking
+    each other.
+
+    If running in a loop, a process will sleep if the function returns 0. The sleep time starts at
+    worker_config.min_sleep_seconds and doubles every consecutive time that there is no work, up to
+    worker_config.max_sleep_seconds. If listen_queues is set, then the process wakes up as soon as events
+    are put on one of those queues, and the sleep time only serves as fallback.
+    :param function: function that will be called. Should take a `connection` and a `batch_size` as
+        arguments. The connection is a db_connection as delivered by get_db_connection()
     :param loop: whether to call the function once (False) or in an endless loop (True)
+    :param worker_config: batch size, concurrency and sleep settings. If None, get_config_worker() is used.
+    :param listen_queues: queues on which new events should wake up a sleeping process.
     :return number of processed events, if loop is False
     """
+    init_logging()
+    if worker_config is None:
+        worker_config = get_config_worker()
+    metrics_config = get_config_metrics()
+    if metrics_config:
+        if worker_config.concurrency > 1 and 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+            logger.warning('Set PROMETHEUS_MULTIPROC_DIR to serve the metrics of all worker processes')
+        start_metrics_server(metrics_config.worker_port)
+    if worker_config.concurrency == 1:
+        return _worker_process(function, loop, worker_config, listen_queues)
+    return _run_worker_processes(function, loop, worker_config, listen_queues)
+
+
+def _run_worker_processes(function: WorkerFunction,
+                          loop: bool,
+                          worker_config: WorkerConfig,
+                          listen_queues: Sequence[ProcessingStage]) -> int:
+    """
+    Run the function in worker_config.concurrency processes, see worker_main(). Returns the sum of the
+    event counts of the processes.
+
+    If a process fails, because the function raised an exception or because the process was killed, then
+    the other processes are terminated, and the exception is raised. So a worker that runs in a loop stops,
+    instead of silently continuing with fewer processes.
+    """
+    processes: List[multiprocessing.Process] = []
+    # the receiving end of the pipe of each process, on which it sends its result
+    receivers: Dict[multiprocessing.connection.Connection, multiprocessing.Process] = {}
+    try:
+        for _ in range(worker_config.concurrency):
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=_worker_process_entry,
+                                              args=(sender, function, loop, worker_config, listen_queues))
+            process.start()
+            # only the process should hold the sending end, so the receiver gets EOF once it exits
+            sender.close()
+            processes.append(process)
+            receivers[receiver] = process
+
+        event_count = 0
+        while receivers:
+            for ready in multiprocessing.connection.wait(list(receivers)):
+                receiver = cast(multiprocessing.connection.Connection, ready)
+                process = receivers.pop(receiver)
+                try:
+                    result = receiver.recv()
+                except EOFError:
+                    process.join()
+                    raise Exception(f'Worker process {process.pid} exited with code {process.exitcode}')
+                finally:
+                    receiver.close()
+                if isinstance(result, BaseException):
+                    raise result
+                event_count += result
+        return event_count
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+
+
+def _worker_process_entry(sender: multiprocessing.connection.Connection,
+                          function: WorkerFunction,
+                          loop: bool,
+                          worker_config: WorkerConfig,
+                          listen_queues: Sequence[ProcessingStage]):
+    """ Run _worker_process(), and send its result, or the exception that it raised, to sender. """
+    try:
+        try:
+            result = _worker_process(function, loop, worker_config, listen_queues)
+        except Exception as exc:
+            logger.exception('Worker process failed')
+            try:
+                sender.send(exc)
+            except Exception:
+                # the exception can't be pickled
+                sender.send(Exception(repr(exc)))
+        else:
+            sender.send(result)
+    finally:
+        sender.close()
+
+
+def _worker_process(function: WorkerFunction,
+                    loop: bool,
+                    worker_config: WorkerConfig,
+                    listen_queues: Sequence[ProcessingStage]) -> int:
+    """ Run the function once, or in a loop, on a new connection. See worker_main() """
     pg_config = get_config_postgres()
     if pg_config is None:
         raise Exception('Missing Postgres configuration')
     connection = get_db_connection(pg_config)
     name = function.__name__.split('_')[-1]
-    print(f'{name} worker')
-    while True:
-        start = time.time()
-        event_count = function(connection)
-        end = time.time()
-        print(f'Processing time: {(end - start):.5} s')
-        if not loop:
-            return event_count
-        if event_count == 0:
-            time.sleep(1)
+    logger.info('%s worker', name)
+    sleep_seconds = worker_config.min_sleep_seconds
+    pg_queues = PostgresQueues(connection=connection)
+    # only count the queues if the metrics are served
+    next_queue_depth_update = time.monotonic() if get_config_metrics() else float('inf')
+    try:
+        if loop and listen_queues:
+            pg_queues.listen(listen_queues)
+        while True:
+            start = time.time()
+            event_count = function(connection, worker_config.batch_size)
+            end = time.time()
+            _log_batch_throughput(name, event_count, end - start)
+            if time.monotonic() >= next_queue_depth_update:
+                _update_queue_depth(pg_queues, listen_queues)
+                next_queue_depth_update = time.monotonic() + QUEUE_DEPTH_INTERVAL_SECONDS
+            if not loop:
+                return event_count
+            if event_count == 0:
+                if listen_queues:
+                    notified = pg_queues.wait_for_events(timeout=sleep_seconds)
+                else:
+                    time.sleep(sleep_seconds)
+                    notified = False
+                if notified:
+                    sleep_seconds = worker_config.min_sleep_seconds
+                else:
+                    sleep_seconds = min(sleep_seconds * 2, worker_config.max_sleep_seconds)
+            else:
+                sleep_seconds = worker_config.min_sleep_seconds
+    finally:
+        connection.close()
+
+
+def _log_batch_throughput(name: str, event_count: int, seconds: float):
+    if event_count == 0:
+        return
+    WORKER_BATCH_SECONDS.labels(worker=name).observe(seconds)
+    WORKER_EVENTS.labels(worker=name).inc(event_count)
+    events_per_second = event_count / seconds if seconds else float('inf')
+    logger.info('%s worker - processed %d events in %.5f s (%.1f events/s)',
+                name, event_count, seconds, events_per_second)
+
+
+def _update_queue_depth(pg_queues: PostgresQueues, queues: Sequence[ProcessingStage]):
+    """ Set the queue depth metric of the queues. Commits, so must not be called during a transaction. """
+    with pg_queues.connection:
+        for queue in queues:
+            QUEUE_DEPTH.labels(queue=queue.value).set(pg_queues.get_queue_size(queue))
@@ -1,6 +1,7 @@
 """
 Copyright 2021 Objectiv B.V.
 """
+import logging
 import sys
 import time
 from typing import List, Tuple
@@ -13,17 +14,22 @@ from objectiv_backend.workers.pg_storage import insert_events_into_nok_data
 from objectiv_backend.workers.util import worker_main
 from objectiv_backend.common.types import EventDataList
 
+logger = logging.getLogger(__name__)
 
-def main_entry(connection) -> int:
+
+def main_entry(connection, batch_size: int = WORKER_BATCH_SIZE) -> int:
     """
     Pick events from the entry queue and insert them into the finalize queue.
+    :param connection: db connection
+    :param batch_size: maximum number of events to process
     :return number of processed events
     """
     with connection:
         pg_queues = PostgresQueues(connection=connection)
         events: EventDataList = pg_queues.get_events(queue=ProcessingStage.ENTRY,
-                                                     max_items=WORKER_BATCH_SIZE)
-        print(f'event-ids: {sorted(event["id"] for event in events)}')
+                                                     max_items=batch_size)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('event-ids: %s', sorted(event['id'] for event in events))
 
         ok_events, nok_events, event_errors = process_events_entry(events)
         # ok_events continue on the happy path
@@ -62,7 +68,7 @@ def process_events_entry(events: EventDataList, current_millis: int = 0) -> \
             validate_event_time(event=event, current_millis=current_millis)
 
         if error_info:
-            print(f"error, event_id: {event['id']}, errors: {[ei.info for ei in error_info]}")
+            logger.info('error, event_id: %s, errors: %s', event['id'], [ei.info for ei in error_info])
             nok_events.append(event)
             event_errors.append(EventError(event_id=event['id'], error_info=error_info))
         else:
@@ -73,4 +79,4 @@ def process_events_entry(events: EventDataList, current_millis: int = 0) -> \
 
 if __name__ == '__main__':
     _loop = sys.argv[1:2] == ['--loop']
-    worker_main(function=main_entry, loop=_loop)
+    worker_main(function=main_entry, loop=_loop, listen_queues=[ProcessingStage.ENTRY])
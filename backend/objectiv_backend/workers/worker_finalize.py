@@ -1,6 +1,7 @@
 """
 Copyright 2021 Objectiv B.V.
 """
+import logging
 import sys
 
 from objectiv_backend.common.config import WORKER_BATCH_SIZE
@@ -9,20 +10,25 @@ from objectiv_backend.workers.pg_queues import PostgresQueues, ProcessingStage
 from objectiv_backend.workers.pg_storage import insert_events_into_data
 from objectiv_backend.workers.util import worker_main
 
+logger = logging.getLogger(__name__)
 
-def main_finalize(connection) -> int:
+
+def main_finalize(connection, batch_size: int = WORKER_BATCH_SIZE) -> int:
     """
     Pick events from the finalize queue, and write them to the data table.
+    :param connection: db connection
+    :param batch_size: maximum number of events to process
     :return number of processed events
     """
     with connection:
         pg_queues = PostgresQueues(connection=connection)
-        events: EventDataList = pg_queues.get_events(queue=ProcessingStage.FINALIZE, max_items=WORKER_BATCH_SIZE)
-        print(f'event-ids: {sorted(event["id"] for event in events)}')
+        events: EventDataList = pg_queues.get_events(queue=ProcessingStage.FINALIZE, max_items=batch_size)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('event-ids: %s', sorted(event['id'] for event in events))
         insert_events_into_data(connection, events)
     return len(events)
 
 
 if __name__ == '__main__':
     _loop = sys.argv[1:2] == ['--loop']
-    worker_main(function=main_finalize, loop=_loop)
+    worker_main(function=main_finalize, loop=_loop, listen_queues=[ProcessingStage.FINALIZE])
@@ -0,0 +1,36 @@
+"""
+Copyright 2022 Objectiv B.V.
+"""
+import sys
+
+from objectiv_backend.common.config import WORKER_BATCH_SIZE
+from objectiv_backend.common.types import EventDataList
+from objectiv_backend.workers.pg_queues import PostgresQueues, ProcessingStage
+from objectiv_backend.workers.pg_storage import insert_events_into_data, insert_events_into_nok_data
+from objectiv_backend.workers.util import worker_main
+from objectiv_backend.workers.worker_entry import process_events_entry
+
+
+def main_pipeline(connection, batch_size: int = WORKER_BATCH_SIZE) -> int:
+    """
+    Pick events from the entry queue, and write them to the data table (or to the nok_data table if they
+    fail validation), all in a single transaction.
+
+    This combines main_entry() and main_finalize(), but skips the finalize queue. That saves writing,
+    deleting and (de)serializing every event once more.
+    :param connection: db connection
+    :param batch_size: maximum number of events to process
+    :return number of processed events
+    """
+    with connection:
+        pg_queues = PostgresQueues(connection=connection)
+        events: EventDataList = pg_queues.get_events(queue=ProcessingStage.ENTRY, max_items=batch_size)
+        ok_events, nok_events, event_errors = process_events_entry(events)
+        insert_events_into_data(connection, events=ok_events)
+        insert_events_into_nok_data(connection, events=nok_events)
+    return len(events)
+
+
+if __name__ == '__main__':
+    _loop = sys.argv[1:2] == ['--loop']
+    worker_main(function=main_pipeline, loop=_loop, listen_queues=[ProcessingStage.ENTRY])
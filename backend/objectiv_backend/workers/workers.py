@@ -3,40 +3,65 @@ Copyright 2021 Objectiv B.V.
 """
 import argparse
 import sys
-import time
 
-from objectiv_backend.common.config import WORKER_SLEEP_SECONDS
+from objectiv_backend.common.config import WORKER_BATCH_SIZE, get_config_worker
+from objectiv_backend.workers.pg_queues import ProcessingStage
 from objectiv_backend.workers.util import worker_main
 from objectiv_backend.workers.worker_entry import main_entry
 from objectiv_backend.workers.worker_finalize import main_finalize
+from objectiv_backend.workers.worker_pipeline import main_pipeline
 
 
-def call_all(loop: bool):
-    while True:
-        event_count = worker_main(function=main_entry, loop=False)
-        event_count += worker_main(function=main_finalize, loop=False)
-        if not loop:
-            break
-        if event_count == 0:
-            # sleeping a short random time is nice for catching concurrency problems
-            # time.sleep(0.2 * random.random())
-            time.sleep(WORKER_SLEEP_SECONDS)
+def main_all(connection, batch_size: int = WORKER_BATCH_SIZE) -> int:
+    """
+    Process a batch from the entry queue, and then a batch from the finalize queue.
+    :param connection: db connection
+    :param batch_size: maximum number of events to process per queue
+    :return number of processed events
+    """
+    event_count = main_entry(connection, batch_size)
+    event_count += main_finalize(connection, batch_size)
+    return event_count
 
 
 def main():
+    worker_config = get_config_worker()
     parser = argparse.ArgumentParser(prog='worker')
     parser.add_argument('type',
-                        choices=['all', 'entry', 'finalize'],
+                        choices=['all', 'entry', 'finalize', 'pipeline'],
                         default='all',
-                        type=str)
+                        type=str,
+                        help="'all' runs the entry and finalize steps. 'pipeline' runs both steps in a "
+                             "single transaction, skipping the finalize queue.")
     parser.add_argument('--loop', action='store_true')
+    parser.add_argument('--batch-size', type=int, default=worker_config.batch_size,
+                        help='Maximum number of events per batch')
+    parser.add_argument('--concurrency', type=int, default=worker_config.concurrency,
+                        help='Number of worker processes')
+    parser.add_argument('--min-sleep', type=float, default=worker_config.min_sleep_seconds,
+                        help='Seconds to sleep the first time there is no work, when running in a loop')
+    parser.add_argument('--max-sleep', type=float, default=worker_config.max_sleep_seconds,
+                        help='Maximum seconds to sleep when there is no work, when running in a loop')
     args = parser.parse_args(sys.argv[1:])
-    if args.type == 'all':
-        return call_all(args.loop)
-    if args.type == 'entry':
-        return worker_main(function=main_entry, loop=args.loop)
-    if args.type == 'finalize':
-        return worker_main(function=main_finalize, loop=args.loop)
+    if args.batch_size < 1 or args.concurrency < 1:
+        parser.error('--batch-size and --concurrency must be at least 1')
+    worker_config = worker_config._replace(
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        min_sleep_seconds=args.min_sleep,
+        max_sleep_seconds=max(args.min_sleep, args.max_sleep)
+    )
+    functions = {
+        'all': (main_all, [ProcessingStage.ENTRY, ProcessingStage.FINALIZE]),
+        'entry': (main_entry, [ProcessingStage.ENTRY]),
+        'finalize': (main_finalize, [ProcessingStage.FINALIZE]),
+        'pipeline': (main_pipeline, [ProcessingStage.ENTRY])
+    }
+    function, listen_queues = functions[args.type]
+    return worker_main(function=function,
+                       loop=args.loop,
+                       worker_config=worker_config,
+                       listen_queues=listen_queues)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,95 @@
+"""
+Copyright 2022 Objectiv B.V.
+
+Tests for the ASGI collector. These are skipped if the `asgi` extra is not installed.
+"""
+import json
+import time
+import uuid
+
+import pytest
+
+pytest.importorskip('starlette')
+pytest.importorskip('asyncpg')
+pytest.importorskip('httpx')
+
+from starlette.testclient import TestClient
+
+from objectiv_backend.app import create_app
+from objectiv_backend.asgi_app import create_asgi_app
+from objectiv_backend.common.config import get_collector_config
+from tests.schema.test_schema import CLICK_EVENT_JSON
+
+
+@pytest.fixture
+def asgi_client():
+    with TestClient(create_asgi_app()) as client:
+        yield client
+
+
+@pytest.fixture
+def flask_client():
+    return create_app().test_client()
+
+
+def _make_post_data(valid: bool = True) -> str:
+    event_list = json.loads(CLICK_EVENT_JSON)
+    now_millis = round(time.time() * 1000)
+    event = event_list['events'][0]
+    event['id'] = str(uuid.uuid4())
+    event['time'] = now_millis
+    if not valid:
+        event['location_stack'] = []
+    event_list['transport_time'] = now_millis
+    return json.dumps(event_list)
+
+
+@pytest.mark.parametrize('post_data', [_make_post_data(), _make_post_data(valid=False), '{"events": 1}'])
+def test_collect_same_response_as_flask(asgi_client, flask_client, post_data):
+    asgi_response = asgi_client.post('/', content=post_data, headers={'X-Real-IP': '192.0.2.1'})
+    flask_response = flask_client.post('/', data=post_data, headers={'X-Real-IP': '192.0.2.1'})
+    assert asgi_response.status_code == flask_response.status_code == 200
+    assert asgi_response.headers['content-type'] == 'application/json'
+    assert asgi_response.json() == json.loads(flask_response.data)
+
+
+def test_collect_cookie(asgi_client):
+    cookie_config = get_collector_config().cookie
+    response = asgi_client.post('/', content=_make_post_data())
+    assert response.json()['event_count'] == 1
+    if not cookie_config:
+        assert 'set-cookie' not in response.headers
+        return
+    cookie_id = response.cookies[cookie_config.name]
+    assert str(uuid.UUID(cookie_id)) == cookie_id
+
+    # the cookie is kept
+    asgi_client.cookies.set(cookie_config.name, cookie_id)
+    response = asgi_client.post('/', content=_make_post_data())
+    assert response.cookies[cookie_config.name] == cookie_id
+
+
+@pytest.mark.parametrize('path', ['/schema', '/jsonschema'])
+def test_schema_same_response_as_flask(asgi_client, flask_client, path):
+    asgi_response = asgi_client.get(path, headers={'Accept-Encoding': 'identity'})
+    flask_response = flask_client.get(path)
+    assert asgi_response.status_code == 200
+    assert asgi_response.text == flask_response.data.decode('utf-8')
+    assert asgi_response.headers['etag'] == flask_response.headers['ETag']
+
+
+def test_schema_not_modified(asgi_client):
+    response = asgi_client.get('/jsonschema', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['content-encoding'] == 'gzip'
+    response = asgi_client.get('/jsonschema', headers={'Accept-Encoding': 'gzip',
+                                                       'If-None-Match': response.headers['etag']})
+    assert response.status_code == 304
+    assert response.content == b''
+
+
+def test_cors(asgi_client):
+    response = asgi_client.options('/', headers={'Origin': 'https://objectiv.io',
+                                                 'Access-Control-Request-Method': 'POST'})
+    assert response.status_code == 200
+    assert response.headers['access-control-allow-origin'] == 'https://objectiv.io'
+    assert response.headers['access-control-allow-credentials'] == 'true'
@@ -0,0 +1,93 @@
+"""
+Copyright 2022 Objectiv B.V.
+"""
+import threading
+import time
+
+import pytest
+
+from objectiv_backend.common import config
+from objectiv_backend.common.config import BufferConfig, get_config_buffer
+from objectiv_backend.end_points.event_buffer import EventBuffer
+
+
+class _RecordingWriter:
+    """ Write function that records the batches, and optionally blocks until released. """
+
+    def __init__(self, block: bool = False):
+        self.batches = []
+        self.release = threading.Event()
+        if not block:
+            self.release.set()
+
+    def __call__(self, ok_events, nok_events, event_errors):
+        self.release.wait(timeout=5)
+        self.batches.append((ok_events, nok_events, event_errors))
+
+
+def _events(count: int, prefix: str = 'e'):
+    return [{'id': f'{prefix}{i}'} for i in range(count)]
+
+
+def test_flush_on_event_count():
+    writer = _RecordingWriter()
+    buffer = EventBuffer(writer, BufferConfig(max_events=100, flush_events=5, flush_interval_seconds=60))
+    assert buffer.add(_events(3))
+    assert buffer.add(_events(1, 'x'), nok_events=_events(1, 'n'), event_errors=['error'])
+    deadline = time.monotonic() + 5
+    while not writer.batches and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert writer.batches == [(_events(3) + _events(1, 'x'), _events(1, 'n'), ['error'])]
+    buffer.close()
+
+
+def test_flush_on_interval():
+    writer = _RecordingWriter()
+    buffer = EventBuffer(writer, BufferConfig(max_events=100, flush_events=50, flush_interval_seconds=0.05))
+    start = time.monotonic()
+    assert buffer.add(_events(2))
+    while not writer.batches and time.monotonic() - start < 5:
+        time.sleep(0.01)
+    assert time.monotonic() - start >= 0.05
+    assert writer.batches == [(_events(2), [], [])]
+    buffer.close()
+
+
+def test_flush_and_close():
+    writer = _RecordingWriter()
+    buffer = EventBuffer(writer, BufferConfig(max_events=100, flush_events=50, flush_interval_seconds=60))
+    assert buffer.flush(timeout=1)
+    assert buffer.add(_events(2))
+    assert buffer.flush(timeout=1)
+    assert writer.batches == [(_events(2), [], [])]
+
+    assert buffer.add(_events(1, 'x'))
+    buffer.close(timeout=1)
+    assert writer.batches[-1] == (_events(1, 'x'), [], [])
+    # closed buffers refuse events
+    assert not buffer.add(_events(1))
+
+
+def test_backpressure():
+    writer = _RecordingWriter(block=True)
+    buffer = EventBuffer(writer, BufferConfig(max_events=10, flush_events=4, flush_interval_seconds=60))
+    assert buffer.add(_events(6))
+    # the 6 events are being written, which takes until the writer is released
+    assert buffer.add(_events(4))
+    assert not buffer.add(_events(1))
+    writer.release.set()
+    assert buffer.flush(timeout=5)
+    assert buffer.add(_events(10))
+    buffer.close(timeout=5)
+    assert sum(len(ok_events) for ok_events, _, _ in writer.batches) == 20
+
+
+def test_config_max_events(monkeypatch):
+    monkeypatch.setattr(config, '_BUFFER_ENABLED', True)
+    monkeypatch.setattr(config, '_BUFFER_FLUSH_EVENTS', 100)
+    monkeypatch.setattr(config, '_BUFFER_MAX_EVENTS', config.DATA_MAX_EVENT_COUNT)
+    assert get_config_buffer().max_events == config.DATA_MAX_EVENT_COUNT
+    # a request with the maximum number of events would never fit in the buffer
+    monkeypatch.setattr(config, '_BUFFER_MAX_EVENTS', config.DATA_MAX_EVENT_COUNT - 1)
+    with pytest.raises(ValueError, match='BUFFER_MAX_EVENTS must be at least 1000'):
+        get_config_buffer()
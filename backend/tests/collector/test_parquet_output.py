@@ -0,0 +1,119 @@
+"""
+Copyright 2022 Objectiv B.V.
+
+Tests for the Parquet output. Skipped if pyarrow is not installed.
+"""
+import json
+import os
+
+import pytest
+
+pyarrow_parquet = pytest.importorskip('pyarrow.parquet')
+pyarrow_dataset = pytest.importorskip('pyarrow.dataset')
+
+from objectiv_backend.common.config import ParquetOutputConfig, get_collector_config
+from objectiv_backend.end_points import extra_output, parquet_output
+from objectiv_backend.end_points.extra_output import write_data_to_parquet_if_configured
+from objectiv_backend.end_points.parquet_output import ParquetSink, PARQUET_SCHEMA, event_to_parquet_row, \
+    get_parquet_sink
+from objectiv_backend.schema.hydrate_events import hydrate_types_into_event
+
+# 2022-04-15T12:30:45Z and 2022-04-16T00:00:01Z
+TIME_DAY_1 = 1_650_025_845_000
+TIME_DAY_2 = 1_650_067_201_000
+
+COOKIE_ID = 'f31b3e0c-a7b5-4c3a-8b2e-5ae1b3e3d3d4'
+
+
+def _event(event_id: str, time: int):
+    event = {
+        '_type': 'PressEvent',
+        'id': event_id,
+        'time': time,
+        'location_stack': [
+            {'_type': 'RootLocationContext', 'id': 'home'},
+            {'_type': 'PressableContext', 'id': 'button'}
+        ],
+        'global_contexts': [
+            {'_type': 'ApplicationContext', 'id': 'app'},
+            {'_type': 'CookieIdContext', 'id': 'cookie_id', 'cookie_id': COOKIE_ID},
+            {'_type': 'LocaleContext', 'id': 'en', 'language_code': 'en', 'country_code': None}
+        ]
+    }
+    return hydrate_types_into_event(get_collector_config().event_schema, event)
+
+
+def _read_days(path) -> dict:
+    """ Read all Parquet files under path, give a dict: day partition to the sorted event ids """
+    result = {}
+    for day_directory in sorted(os.listdir(path)):
+        names = os.listdir(os.path.join(path, day_directory))
+        assert all(name.endswith('.parquet') for name in names)
+        table = pyarrow_parquet.read_table(os.path.join(path, day_directory))
+        result[day_directory] = sorted(table.column('event_id').to_pylist())
+    return result
+
+
+def test_event_to_parquet_row():
+    row = event_to_parquet_row(_event('e1', TIME_DAY_1))
+    assert row['event_id'] == 'e1'
+    assert row['moment'].isoformat() == '2022-04-15T12:30:45'
+    assert row['cookie_id'] == COOKIE_ID
+    assert row['_type'] == 'PressEvent'
+    assert 'InteractiveEvent' in row['_types']
+    assert row['properties'] == [('time', str(TIME_DAY_1))]
+    assert [context['id'] for context in row['location_stack']] == ['home', 'button']
+    locale = row['global_contexts'][2]
+    assert locale['_type'] == 'LocaleContext'
+    assert dict(locale['properties']) == {'language_code': '"en"', 'country_code': 'null'}
+
+
+def test_parquet_sink_partitions_by_day(tmp_path):
+    sink = ParquetSink(ParquetOutputConfig(path=str(tmp_path), max_events=3, max_seconds=60))
+    try:
+        sink.add([_event('e1', TIME_DAY_1), _event('e2', TIME_DAY_2)])
+        assert not os.path.exists(tmp_path / 'day=2022-04-15')
+        sink.add([_event('e3', TIME_DAY_1)])
+        assert sink.flush(timeout=5)
+    finally:
+        sink.close()
+    assert _read_days(tmp_path) == {'day=2022-04-15': ['e1', 'e3'], 'day=2022-04-16': ['e2']}
+
+    dataset = pyarrow_dataset.dataset(str(tmp_path), format='parquet', partitioning='hive')
+    table = dataset.to_table(columns=['event_id', 'day', 'cookie_id', 'global_contexts'],
+                             filter=pyarrow_dataset.field('event_id') == 'e2')
+    assert table.column('day').to_pylist() == ['2022-04-16']
+    assert table.column('cookie_id').to_pylist() == [COOKIE_ID]
+    global_contexts = table.column('global_contexts').to_pylist()[0]
+    assert [context['_type'] for context in global_contexts] == \
+        ['ApplicationContext', 'CookieIdContext', 'LocaleContext']
+    cookie_properties = dict(global_contexts[1]['properties'])
+    assert json.loads(cookie_properties['cookie_id']) == COOKIE_ID
+
+
+def test_parquet_sink_schema(tmp_path):
+    sink = ParquetSink(ParquetOutputConfig(path=str(tmp_path)))
+    sink.write_events([_event('e1', TIME_DAY_1)])
+    sink.close()
+    directory = tmp_path / 'day=2022-04-15'
+    names = os.listdir(directory)
+    assert len(names) == 1 and names[0].endswith(f'-{os.getpid()}-000001.parquet')
+    assert pyarrow_parquet.read_schema(directory / names[0]).equals(PARQUET_SCHEMA)
+
+
+def test_write_data_to_parquet(tmp_path, monkeypatch):
+    collector_config = get_collector_config()
+    parquet_config = ParquetOutputConfig(path=str(tmp_path), max_events=100, max_seconds=60)
+    collector_config = collector_config._replace(
+        output=collector_config.output._replace(parquet=parquet_config))
+    monkeypatch.setattr(extra_output, 'get_collector_config', lambda: collector_config)
+    # the module only imports the Parquet output if it is configured
+    monkeypatch.setattr(extra_output, 'get_parquet_sink', get_parquet_sink, raising=False)
+    monkeypatch.setattr(parquet_output, '_PARQUET_SINK', None)
+
+    write_data_to_parquet_if_configured([])
+    assert parquet_output._PARQUET_SINK is None
+    write_data_to_parquet_if_configured([_event('e1', TIME_DAY_1), _event('e2', TIME_DAY_1)])
+    sink = get_parquet_sink(parquet_config)
+    sink.close()
+    assert _read_days(tmp_path) == {'day=2022-04-15': ['e1', 'e2']}
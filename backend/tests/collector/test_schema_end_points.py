@@ -0,0 +1,89 @@
+"""
+Copyright 2022 Objectiv B.V.
+"""
+import gzip
+import json
+
+import pytest
+
+from objectiv_backend.app import create_app
+from objectiv_backend.common.config import get_collector_config
+from objectiv_backend.end_points import schema
+from objectiv_backend.end_points.schema import get_rendered_json_schema, get_rendered_schema, \
+    get_schema_response, render_body
+from objectiv_backend.schema.generate_json_schema import generate_json_schema
+
+
+@pytest.fixture
+def flask_client():
+    return create_app().test_client()
+
+
+@pytest.mark.parametrize('path', ['/schema', '/jsonschema'])
+def test_schema_etag(flask_client, path):
+    response = flask_client.get(path)
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == schema.SCHEMA_CACHE_CONTROL
+    assert 'Content-Encoding' not in response.headers
+    etag = response.headers['ETag']
+    assert etag.startswith('"') and etag.endswith('"')
+
+    response = flask_client.get(path, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+
+    response = flask_client.get(path, headers={'If-None-Match': f'"other", W/{etag}'})
+    assert response.status_code == 304
+
+    response = flask_client.get(path, headers={'If-None-Match': '"other"'})
+    assert response.status_code == 200
+    assert response.headers['ETag'] == etag
+
+
+def test_schema_bodies():
+    event_schema = get_collector_config().event_schema
+    rendered_schema = get_rendered_schema(event_schema)
+    assert rendered_schema.bodies['identity'] == str(event_schema).encode('utf-8')
+    assert json.loads(get_rendered_json_schema(event_schema).bodies['identity']) == \
+        generate_json_schema(event_schema)
+    # rendered once per schema object
+    assert get_rendered_schema(event_schema) is rendered_schema
+
+
+def test_schema_gzip(flask_client):
+    identity_response = flask_client.get('/jsonschema')
+    response = flask_client.get('/jsonschema', headers={'Accept-Encoding': 'gzip;q=1.0, br;q=0'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(response.data) == identity_response.data
+    assert response.headers['ETag'] != identity_response.headers['ETag']
+
+    response = flask_client.get('/jsonschema', headers={'Accept-Encoding': 'gzip',
+                                                        'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+
+
+def test_schema_response_encoding_negotiation(monkeypatch):
+    monkeypatch.setattr(schema, 'brotli', None)
+    rendered_body = render_body('{"a": 1}')
+    assert list(rendered_body.bodies) == ['gzip', 'identity']
+    for accept_encoding, expected in [(None, None),
+                                      ('', None),
+                                      ('deflate', None),
+                                      ('gzip;q=0', None),
+                                      ('GZIP', 'gzip'),
+                                      ('*', 'gzip'),
+                                      ('br, gzip;q=0.5', 'gzip')]:
+        response = get_schema_response(rendered_body, if_none_match=None, accept_encoding=accept_encoding)
+        assert response.headers.get('Content-Encoding') == expected
+
+
+def test_schema_response_brotli():
+    brotli = pytest.importorskip('brotli')
+    rendered_body = render_body('{"a": 1}')
+    response = get_schema_response(rendered_body, if_none_match=None, accept_encoding='gzip, br')
+    assert response.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(response.body) == b'{"a": 1}'
+    assert len({rendered_body.etags[encoding] for encoding in ['br', 'gzip', 'identity']}) == 3
@@ -0,0 +1,196 @@
+"""
+Copyright 2022 Objectiv B.V.
+
+Tests for the segment writer, and the file system and S3 outputs that use it. The S3 tests use moto, and
+are skipped if moto is not installed.
+"""
+import gzip
+import json
+import os
+import time
+from datetime import datetime
+
+import pytest
+
+from objectiv_backend.common.config import FileSystemOutputConfig, SegmentConfig, AwsOutputConfig, \
+    get_collector_config
+from objectiv_backend.end_points import extra_output
+from objectiv_backend.end_points.extra_output import events_to_json, rotate_segments, \
+    write_data_to_fs_if_configured, write_data_to_s3_if_configured
+from objectiv_backend.end_points.segment_writer import SegmentWriter
+
+MOMENT = datetime(2022, 4, 15, 12, 30, 45)
+
+
+def _decompress(path: str, name: str = None) -> bytes:
+    """ Decompress a segment file, the compression is determined by name, or path if not set. """
+    name = name or path
+    with open(path, 'rb') as f:
+        data = f.read()
+    if name.endswith('.gz'):
+        return gzip.decompress(data)
+    if name.endswith('.zst'):
+        zstandard = pytest.importorskip('zstandard')
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+
+class _Published:
+    def __init__(self):
+        self.segments = []
+
+    def __call__(self, path: str, name: str, moment: datetime):
+        self.segments.append((name, _decompress(path, name)))
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'zstd', 'none'])
+def test_segment_writer_rotates_by_size(tmp_path, compression):
+    if compression == 'zstd':
+        pytest.importorskip('zstandard')
+    published = _Published()
+    writer = SegmentWriter(directory=str(tmp_path), publish=published,
+                           segment_config=SegmentConfig(compression=compression, max_bytes=10, max_seconds=60))
+    try:
+        writer.write('{"a":1}', MOMENT)
+        writer.write('{"b":2}\n', MOMENT)
+        writer.write('{"c":3}', MOMENT)
+        assert len(published.segments) == 1
+        writer.rotate()
+    finally:
+        writer.close()
+    assert [data for _, data in published.segments] == [b'{"a":1}\n{"b":2}\n', b'{"c":3}\n']
+    names = [name for name, _ in published.segments]
+    extension = {'gzip': '.json.gz', 'zstd': '.json.zst', 'none': '.json'}[compression]
+    assert names[0].startswith(f'20220415T123045-') and names[0].endswith(f'-{os.getpid()}-000001{extension}')
+    assert names[1].endswith(f'-{os.getpid()}-000002{extension}')
+    # published segments are not removed by the writer, only temporary files are left in the directory
+    assert all(name.startswith('.') and name.endswith('.tmp') for name in os.listdir(tmp_path))
+
+
+def test_segment_writer_rotates_by_age(tmp_path):
+    published = _Published()
+    writer = SegmentWriter(directory=str(tmp_path), publish=published,
+                           segment_config=SegmentConfig(max_bytes=1000, max_seconds=0.05))
+    try:
+        writer.write('{"a":1}', MOMENT)
+        start = time.time()
+        while not published.segments and time.time() - start < 5:
+            time.sleep(0.01)
+        assert [data for _, data in published.segments] == [b'{"a":1}\n']
+    finally:
+        writer.close()
+    with pytest.raises(ValueError):
+        writer.write('{"b":2}', MOMENT)
+
+
+@pytest.fixture
+def segment_writers():
+    yield
+    for writer in extra_output._SEGMENT_WRITERS.values():
+        writer.close()
+    extra_output._SEGMENT_WRITERS.clear()
+
+
+def _patch_output_config(monkeypatch, **outputs):
+    collector_config = get_collector_config()
+    collector_config = collector_config._replace(output=collector_config.output._replace(**outputs))
+    monkeypatch.setattr(extra_output, 'get_collector_config', lambda: collector_config)
+
+
+def test_write_data_to_fs(tmp_path, monkeypatch, segment_writers):
+    _patch_output_config(monkeypatch, file_system=FileSystemOutputConfig(path=str(tmp_path)))
+    events = [{'id': '1'}, {'id': '2', 'value': 'ë'}]
+    write_data_to_fs_if_configured(data=events_to_json(events), prefix='OK', moment=MOMENT)
+    write_data_to_fs_if_configured(data=events_to_json(events[:1]), prefix='OK', moment=MOMENT)
+    assert [name for name in os.listdir(tmp_path / 'OK') if not name.startswith('.')] == []
+
+    rotate_segments()
+    names = os.listdir(tmp_path / 'OK')
+    assert len(names) == 1 and names[0].endswith('.json.gz')
+    lines = _decompress(str(tmp_path / 'OK' / names[0])).decode('utf-8').splitlines()
+    assert [json.loads(line) for line in lines] == events + events[:1]
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    moto = pytest.importorskip('moto')
+    import boto3
+    import boto3.exceptions
+    import boto3.s3.transfer
+    import botocore.exceptions
+    # the module only imports boto3 if the S3 output is configured
+    monkeypatch.setattr(extra_output, 'boto3', boto3, raising=False)
+    monkeypatch.setattr(extra_output, 'TransferConfig', boto3.s3.transfer.TransferConfig, raising=False)
+    monkeypatch.setattr(extra_output, 'S3UploadFailedError', boto3.exceptions.S3UploadFailedError,
+                        raising=False)
+    monkeypatch.setattr(extra_output, 'ClientError', botocore.exceptions.ClientError, raising=False)
+    with moto.mock_aws():
+        extra_output._get_s3_client.cache_clear()
+        client = boto3.client('s3', region_name='eu-west-1')
+        client.create_bucket(Bucket='bucket', CreateBucketConfiguration={'LocationConstraint': 'eu-west-1'})
+        yield client
+    extra_output._get_s3_client.cache_clear()
+
+
+@pytest.fixture
+def s3_spool_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(extra_output, 'S3_SPOOL_DIRECTORY', str(tmp_path))
+    return tmp_path
+
+
+def test_write_data_to_s3(s3, monkeypatch, segment_writers, s3_spool_directory):
+    # moto requires parts of at least 5MB
+    monkeypatch.setattr(extra_output, 'S3_MULTIPART_THRESHOLD', 5 * 1024 * 1024)
+    monkeypatch.setattr(extra_output, 'S3_MULTIPART_CHUNKSIZE', 5 * 1024 * 1024)
+    aws_config = AwsOutputConfig(access_key_id='testing', secret_access_key='testing', region='eu-west-1',
+                                 bucket='bucket', s3_prefix='prefix',
+                                 segment=SegmentConfig(compression='none', max_bytes=11 * 1024 * 1024))
+    _patch_output_config(monkeypatch, aws=aws_config)
+
+    data = events_to_json([{'id': str(i), 'padding': 'x' * 1000} for i in range(6000)])
+    write_data_to_s3_if_configured(data=data, prefix='RAW', moment=MOMENT)
+    write_data_to_s3_if_configured(data=data, prefix='RAW', moment=MOMENT)
+    write_data_to_s3_if_configured(data='{"id":"last"}', prefix='RAW', moment=MOMENT)
+    rotate_segments()
+    # the client is reused
+    assert extra_output._get_s3_client.cache_info().currsize == 1
+
+    objects = sorted(s3.list_objects_v2(Bucket='bucket')['Contents'], key=lambda o: o['Key'])
+    assert [o['Key'].rsplit('-', 1)[1] for o in objects] == ['000001.json', '000002.json']
+    assert all(o['Key'].startswith('prefix/2022/04/15/RAW/20220415T123045-') for o in objects)
+    # the first segment is large enough for a multipart upload
+    assert s3.head_object(Bucket='bucket', Key=objects[0]['Key'])['ETag'].endswith('-3"')
+    body = s3.get_object(Bucket='bucket', Key=objects[0]['Key'])['Body'].read()
+    assert body == (data + '\n' + data + '\n').encode('utf-8')
+    # uploaded segments are removed locally
+    writer = extra_output._SEGMENT_WRITERS[('aws', 'RAW')]
+    assert os.listdir(writer.directory) == []
+
+
+def test_write_data_to_s3_upload_failure(s3, monkeypatch, segment_writers, s3_spool_directory):
+    aws_config = AwsOutputConfig(access_key_id='testing', secret_access_key='testing', region='eu-west-1',
+                                 bucket='other-bucket', s3_prefix='prefix',
+                                 segment=SegmentConfig(compression='none'))
+    _patch_output_config(monkeypatch, aws=aws_config)
+    (s3_spool_directory / 'RAW').mkdir()
+    # left behind by a process that was killed while writing it
+    (s3_spool_directory / 'RAW' / '.20220415T120000-host-1-000001.json.tmp').write_bytes(b'{"id":"0"}')
+
+    # the bucket doesn't exist, the segment is kept under its own name
+    write_data_to_s3_if_configured(data='{"id":"1"}', prefix='RAW', moment=MOMENT)
+    rotate_segments()
+    names = sorted(os.listdir(s3_spool_directory / 'RAW'))
+    assert len(names) == 2 and names[0] == '.20220415T120000-host-1-000001.json.tmp'
+    assert names[1].startswith('20220415T123045-') and names[1].endswith('-000001.json')
+
+    # a new writer for the prefix, e.g. after a restart, uploads it
+    s3.create_bucket(Bucket='other-bucket', CreateBucketConfiguration={'LocationConstraint': 'eu-west-1'})
+    extra_output._SEGMENT_WRITERS.pop(('aws', 'RAW')).close()
+    write_data_to_s3_if_configured(data='{"id":"2"}', prefix='RAW', moment=MOMENT)
+    deadline = time.monotonic() + 10
+    while names[1] in os.listdir(s3_spool_directory / 'RAW') and time.monotonic() < deadline:
+        time.sleep(0.05)
+    objects = s3.list_objects_v2(Bucket='other-bucket')['Contents']
+    assert [o['Key'] for o in objects] == [f'prefix/2022/04/15/RAW/{names[1]}']
+    assert s3.get_object(Bucket='other-bucket', Key=objects[0]['Key'])['Body'].read() == b'{"id":"1"}\n'
+    assert names[0] in os.listdir(s3_spool_directory / 'RAW')
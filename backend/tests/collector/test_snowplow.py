@@ -3,7 +3,8 @@ import jsonschema
 import base64
 from objectiv_backend.snowplow.schema.ttypes import CollectorPayload
 from objectiv_backend.snowplow.snowplow_helper import make_snowplow_custom_context, \
-    objectiv_event_to_snowplow, objectiv_event_to_snowplow_payload, snowplow_schema_violation_json
+    objectiv_event_to_snowplow, objectiv_event_to_snowplow_payload, snowplow_schema_violation_json, \
+    _objectiv_event_to_snowplow_payload, index_event_errors
 from tests.schema.test_schema import CLICK_EVENT_JSON, make_event_from_dict
 from objectiv_backend.common.config import SnowplowConfig
 from objectiv_backend.schema.validate_events import EventError, ErrorInfo
@@ -99,3 +100,24 @@ def test_snowplow_failed_event():
         instance = violation['data']
 
         jsonschema.validate(instance=instance, schema=schema,)
+
+
+def test_snowplow_failed_event_reuse_payload_data():
+    event_error = EventError(event_id=event['id'], error_info=[ErrorInfo(data=[], info='test')])
+    payload, payload_data, objectiv_event = _objectiv_event_to_snowplow_payload(event=event, config=config)
+
+    decoded = snowplow_schema_violation_json(payload=payload, config=config, event_error=event_error)
+    reused = snowplow_schema_violation_json(payload=payload, config=config, event_error=event_error,
+                                            payload_data=payload_data, objectiv_event=objectiv_event)
+    # the failure timestamp is the current time
+    del decoded['data']['failure']['timestamp']
+    del reused['data']['failure']['timestamp']
+    assert json.loads(json.dumps(reused)) == decoded
+
+
+def test_index_event_errors():
+    first = EventError(event_id='a', error_info=[ErrorInfo(data=[], info='first')])
+    last = EventError(event_id='a', error_info=[ErrorInfo(data=[], info='last')])
+    other = EventError(event_id='b', error_info=[])
+    assert index_event_errors(None) == {}
+    assert index_event_errors([first, other, last]) == {'a': last, 'b': other}
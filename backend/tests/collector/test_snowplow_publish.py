@@ -0,0 +1,132 @@
+"""
+Copyright 2022 Objectiv B.V.
+
+Tests for publishing events to the Snowplow pipelines. The AWS tests use moto, and are skipped if moto is
+not installed.
+"""
+import base64
+import json
+import uuid
+from concurrent.futures import Future
+
+import pytest
+
+from objectiv_backend.snowplow import snowplow_helper
+from objectiv_backend.snowplow.snowplow_helper import write_data_to_aws_pipeline, write_data_to_gcp_pubsub
+from tests.collector.test_snowplow import config
+from tests.schema.test_schema import CLICK_EVENT_JSON, make_event_from_dict
+
+
+def _make_events(count: int):
+    events = []
+    for _ in range(count):
+        event = make_event_from_dict(json.loads(CLICK_EVENT_JSON)['events'][0])
+        event['id'] = str(uuid.uuid4())
+        events.append(event)
+    return events
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    moto = pytest.importorskip('moto')
+    import boto3
+    import botocore.exceptions
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'eu-west-1')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    # the module only imports boto3 if the AWS pipeline is configured
+    monkeypatch.setattr(snowplow_helper, 'boto3', boto3, raising=False)
+    monkeypatch.setattr(snowplow_helper, 'botocore', botocore, raising=False)
+    monkeypatch.setattr(snowplow_helper, 'RETRY_WAIT_SECONDS', 0)
+    with moto.mock_aws():
+        snowplow_helper._get_aws_client.cache_clear()
+        yield boto3
+    snowplow_helper._get_aws_client.cache_clear()
+
+
+def test_write_data_to_kinesis(aws):
+    kinesis = aws.client('kinesis')
+    kinesis.create_stream(StreamName='bad', ShardCount=1)
+    shard_iterator = kinesis.get_shard_iterator(
+        StreamName='bad', ShardId='shardId-000000000000', ShardIteratorType='TRIM_HORIZON')['ShardIterator']
+
+    events = _make_events(1201)
+    write_data_to_aws_pipeline(events=events, config=config._replace(aws_message_topic_bad='bad'), good=False)
+    # the client is reused
+    assert snowplow_helper._get_aws_client.cache_info().currsize == 1
+
+    records = kinesis.get_records(ShardIterator=shard_iterator, Limit=10000)['Records']
+    parameters = [json.loads(record['Data'])['data']['payload']['raw']['parameters'] for record in records]
+    event_ids = [parameter['value'] for record_parameters in parameters for parameter in record_parameters
+                 if parameter['name'] == 'eid']
+    assert event_ids == [event['id'] for event in events]
+
+
+def test_write_data_to_kinesis_retry(monkeypatch):
+    calls = []
+
+    class _Client:
+        def put_records(self, StreamName, Records):
+            calls.append(len(Records))
+            # the first record fails on the first attempt
+            return {'Records': [{'ErrorCode': 'ProvisionedThroughputExceededException'} if len(calls) == 1 and i == 0
+                                else {'SequenceNumber': '1'} for i in range(len(Records))]}
+
+    monkeypatch.setattr(snowplow_helper, '_get_aws_client', lambda client_type, pid: _Client())
+    monkeypatch.setattr(snowplow_helper, 'RETRY_WAIT_SECONDS', 0)
+    write_data_to_aws_pipeline(events=_make_events(3), config=config._replace(aws_message_topic_bad='bad'),
+                               good=False)
+    assert calls == [3, 1]
+
+
+def test_write_data_to_sqs(aws):
+    sqs = aws.client('sqs')
+    queue_url = sqs.create_queue(QueueName='raw')['QueueUrl']
+
+    events = _make_events(25)
+    sqs_config = config._replace(aws_message_topic_raw=queue_url, aws_message_raw_type='sqs')
+    write_data_to_aws_pipeline(events=events, config=sqs_config, good=True)
+
+    messages = []
+    while True:
+        received = sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10,
+                                       MessageAttributeNames=['All']).get('Messages', [])
+        if not received:
+            break
+        messages.extend(received)
+    assert len(messages) == 25
+    assert all(message['MessageAttributes']['kinesisKey']['StringValue'] == 'event_id' for message in messages)
+    # the message is a base64 encoded thrift CollectorPayload, that contains the event id
+    payloads = [base64.b64decode(message['Body']) for message in messages]
+    for event in events:
+        assert sum(event['id'].encode('utf-8') in payload for payload in payloads) == 1
+
+
+class _FakePublisher:
+    """ Publisher that fails every message the first time it's published. """
+
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic_path, data):
+        future: Future = Future()
+        if data in self.published:
+            future.set_result('message-id')
+        else:
+            future.set_exception(Exception('temporarily unavailable'))
+        self.published.append(data)
+        return future
+
+
+def test_write_data_to_gcp_pubsub(monkeypatch):
+    publisher = _FakePublisher()
+    monkeypatch.setattr(snowplow_helper, '_get_pubsub_publisher', lambda pid: publisher)
+    monkeypatch.setattr(snowplow_helper, 'NotFound', LookupError, raising=False)
+    monkeypatch.setattr(snowplow_helper, 'RETRY_WAIT_SECONDS', 0)
+
+    events = _make_events(3)
+    write_data_to_gcp_pubsub(events=events, config=config._replace(gcp_project='p', gcp_pubsub_topic_bad='bad'),
+                             good=False)
+    # every message was published twice: once failed, and once retried successfully
+    assert len(publisher.published) == 6
+    assert publisher.published[:3] == publisher.published[3:]
@@ -0,0 +1,140 @@
+import threading
+
+import pytest
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+from psycopg2.pool import PoolError
+
+from objectiv_backend.common import db
+from objectiv_backend.common.config import PostgresConfig
+from objectiv_backend.common.db import ConnectionPool, get_connection_pool
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.status = TRANSACTION_STATUS_IDLE
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.status = TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def fake_connections(monkeypatch):
+    opened = []
+
+    def _get_db_connection(pg_config):
+        connection = FakeConnection()
+        opened.append(connection)
+        return connection
+
+    monkeypatch.setattr(db, 'get_db_connection', _get_db_connection)
+    return opened
+
+
+def _pg_config(**kwargs) -> PostgresConfig:
+    return PostgresConfig(hostname='localhost', port=5432, database_name='objectiv', user='objectiv',
+                          password='', **kwargs)
+
+
+def test_pool_reuses_connections(fake_connections):
+    pool = ConnectionPool(_pg_config(pool_min_size=1, pool_max_size=2))
+    assert len(fake_connections) == 1
+
+    with pool.connection() as connection:
+        assert connection is fake_connections[0]
+    with pool.connection() as connection:
+        assert connection is fake_connections[0]
+    assert len(fake_connections) == 1
+
+    stats = pool.get_stats()
+    assert stats.checkouts == 2
+    assert stats.size == 1
+    assert stats.idle == 1
+
+
+def test_pool_max_size_and_timeout(fake_connections):
+    pool = ConnectionPool(_pg_config(pool_max_size=2, pool_timeout=0.05))
+    connection_1 = pool.get_connection()
+    connection_2 = pool.get_connection()
+    assert connection_1 is not connection_2
+    with pytest.raises(PoolError):
+        pool.get_connection()
+
+
+def test_pool_waits_for_connection(fake_connections):
+    pool = ConnectionPool(_pg_config(pool_max_size=1, pool_timeout=5))
+    connection = pool.get_connection()
+
+    # a connection that is returned while waiting is handed out to the waiting caller
+    timer = threading.Timer(0.01, pool.put_connection, args=(connection,))
+    timer.start()
+    assert pool.get_connection() is connection
+    timer.join()
+    assert len(fake_connections) == 1
+    assert pool.get_stats().max_wait_seconds > 0
+
+
+def test_pool_discards_broken_connections(fake_connections):
+    pool = ConnectionPool(_pg_config(pool_max_size=1))
+    connection = pool.get_connection()
+    connection.closed = 2
+    pool.put_connection(connection)
+    assert pool.get_stats().size == 0
+
+    new_connection = pool.get_connection()
+    assert new_connection is not connection
+
+
+def test_pool_rolls_back_open_transaction(fake_connections):
+    pool = ConnectionPool(_pg_config(pool_max_size=1))
+    connection = pool.get_connection()
+    connection.status = TRANSACTION_STATUS_INTRANS
+    pool.put_connection(connection)
+    assert connection.status == TRANSACTION_STATUS_IDLE
+    assert pool.get_connection() is connection
+
+
+def test_get_connection_pool_after_fork(fake_connections, monkeypatch):
+    pg_config = _pg_config()
+    pool = get_connection_pool(pg_config)
+    assert get_connection_pool(pg_config) is pool
+
+    # simulate being in a forked child process
+    monkeypatch.setattr(pool, 'pid', -1)
+    assert get_connection_pool(pg_config) is not pool
+
+
+def test_pool_close_all(fake_connections):
+    pool = ConnectionPool(_pg_config(pool_min_size=1, pool_max_size=2))
+    idle_connection = fake_connections[0]
+    in_use_connection = pool.get_connection()
+    assert in_use_connection is idle_connection
+    other_connection = pool.get_connection()
+    pool.put_connection(other_connection)
+
+    pool.close_all()
+    assert other_connection.closed
+    assert not in_use_connection.closed
+    with pytest.raises(PoolError):
+        pool.get_connection()
+
+    # connections that were in use are closed when they are returned
+    pool.put_connection(in_use_connection)
+    assert in_use_connection.closed
+    assert pool.get_stats().size == 0
+
+
+def test_get_connection_pool_config_change(fake_connections):
+    pool = get_connection_pool(_pg_config(pool_min_size=1))
+    idle_connection = fake_connections[0]
+    new_pool = get_connection_pool(_pg_config(pool_min_size=1, pool_max_size=5))
+    assert new_pool is not pool
+    # the old pool is closed, and doesn't keep its idle connections open
+    assert idle_connection.closed
+    assert pool.get_stats().size == 0
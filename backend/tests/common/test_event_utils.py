@@ -0,0 +1,57 @@
+"""
+Copyright 2022 Objectiv B.V.
+"""
+import copy
+
+import pytest
+
+from objectiv_backend.common.config import get_collector_config
+from objectiv_backend.common.event_utils import add_global_context_to_event, get_context, \
+    get_contexts, get_optional_context
+from objectiv_backend.schema.hydrate_events import hydrate_types_into_event
+from objectiv_backend.schema.schema import HttpContext
+
+EVENT = {
+    '_type': 'PressEvent',
+    'id': 'a4d5d3a1-2e2b-4a3c-a1a6-1f2d7a6e6b40',
+    'time': 1630049334860,
+    'location_stack': [
+        {'_type': 'RootLocationContext', 'id': 'home'},
+        {'_type': 'NavigationContext', 'id': 'navigation'},
+        {'_type': 'PressableContext', 'id': 'open-drawer'}
+    ],
+    'global_contexts': [
+        {'_type': 'ApplicationContext', 'id': 'app'},
+        {'_type': 'PathContext', 'id': 'http://localhost/?utm_source=x'}
+    ]
+}
+
+@pytest.fixture
+def hydrated_event():
+    event = copy.deepcopy(EVENT)
+    return hydrate_types_into_event(get_collector_config().event_schema, event)
+
+
+def test_get_contexts(hydrated_event):
+    # parent types match all their children, global contexts first
+    assert [c['id'] for c in get_contexts(hydrated_event, 'AbstractContext')] == \
+        ['app', 'http://localhost/?utm_source=x', 'home', 'navigation', 'open-drawer']
+    assert get_contexts(hydrated_event, 'AbstractLocationContext') == hydrated_event['location_stack']
+    assert get_contexts(hydrated_event, 'PathContext') == [hydrated_event['global_contexts'][1]]
+    assert get_contexts(hydrated_event, 'HttpContext') == []
+
+
+def test_get_context(hydrated_event):
+    assert get_optional_context(hydrated_event, 'AbstractContext') == hydrated_event['global_contexts'][0]
+    assert get_context(hydrated_event, 'NavigationContext') == hydrated_event['location_stack'][1]
+    assert get_optional_context(hydrated_event, 'HttpContext') is None
+    with pytest.raises(ValueError):
+        get_context(hydrated_event, 'HttpContext')
+
+
+def test_add_global_context_to_event():
+    event = copy.deepcopy(EVENT)
+    http_context = HttpContext(id='http_context', referrer='', user_agent='', remote_address='127.0.0.1')
+    add_global_context_to_event(event, http_context)
+    assert event['global_contexts'][-1] == http_context
+    assert get_context(event, 'HttpContext') == http_context
@@ -0,0 +1,59 @@
+"""
+Copyright 2022 Objectiv B.V.
+"""
+import json
+from typing import NamedTuple
+
+import pytest
+
+from objectiv_backend.common import json_codec
+from objectiv_backend.common.json_codec import json_dumps, json_loads, json_dumps_list
+
+
+class _Point(NamedTuple):
+    x: int
+    y: int
+
+
+@pytest.fixture(params=['orjson', 'json'])
+def json_library(request, monkeypatch):
+    if request.param == 'json':
+        monkeypatch.setattr(json_codec, 'orjson', None)
+    elif json_codec.orjson is None:
+        pytest.skip('orjson is not installed')
+    return request.param
+
+
+def test_json_dumps(json_library):
+    data = {'id': 'ë', 'list': [1, 2.5, None, True], 'nested': {'a': 'tab\t'}}
+    expected_id = 'ë' if json_library == 'orjson' else '\\u00eb'
+    assert json_dumps(data) == f'{{"id":"{expected_id}","list":[1,2.5,null,true],"nested":{{"a":"tab\\t"}}}}'
+    # types that orjson doesn't support natively are serialized as the standard library would
+    assert json_dumps({'point': _Point(1, 2), 'big': 2 ** 70}) == f'{{"point":[1,2],"big":{2 ** 70}}}'
+    with pytest.raises(TypeError):
+        json_dumps({'set': {1}})
+
+
+def test_json_loads(json_library):
+    data = {'id': 'ë', 'list': [1, 2.5, None, True]}
+    assert json_loads(json.dumps(data)) == data
+    assert json_loads(json.dumps(data).encode('utf-8')) == data
+    with pytest.raises(ValueError):
+        json_loads(b'{"id": ')
+
+
+def test_json_dumps_list(json_library):
+    events = [{'id': 1}, {'id': 2}]
+    assert json_loads(json_dumps_list([json_dumps(event) for event in events])) == events
+    assert json_dumps_list([]) == '[]'
+
+
+def test_lone_surrogates(json_library):
+    # Accepted by the standard library, so always accepted by the collector
+    data = json_loads(b'{"id": "\\ud800"}')
+    assert data == {'id': '\ud800'}
+    serialized = json_dumps(data)
+    assert serialized == '{"id":"\\ud800"}'
+    # Can be written to the database
+    serialized.encode('utf-8')
+    assert json_loads(serialized) == data
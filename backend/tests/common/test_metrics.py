@@ -0,0 +1,80 @@
+"""
+Copyright 2022 Objectiv B.V.
+
+Tests for the metrics, and the /metrics end point. Skipped if prometheus_client is not installed.
+"""
+import json
+import time
+import uuid
+
+import pytest
+
+pytest.importorskip('prometheus_client')
+
+from objectiv_backend.app import create_app
+from objectiv_backend.common import config
+from objectiv_backend.common.config import init_collector_config
+from objectiv_backend.common.metrics import COLLECTOR_STAGE_SECONDS, _NoopMetric, render_metrics, timed
+from tests.schema.test_schema import CLICK_EVENT_JSON
+
+
+def _get_sample(name: str, **labels) -> float:
+    """ Give the value of a sample from the rendered metrics, 0 if there is no such sample. """
+    from prometheus_client.parser import text_string_to_metric_families
+    body, _ = render_metrics()
+    for family in text_string_to_metric_families(body.decode('utf-8')):
+        for sample in family.samples:
+            if sample.name == name and all(sample.labels.get(key) == value for key, value in labels.items()):
+                return sample.value
+    return 0
+
+
+@pytest.fixture
+def metrics_client(monkeypatch):
+    monkeypatch.setattr(config, '_METRICS_ENABLED', True)
+    yield create_app().test_client()
+    monkeypatch.undo()
+    init_collector_config()
+
+
+def test_timed():
+    before = _get_sample('objectiv_collector_stage_seconds_count', stage='test')
+    with timed(COLLECTOR_STAGE_SECONDS.labels(stage='test')):
+        pass
+    with pytest.raises(ValueError):
+        with timed(COLLECTOR_STAGE_SECONDS.labels(stage='test')):
+            raise ValueError()
+    assert _get_sample('objectiv_collector_stage_seconds_count', stage='test') == before + 2
+
+
+def test_noop_metric():
+    metric = _NoopMetric()
+    metric.labels(stage='parse').observe(1)
+    metric.labels('ok').inc()
+    metric.set(3)
+    with timed(metric):
+        pass
+
+
+def test_metrics_end_point(metrics_client):
+    event_list = json.loads(CLICK_EVENT_JSON)
+    event_list['events'][0]['id'] = str(uuid.uuid4())
+    event_list['events'][0]['time'] = round(time.time() * 1000)
+    requests_before = _get_sample('objectiv_collector_requests_total', result='data_error')
+    events_before = _get_sample('objectiv_collector_request_events_count')
+
+    metrics_client.post('/', data=json.dumps(event_list), headers={'X-Real-IP': '192.0.2.1'})
+    metrics_client.post('/', data='{"events": 1}')
+
+    response = metrics_client.get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('text/plain')
+    body = response.data.decode('utf-8')
+    assert 'objectiv_collector_stage_seconds_bucket{le="0.001",stage="enrich"}' in body
+    assert _get_sample('objectiv_collector_requests_total', result='data_error') == requests_before + 1
+    assert _get_sample('objectiv_collector_request_events_count') == events_before + 1
+
+
+def test_metrics_end_point_disabled():
+    response = create_app().test_client().get('/metrics')
+    assert response.status_code == 404
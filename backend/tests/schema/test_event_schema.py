@@ -115,6 +115,17 @@ def test_all_parent_event_types():
         assert schema.get_all_parent_event_types(event_type) == expected
 
 
+def test_sorted_parent_event_types():
+    schema = _get_schema()
+    for event_type in schema.list_event_types():
+        sorted_types = schema.get_sorted_parent_event_types(event_type)
+        assert sorted_types == tuple(sorted(schema.get_all_parent_event_types(event_type)))
+        # pre-calculated: the same object is returned every time
+        assert schema.get_sorted_parent_event_types(event_type) is sorted_types
+    with pytest.raises(ValueError):
+        schema.get_sorted_parent_event_types('NonExistingEvent')
+
+
 def test_all_required_contexts_for_event():
     schema = _get_schema()
     event_to_contexts = {
@@ -170,6 +181,17 @@ def test_all_parent_context_types():
            {'BaseContext', 'OtherContext', 'ExtraContext'}
 
 
+def test_sorted_parent_context_types():
+    schema = _get_schema()
+    assert schema.get_sorted_parent_context_types('X') == ('X', )
+    for context_type in schema.list_context_types():
+        sorted_types = schema.get_sorted_parent_context_types(context_type)
+        assert sorted_types == tuple(sorted(schema.get_all_parent_context_types(context_type)))
+        assert schema.get_sorted_parent_context_types(context_type) is sorted_types
+    assert schema.get_sorted_parent_context_types('ExtraContext') == \
+           ('BaseContext', 'ExtraContext', 'OtherContext')
+
+
 def test_all_child_context_types():
     schema = _get_schema()
     assert schema.get_all_child_context_types('X') == set()
@@ -231,6 +253,30 @@ def test_optional_property():
     assert other_context['required'] == ['id', 'other_property']
 
 
+def test_get_context_validator():
+    schema = _get_schema()
+    assert schema.get_context_validator('X') is None
+
+    validator = schema.get_context_validator('ExtraContext')
+    assert validator.schema == schema.get_context_schema('ExtraContext')
+    # validators are compiled once, when the schema is created
+    assert validator is schema.get_context_validator('ExtraContext')
+
+    valid_context = {'id': 'x', 'extra_property': 'y', 'other_property': 1, 'optional_property': None}
+    assert validator.is_valid(valid_context)
+    assert not validator.is_valid({'id': 'x', 'extra_property': 'y'})
+
+
+def test_get_event_validator():
+    schema = _get_schema()
+    assert schema.get_event_validator('XEvent') is None
+
+    validator = schema.get_event_validator('GreatGrandChildEvent')
+    assert validator.schema == schema.get_event_schema('GreatGrandChildEvent')
+    assert validator is schema.get_event_validator('GreatGrandChildEvent')
+    assert validator.is_valid({})
+
+
 # ### Below are helper functions and test data
 def _get_schema() -> EventSchema:
 
@@ -94,6 +94,17 @@ def test_event_list_validates():
     assert(validate_structure_event_list(event_list) != [])
 
 
+def test_event_list_validation_does_not_modify_event_schema():
+    event_schema = get_collector_config().event_schema
+    schema_before = str(event_schema)
+
+    assert(validate_structure_event_list(json.loads(CLICK_EVENT_JSON)) == [])
+
+    assert str(event_schema) == schema_before
+    abstract_event_properties = event_schema.events.schema['AbstractEvent']['properties']
+    assert abstract_event_properties['location_stack']['items']['type'] == 'AbstractLocationContext'
+
+
 def test_make_content_context():
     content_context = {
         'id': 'content_id',
@@ -0,0 +1,31 @@
+"""
+Fixtures for tests that require a local Postgres database, initialized with objectiv-db-init. Tests that use
+these fixtures are skipped if the database is not available.
+"""
+import psycopg2
+import pytest
+
+from objectiv_backend.common.config import get_config_postgres
+from objectiv_backend.common.db import get_db_connection
+
+
+def _get_connection_or_skip():
+    try:
+        return get_db_connection(get_config_postgres())
+    except (psycopg2.OperationalError, TypeError):
+        pytest.skip('Postgres database is not available')
+
+
+@pytest.fixture
+def connection():
+    result = _get_connection_or_skip()
+    yield result
+    result.close()
+
+
+@pytest.fixture
+def connections():
+    result = [_get_connection_or_skip(), _get_connection_or_skip()]
+    yield result
+    for connection in result:
+        connection.close()
@@ -0,0 +1,120 @@
+"""
+Tests for the partitioned data table layout. The tests that require a local Postgres database create the
+layout in a separate schema, and roll back everything afterwards. See conftest.py
+"""
+import datetime
+import json
+import uuid
+
+import pytest
+
+from objectiv_backend.common.types import FailureReason
+from objectiv_backend.schema.schema import make_event_from_dict, CookieIdContext
+from objectiv_backend.tools.db_init.db_init import get_sql, _read_sql_file, get_create_partitions_sql
+from objectiv_backend.workers.pg_storage import insert_events_into_data, BULK_INSERT_MIN_EVENTS
+from tests.schema.test_schema import CLICK_EVENT_JSON
+
+_TEST_SCHEMA = 'test_db_init_partitioned'
+
+
+def test_get_sql():
+    sql = get_sql()
+    assert 'partition by range' not in sql
+    partitioned_sql = get_sql(partition_data_by_day=True, partition_days_ahead=3)
+    assert partitioned_sql.count('create table data (') == 1
+    assert 'partition by range(day)' in partitioned_sql
+    assert 'select create_data_partitions(current_date, current_date + 3);' in partitioned_sql
+    # only the data table is different
+    assert partitioned_sql.startswith(sql.split('create table data (')[0])
+    assert partitioned_sql.endswith(sql.split('create index on data(day);')[1])
+
+
+@pytest.fixture
+def partitioned_connection(connection):
+    """ Connection that has a partitioned data table in its search path, with partitions for -1 to +1 days """
+    with connection.cursor() as cursor:
+        cursor.execute(f'create schema {_TEST_SCHEMA}; set local search_path to {_TEST_SCHEMA}, public;')
+        cursor.execute(_read_sql_file('create_data_partitioned.sql'))
+        cursor.execute('select create_data_partitions(current_date - 1, current_date + 1)')
+    try:
+        yield connection
+    finally:
+        connection.rollback()
+
+
+def _make_events(count: int, day: datetime.date):
+    moment = datetime.datetime.combine(day, datetime.time(12), tzinfo=datetime.timezone.utc)
+    events = []
+    for _ in range(count):
+        event = make_event_from_dict(json.loads(CLICK_EVENT_JSON)['events'][0])
+        event['id'] = str(uuid.uuid4())
+        event['time'] = round(moment.timestamp() * 1000)
+        cookie_id = str(uuid.uuid4())
+        event['global_contexts'].append(CookieIdContext(id=cookie_id, cookie_id=cookie_id))
+        events.append(event)
+    return events
+
+
+def test_create_data_partitions(partitioned_connection):
+    today = datetime.date.today()
+    with partitioned_connection.cursor() as cursor:
+        cursor.execute(get_create_partitions_sql(days_ahead=2))
+        # only the partition for today + 2 is missing
+        assert cursor.fetchone()[0] == 1
+        cursor.execute('''
+            select child.relname
+            from pg_inherits
+            join pg_class parent on parent.oid = pg_inherits.inhparent
+            join pg_class child on child.oid = pg_inherits.inhrelid
+            join pg_namespace on pg_namespace.oid = parent.relnamespace
+            where parent.relname = 'data' and pg_namespace.nspname = %s
+            order by 1
+        ''', (_TEST_SCHEMA, ))
+        partitions = [row[0] for row in cursor.fetchall()]
+    expected_days = [today + datetime.timedelta(days=offset) for offset in range(-1, 3)]
+    assert partitions == [f'data_{day:%Y%m%d}' for day in expected_days] + ['data_default']
+
+
+@pytest.mark.parametrize('event_count', [2, BULK_INSERT_MIN_EVENTS])
+def test_insert_duplicates_over_partitions(partitioned_connection, event_count):
+    today = datetime.date.today()
+    events = _make_events(event_count, today)
+    # same event_ids, on days that are in another partition, and in the default partition
+    duplicates = [dict(event, time=other['time'])
+                  for event, other in zip(events[:2], _make_events(2, today + datetime.timedelta(days=1)))]
+    duplicates[1]['time'] = _make_events(1, today - datetime.timedelta(days=10))[0]['time']
+
+    insert_events_into_data(partitioned_connection, events)
+    insert_events_into_data(partitioned_connection, duplicates + _make_events(1, today))
+
+    with partitioned_connection.cursor() as cursor:
+        cursor.execute('select tableoid::regclass::text, count(*) from data group by 1 order by 1')
+        assert cursor.fetchall() == [(f'data_{today:%Y%m%d}', event_count + 1)]
+        cursor.execute('select event_id, reason from nok_data where event_id = any(%s::uuid[])',
+                       ([event['id'] for event in duplicates], ))
+        assert sorted((str(event_id), reason) for event_id, reason in cursor.fetchall()) == \
+            sorted((event['id'], FailureReason.DUPLICATE.value) for event in duplicates)
+
+
+def test_drop_data_partitions(partitioned_connection):
+    today = datetime.date.today()
+    old_events = _make_events(2, today - datetime.timedelta(days=1)) + \
+        _make_events(1, today - datetime.timedelta(days=10))
+    events = _make_events(2, today)
+    insert_events_into_data(partitioned_connection, old_events + events)
+
+    with partitioned_connection.cursor() as cursor:
+        cursor.execute('select drop_data_partitions(current_date)')
+        assert cursor.fetchone()[0] == 1
+        cursor.execute("select to_regclass(%s)", (f'data_{today - datetime.timedelta(days=1):%Y%m%d}', ))
+        assert cursor.fetchone()[0] is None
+        cursor.execute('select event_id::text from data order by 1')
+        assert [row[0] for row in cursor.fetchall()] == sorted(event['id'] for event in events)
+        cursor.execute('select event_id::text from data_event_id order by 1')
+        assert [row[0] for row in cursor.fetchall()] == sorted(event['id'] for event in events)
+
+    # the event_ids of the dropped data are no longer duplicates
+    insert_events_into_data(partitioned_connection, old_events)
+    with partitioned_connection.cursor() as cursor:
+        cursor.execute('select count(*) from data')
+        assert cursor.fetchone()[0] == len(old_events) + len(events)
@@ -0,0 +1,41 @@
+"""
+Tests that require a local Postgres database, see conftest.py
+"""
+import time
+import uuid
+
+from objectiv_backend.workers.pg_queues import PostgresQueues, ProcessingStage
+
+
+def test_put_events_notifies_listeners(connections):
+    listen_connection, put_connection = connections
+    listener = PostgresQueues(connection=listen_connection)
+    listener.listen([ProcessingStage.FINALIZE])
+    # no events, so this times out
+    assert not listener.wait_for_events(timeout=0.01)
+
+    event = {'id': str(uuid.uuid4()), '_type': 'TestEvent'}
+    with put_connection:
+        PostgresQueues(connection=put_connection).put_events(queue=ProcessingStage.FINALIZE, events=[event])
+
+    start = time.time()
+    assert listener.wait_for_events(timeout=5)
+    assert time.time() - start < 1
+    # the notification is consumed
+    assert not listener.wait_for_events(timeout=0.01)
+
+    # clean up
+    with put_connection:
+        with put_connection.cursor() as cursor:
+            cursor.execute('delete from queue_finalize where event_id = %s', (event['id'],))
+
+
+def test_get_queue_size(connection):
+    pg_queues = PostgresQueues(connection=connection)
+    with connection:
+        size = pg_queues.get_queue_size(ProcessingStage.ENTRY)
+        events = [{'id': str(uuid.uuid4()), '_type': 'TestEvent'} for _ in range(3)]
+        pg_queues.put_events(queue=ProcessingStage.ENTRY, events=events)
+        assert pg_queues.get_queue_size(ProcessingStage.ENTRY) == size + 3
+        # don't leave the events on the queue
+        connection.rollback()
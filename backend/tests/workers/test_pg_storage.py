@@ -0,0 +1,50 @@
+"""
+Tests that require a local Postgres database, see conftest.py
+"""
+import json
+import uuid
+
+import pytest
+
+from objectiv_backend.common.types import FailureReason
+from objectiv_backend.schema.schema import make_event_from_dict, CookieIdContext
+from objectiv_backend.workers.pg_storage import insert_events_into_data, BULK_INSERT_MIN_EVENTS
+from tests.schema.test_schema import CLICK_EVENT_JSON
+
+
+def _make_events(count: int):
+    events = []
+    for _ in range(count):
+        event = make_event_from_dict(json.loads(CLICK_EVENT_JSON)['events'][0])
+        event['id'] = str(uuid.uuid4())
+        # characters that have a special meaning in the text format of COPY
+        cookie_id = str(uuid.uuid4())
+        event['global_contexts'].append(CookieIdContext(id='tab\t newline\n backslash\\', cookie_id=cookie_id))
+        events.append(event)
+    return events
+
+
+def _select_values(connection, table_name, events):
+    with connection.cursor() as cursor:
+        cursor.execute(f'select event_id, value from {table_name} where event_id = any(%s::uuid[])',
+                       ([event['id'] for event in events], ))
+        return {str(event_id): value for event_id, value in cursor.fetchall()}
+
+
+@pytest.mark.parametrize('event_count', [2, BULK_INSERT_MIN_EVENTS])
+def test_insert_events_into_data(connection, event_count):
+    events = _make_events(event_count)
+    duplicates = events[:1]
+    try:
+        insert_events_into_data(connection, duplicates)
+        insert_events_into_data(connection, events)
+
+        assert _select_values(connection, 'data', events) == {event['id']: event for event in events}
+        with connection.cursor() as cursor:
+            cursor.execute('select event_id, reason from nok_data where event_id = any(%s::uuid[])',
+                           ([event['id'] for event in events], ))
+            nok_rows = cursor.fetchall()
+        assert [(str(event_id), reason) for event_id, reason in nok_rows] == \
+               [(duplicates[0]['id'], FailureReason.DUPLICATE.value)]
+    finally:
+        connection.rollback()
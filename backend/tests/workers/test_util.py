@@ -0,0 +1,99 @@
+import multiprocessing
+import os
+import signal
+import time
+
+import pytest
+
+from objectiv_backend.common.config import WorkerConfig
+from objectiv_backend.workers import util
+
+
+class FakeConnection:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class StopWorker(Exception):
+    pass
+
+
+@pytest.fixture
+def fake_connection(monkeypatch):
+    connection = FakeConnection()
+    monkeypatch.setattr(util, 'get_db_connection', lambda pg_config: connection)
+    return connection
+
+
+_WORKER_CONFIG = WorkerConfig(batch_size=50, concurrency=1, min_sleep_seconds=0.1, max_sleep_seconds=0.5)
+
+
+def test_worker_main_once(fake_connection):
+    batch_sizes = []
+
+    def main_test(connection, batch_size):
+        assert connection is fake_connection
+        batch_sizes.append(batch_size)
+        return 42
+
+    assert util.worker_main(function=main_test, loop=False, worker_config=_WORKER_CONFIG) == 42
+    assert batch_sizes == [50]
+    assert fake_connection.closed
+
+
+def test_worker_main_adaptive_sleep(fake_connection, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(util.time, 'sleep', sleeps.append)
+    event_counts = [0, 0, 0, 0, 0, 10, 0, 0]
+
+    def main_test(connection, batch_size):
+        if not event_counts:
+            raise StopWorker()
+        return event_counts.pop(0)
+
+    with pytest.raises(StopWorker):
+        util.worker_main(function=main_test, loop=True, worker_config=_WORKER_CONFIG)
+    # sleep time doubles while there is no work, up to the maximum. It resets once there is work.
+    assert sleeps == [0.1, 0.2, 0.4, 0.5, 0.5, 0.1, 0.2]
+    assert fake_connection.closed
+
+
+_MULTI_PROCESS_CONFIG = _WORKER_CONFIG._replace(concurrency=3)
+
+
+def test_worker_main_processes(fake_connection):
+    def main_test(connection, batch_size):
+        return 42
+
+    assert util.worker_main(function=main_test, loop=False, worker_config=_MULTI_PROCESS_CONFIG) == 3 * 42
+
+
+def test_worker_main_processes_exception(fake_connection):
+    started = multiprocessing.Value('i', 0)
+
+    def main_test(connection, batch_size):
+        with started.get_lock():
+            started.value += 1
+            first = started.value == 1
+        if first:
+            raise StopWorker()
+        return 0
+
+    start = time.monotonic()
+    # a failing process stops the other processes, that would otherwise run forever
+    with pytest.raises(StopWorker):
+        util.worker_main(function=main_test, loop=True, worker_config=_MULTI_PROCESS_CONFIG)
+    assert time.monotonic() - start < 10
+    assert multiprocessing.active_children() == []
+
+
+def test_worker_main_processes_killed(fake_connection):
+    def main_test(connection, batch_size):
+        os.kill(os.getpid(), signal.SIGKILL)
+        return 0
+
+    with pytest.raises(Exception, match=f'exited with code -{signal.SIGKILL}'):
+        util.worker_main(function=main_test, loop=True, worker_config=_MULTI_PROCESS_CONFIG)
+    assert multiprocessing.active_children() == []
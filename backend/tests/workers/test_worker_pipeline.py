@@ -0,0 +1,49 @@
+"""
+Tests that require a local Postgres database, see conftest.py
+"""
+import json
+import time
+import uuid
+
+from objectiv_backend.schema.schema import make_event_from_dict, CookieIdContext
+from objectiv_backend.workers.pg_queues import PostgresQueues, ProcessingStage
+from objectiv_backend.workers.worker_pipeline import main_pipeline
+from tests.schema.test_schema import CLICK_EVENT_JSON
+
+
+def _make_event(valid: bool):
+    event = make_event_from_dict(json.loads(CLICK_EVENT_JSON)['events'][0])
+    event['id'] = str(uuid.uuid4())
+    event['time'] = round(time.time() * 1000)
+    cookie_id = str(uuid.uuid4())
+    event['global_contexts'].append(CookieIdContext(id=cookie_id, cookie_id=cookie_id))
+    if not valid:
+        event['_type'] = 'NonExistingEvent'
+    return event
+
+
+def _count(connection, table: str, event_id: str) -> int:
+    with connection.cursor() as cursor:
+        cursor.execute(f'select count(*) from {table} where event_id = %s', (event_id,))
+        return cursor.fetchone()[0]
+
+
+def test_main_pipeline(connection):
+    ok_event = _make_event(valid=True)
+    nok_event = _make_event(valid=False)
+    with connection:
+        PostgresQueues(connection=connection).put_events(queue=ProcessingStage.ENTRY,
+                                                         events=[ok_event, nok_event])
+    # other tests might have left events on the queue, so we process all there is
+    while main_pipeline(connection, batch_size=1000):
+        pass
+
+    with connection:
+        assert _count(connection, 'data', ok_event['id']) == 1
+        assert _count(connection, 'nok_data', ok_event['id']) == 0
+        assert _count(connection, 'nok_data', nok_event['id']) == 1
+        assert _count(connection, 'queue_finalize', ok_event['id']) == 0
+        for table in ('data', 'nok_data'):
+            with connection.cursor() as cursor:
+                cursor.execute(f'delete from {table} where event_id in (%s, %s)',
+                               (ok_event['id'], nok_event['id']))
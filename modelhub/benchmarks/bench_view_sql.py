@@ -0,0 +1,107 @@
+"""
+Copyright 2022 Objectiv B.V.
+
+Benchmark of generating the SQL of the DataFrame that ModelHub.get_objectiv_dataframe() returns: the graph
+of the extracted contexts, identity resolution and sessionized data pipelines, optionally with a DataFrame of
+all data merged in with from_pandas(), as done by e.g. ModelHub.map and ModelHub.aggregate when combining
+with local data.
+
+Compares the ways of splitting the SQL of every model into its CTEs:
+ * sqlparse: lex the full SQL of every model with sqlparse. This is how raw_sql_to_selects() worked before it
+   got its own scanner.
+ * scanner: raw_sql_to_selects(), which only scans the SQL up to the CTE boundaries, and falls back to
+   sqlparse for the SQL that it doesn't handle.
+
+No database is needed, the dtypes of the table are given instead of queried.
+
+Usage, from the modelhub directory:
+    PYTHONPATH=.:../bach python benchmarks/bench_view_sql.py [--rows 10000] [--repeat 3]
+"""
+import argparse
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+import pandas
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+
+import bach
+from bach.types import StructuredDtype
+from modelhub.pipelines import extracted_contexts
+from modelhub.pipelines.util import get_objectiv_data
+from sql_models import sql_generator
+from sql_models.constants import DBDialect
+from sql_models.sql_query_parser import CteTuple, raw_sql_to_selects, _raw_sql_to_selects_sqlparse
+
+DB_URL = 'postgresql://objectiv:@localhost:5432/objectiv'
+
+
+def _get_dtypes_from_table(engine: Engine, table_name: str) -> Dict[str, StructuredDtype]:
+    """ Give the dtypes of the columns that ExtractedContextsPipeline expects, instead of querying them. """
+    pipeline = extracted_contexts.ExtractedContextsPipeline
+    taxonomy_column = extracted_contexts._get_taxonomy_column_definition(engine)
+    return {
+        taxonomy_column.name: taxonomy_column.dtype,
+        **pipeline.required_context_columns_per_dialect[DBDialect.from_engine(engine)],
+    }
+
+
+def _get_pipeline_df(rows: int) -> bach.DataFrame:
+    """ Give the objectiv DataFrame, merged with a from_pandas() DataFrame of the given number of rows. """
+    engine = create_engine(DB_URL)
+    extracted_contexts.bach.from_database.get_dtypes_from_table = _get_dtypes_from_table  # type: ignore
+    df = get_objectiv_data(engine=engine, table_name='data', identity_resolution='email')
+    if rows:
+        pdf = pandas.DataFrame({
+            'session_id': range(rows),
+            'label': [f"label {i}, with (parentheses) and 'quotes'" for i in range(rows)],
+        })
+        labels = bach.DataFrame.from_pandas(engine=engine, df=pdf, convert_objects=True)
+        df = df.merge(labels, on='session_id', how='left')
+    return df
+
+
+def _run(
+    split_function: Callable[[str], List[CteTuple]],
+    df: bach.DataFrame,
+    repeat: int
+) -> Tuple[float, str]:
+    """
+    Generate the SQL of df with split_function, repeat times.
+    Return the seconds of the fastest run, and the SQL.
+    """
+    sql_generator.raw_sql_to_selects = split_function  # type: ignore
+    try:
+        best = float('inf')
+        sql = ''
+        for _ in range(repeat):
+            start = time.perf_counter()
+            sql = df.view_sql()
+            best = min(best, time.perf_counter() - start)
+        return best, sql
+    finally:
+        sql_generator.raw_sql_to_selects = raw_sql_to_selects  # type: ignore
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark SQL generation of the modelhub pipeline graph')
+    parser.add_argument('--rows', type=int, default=10_000,
+                        help='number of rows in the merged from_pandas() DataFrame, 0 to not merge')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs, the fastest run is reported')
+    args = parser.parse_args(sys.argv[1:])
+
+    df = _get_pipeline_df(args.rows)
+    results = {}
+    sqls = {}
+    for name, split_function in (('sqlparse', _raw_sql_to_selects_sqlparse), ('scanner', raw_sql_to_selects)):
+        results[name], sqls[name] = _run(split_function, df, args.repeat)
+        print(f'{name:>8}: {results[name] * 1000:10.1f} ms')
+    print(f'SQL of {len(sqls["scanner"]):,} characters')
+    print(f'speed-up: {results["sqlparse"] / results["scanner"]:.1f}x')
+    if sqls['sqlparse'] != sqls['scanner']:
+        raise Exception('sqlparse and scanner give different SQL')
+
+
+if __name__ == '__main__':
+    main()